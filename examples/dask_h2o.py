@@ -28,8 +28,11 @@ if __name__=="__main__":
     from pyqmc import EnergyAccumulator
     import pandas as pd
 
-    df,coords=distvmc(wf,pyqmc.initial_guess(mol,nconfig),client=client,nsteps_per=10,nsteps=10)
-    line_minimization(wf,coords,pyqmc.gradient_generator(mol,wf,["wf2acoeff", "wf2bcoeff"]),client=client)
+    # The walkers and a copy of wf stay on the workers; only parameters
+    # and averages are sent back and forth from here on.
+    coords = pyqmc.dasktools.DistributedWalkers(wf, pyqmc.initial_guess(mol, nconfig), client)
+    df,coords=distvmc(wf,coords,client=client,nsteps_per=10,nsteps=10)
+    line_minimization(wf,coords,pyqmc.gradient_generator(mol,wf,["wf2acoeff", "wf2bcoeff"]),client=client,hdf_file="linemin.hdf5")
     dfdmc, configs, weights = rundmc(
         wf,
         coords,
@@ -41,6 +44,5 @@ if __name__=="__main__":
         verbose=True,
         propagate=pyqmc.dasktools.distdmc_propagate,
         client=client,
+        hdf_file="dmc.hdf5",
     )
-
-    dfdmc = pd.DataFrame(dfdmc).to_json("dmc.json")
@@ -12,10 +12,13 @@ from pyqmc.func3d import (
     GaussianFunction,
     CutoffCuspFunction,
 )
-from pyqmc.optvariance import optvariance
+from pyqmc.optvariance import optvariance, minimize_variance
 from pyqmc.optsr import gradient_descent
 from pyqmc.linemin import line_minimization
+from pyqmc.optlinear import linear_method
+from pyqmc.optadam import adam_descent
 from pyqmc.dmc import rundmc
+from pyqmc.checkpoint import Checkpoint
 
 
 def slater_jastrow(mol, mf, abasis=None, bbasis=None):
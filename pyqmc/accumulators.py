@@ -1,24 +1,136 @@
 import numpy as np
-from pyqmc.energy import energy
+from pyqmc.energy import energy, OpenCoulomb
+from pyqmc.ewald import Ewald
+from pyqmc.multiplywf import recompute_parameters
+from pyqmc.linearjastrow import find_jastrow
+from pyqmc.coord import get_rng, get_rng_state, set_rng_state
+import pyqmc.eval_ecp as eval_ecp
+
+
+class SharedQuantities:
+    """Quantities that several accumulators use, computed at most once per step.
+
+    Accumulators that take part list the quantities they use in a `needs` attribute
+    and accept a `shared` keyword in __call__() and avg(); the drivers create one
+    SharedQuantities per step and pass it to all of them. Quantities are computed on
+    first use, so nothing is evaluated that no accumulator asks for.
+    """
+
+    def __init__(self, configs, wf):
+        self.configs = configs
+        self.wf = wf
+        self._cache = {}
+
+    def get(self, key, compute):
+        """Return the quantity stored under key, calling compute() the first time"""
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def gradients(self):
+        """(nelec, 3, nconf) array of wf.gradient() for each electron"""
+        return self.get("gradients", self._gradients)
+
+    def _gradients(self):
+        nelec = self.configs.configs.shape[1]
+        return np.array(
+            [self.wf.gradient(e, self.configs.electron(e)) for e in range(nelec)]
+        )
+
+    def pgradient(self):
+        return self.get("pgradient", self.wf.pgradient)
+
+    def result(self, accumulator):
+        """Per-configuration output of accumulator(configs, wf). The returned
+        dictionary is shared between consumers and must not be modified."""
+        return self.get(
+            ("result", id(accumulator)),
+            lambda: evaluate(accumulator, self.configs, self.wf, self),
+        )
+
+
+def split_interval(accumulator):
+    """Returns (accumulator, interval) for an entry of an accumulators dictionary.
+    An entry is either an accumulator or a tuple (accumulator, interval); otherwise the
+    interval attribute of the accumulator is used if it has one, and 1 if not. The
+    accumulator is then evaluated only on steps that are a multiple of interval."""
+    if isinstance(accumulator, tuple):
+        return accumulator
+    return accumulator, getattr(accumulator, "interval", 1)
+
+
+def walker_quantities(accumulators):
+    """Returns the per-walker quantities in the step data of an accumulators
+    dictionary, as a dictionary from the key (with the accumulator name prefixed) to
+    the number of final steps of a run it is kept for. Accumulators list these keys
+    in a walker_keys attribute, and give the number of steps as walker_steps.
+    Unlike the other quantities they are not averages over the walkers, so the
+    drivers concatenate them over partitions instead of averaging, and do not write
+    them to HDF5 files."""
+    keys = {}
+    for name, acc in accumulators.items():
+        acc = split_interval(acc)[0]
+        for k in getattr(acc, "walker_keys", ()):
+            keys[name + k] = acc.walker_steps
+    return keys
+
+
+def evaluate(accumulator, configs, wf, shared):
+    """accumulator(configs, wf), passing shared if the accumulator supports it"""
+    if hasattr(accumulator, "needs"):
+        return accumulator(configs, wf, shared=shared)
+    return accumulator(configs, wf)
+
+
+def average(accumulator, configs, wf, shared):
+    """accumulator.avg(configs, wf), passing shared if the accumulator supports it"""
+    if hasattr(accumulator, "needs"):
+        return accumulator.avg(configs, wf, shared=shared)
+    return accumulator.avg(configs, wf)
 
 
 class EnergyAccumulator:
     """returns energy of each configuration in a dictionary. 
-  Keys and their meanings can be found in energy.energy """
+  Keys and their meanings can be found in energy.energy 
 
-    def __init__(self, mol, threshold=10):
+  Everything that only depends on mol is computed once here: the ion charges,
+  positions and ion-ion energy are held by self.coulomb (OpenCoulomb or Ewald), and
+  the ECP functors, cutoffs and quadratures by self.ecp_species."""
+
+    needs = ("energy",)
+
+    def __init__(self, mol, threshold=10, ecp_tolerance=1e-8, naip=None):
         self.mol = mol
         self.threshold = threshold
+        self.ecp_species = eval_ecp.generate_ecp_species(mol, ecp_tolerance, naip)
+        self.coulomb = Ewald(mol) if hasattr(mol, "a") else OpenCoulomb(mol)
+        # Energy accumulators for the same system share their result within a step
+        if isinstance(naip, dict):
+            naip = tuple(sorted(naip.items()))
+        self._shared_key = ("energy", id(mol), threshold, ecp_tolerance, naip)
+
+    def __call__(self, configs, wf, shared=None):
+        if shared is None:
+            return self._energy(configs, wf)
+        return shared.get(self._shared_key, lambda: self._energy(configs, wf))
 
-    def __call__(self, configs, wf):
-        return energy(self.mol, configs, wf, self.threshold)
+    def _energy(self, configs, wf):
+        return energy(
+            self.mol, configs, wf, self.threshold, self.ecp_species, self.coulomb
+        )
 
-    def avg(self, configs, wf):
+    def avg(self, configs, wf, shared=None):
         d = {}
-        for k, it in self(configs, wf).items():
+        for k, it in self(configs, wf, shared).items():
             d[k] = np.mean(it, axis=0)
         return d
 
+    def nonlocal_tmoves(self, configs, wf, e, tau):
+        """T-move amplitudes and positions of electron e; see eval_ecp.ecp_tmoves"""
+        return eval_ecp.ecp_tmoves(
+            self.mol, configs, wf, e, self.threshold, tau, self.ecp_species
+        )
+
 
 class LinearTransform:
     """
@@ -46,7 +158,7 @@ class LinearTransform:
             mask = self.frozen[k]
             self.frozen_parms[k] = np.ma.array(parameters[k], mask=~mask)
 
-        self.shapes = np.array([parameters[k].shape for k in self.to_opt])
+        self.shapes = [parameters[k].shape for k in self.to_opt]
         self.slices = np.array([np.prod(s) for s in self.shapes])
 
     def serialize_parameters(self, parameters):
@@ -88,53 +200,190 @@ class LinearTransform:
 
 
 class PGradTransform:
-    """   """
+    """ 
+    Energy, parameter derivatives and the terms of the SR overlap matrix.
+
+    With matrix_free=True, the (nparam, nparam) matrix dpidpj is not accumulated.
+    Instead, avg() returns the derivatives of each walker as dpwalker, an
+    (nconf, nparam) array, and the optimizers build a linemin.SROperator from it.
+    dpwalker is a walker quantity (see walker_quantities()): vmc() keeps it only
+    for the last walker_steps steps of a run, so the memory and the data sent
+    back from the partitions are O(walker_steps * nconf * nparam) however many
+    steps are taken.
+    """
 
-    def __init__(self, enacc, transform, nodal_cutoff=1e-5):
+    needs = ("energy", "pgradient", "gradients")
+
+    def __init__(
+        self, enacc, transform, nodal_cutoff=1e-5, matrix_free=False, walker_steps=10
+    ):
         self.enacc = enacc
         self.transform = transform
         self.nodal_cutoff = nodal_cutoff
+        self.matrix_free = matrix_free
+        self.walker_steps = walker_steps
+
+    @property
+    def walker_keys(self):
+        return ("dpwalker",) if self.matrix_free else ()
 
-    def _node_cut(self, configs, wf):
+    def _node_cut(self, configs, wf, shared):
         """ Return true if a given configuration is within nodal_cutoff 
         of the node """
         ne = configs.configs.shape[1]
-        d2 = 0.0
-        for e in range(ne):
-            d2 += np.sum(wf.gradient(e, configs.electron(e)) ** 2, axis=0)
+        d2 = np.sum(shared.gradients() ** 2, axis=(0, 1))
         r = 1.0 / (d2 * ne * ne)
         return r < self.nodal_cutoff ** 2
 
-    def __call__(self, configs, wf):
-        pgrad = wf.pgradient()
-        d = self.enacc(configs, wf)
-        energy = d["total"]
-        dp = self.transform.serialize_gradients(pgrad)
-        node_cut = self._node_cut(configs, wf)
+    def _dp(self, configs, wf, shared):
+        """Serialized parameter derivatives, zeroed for walkers near the node"""
+        dp = self.transform.serialize_gradients(shared.pgradient())
+        node_cut = self._node_cut(configs, wf, shared)
         dp[node_cut, :] = 0.0
         # print('number cut off',np.sum(node_cut))
+        return dp
+
+    def __call__(self, configs, wf, shared=None):
+        if shared is None:
+            shared = SharedQuantities(configs, wf)
+        d = dict(shared.result(self.enacc))
+        energy = d["total"]
+        dp = self._dp(configs, wf, shared)
 
         d["dpH"] = np.einsum("i,ij->ij", energy, dp)
         d["dppsi"] = dp
-        d["dpidpj"] = np.einsum("ij,ik->ijk", dp, dp)
+        if not self.matrix_free:
+            d["dpidpj"] = np.einsum("ij,ik->ijk", dp, dp)
         return d
 
-    def avg(self, configs, wf):
+    def avg(self, configs, wf, shared=None):
+        if shared is None:
+            shared = SharedQuantities(configs, wf)
         nconf = configs.configs.shape[0]
-        pgrad = wf.pgradient()
-        den = self.enacc(configs, wf)
+        den = shared.result(self.enacc)
         energy = den["total"]
-        dp = self.transform.serialize_gradients(pgrad)
-
-        node_cut = self._node_cut(configs, wf)
-        dp[node_cut, :] = 0.0
-        # print('number cut off',np.sum(node_cut))
+        dp = self._dp(configs, wf, shared)
 
         d = {}
         for k, it in den.items():
             d[k] = np.mean(it, axis=0)
         d["dpH"] = np.einsum("i,ij->j", energy, dp) / nconf
         d["dppsi"] = np.mean(dp, axis=0)
-        d["dpidpj"] = np.einsum("ij,ik->jk", dp, dp) / nconf
+        if self.matrix_free:
+            d["dpwalker"] = dp
+        else:
+            d["dpidpj"] = np.einsum("ij,ik->jk", dp, dp) / nconf
+
+        return d
+
+
+class LinearMethodTransform(PGradTransform):
+    """
+    In addition to the PGradTransform quantities, accumulates the terms of the
+    Hamiltonian matrix of the linear method (see optlinear.linear_method()):
+
+      dpHdpj: <dp_i E_L dp_j>
+
+      dEdp: <dE_L/dp_j>
 
+      dpidEdpj: <dp_i dE_L/dp_j>
+
+    If all the parameters are coefficients of a JastrowSpin factor and the ECPs have
+    no nonlocal channels, dE_L/dp is evaluated analytically from the basis gradients
+    and laplacians of the Jastrow factor (see jastrow_energy_derivatives()).
+    Otherwise, the wave functions do not provide parameter derivatives of their
+    gradient and laplacian, so dE_L/dp is evaluated by forward finite differences of
+    the local energy, reusing the random state of the ECP quadrature so that the
+    differences are smooth. This costs one energy evaluation per parameter, and a
+    recompute of the factor of the wave function that the parameter belongs to;
+    set an interval (see split_interval()) to evaluate it only every few steps.
+    """
+
+    def __init__(self, enacc, transform, nodal_cutoff=1e-5, delta=1e-5):
+        super().__init__(enacc, transform, nodal_cutoff)
+        self.delta = delta
+
+    def _set_parameters(self, wf, x):
+        """Set the serialized parameters x and return the keys that changed"""
+        changed = []
+        for k, p in self.transform.deserialize(x).items():
+            if not np.array_equal(p, wf.parameters[k]):
+                changed.append(k)
+            wf.parameters[k] = p
+        return changed
+
+    def energy_derivatives(self, configs, wf, shared=None):
+        """Returns the (nconf, nparam) derivatives of the local energy, analytically
+        where possible and by finite differences otherwise"""
+        found = find_jastrow(wf, self.transform.to_opt)
+        species = getattr(self.enacc, "ecp_species", None)
+        if found is None or species is None:
+            return self.finite_difference_derivatives(configs, wf)
+        if any(len(sp["functors"]) > 1 for sp in species.values()):
+            return self.finite_difference_derivatives(configs, wf)
+        if shared is None:
+            shared = SharedQuantities(configs, wf)
+        jastrow, _, prefix = found
+        return self.jastrow_energy_derivatives(configs, shared, jastrow, prefix)
+
+    def jastrow_energy_derivatives(self, configs, shared, jastrow, prefix):
+        r"""Returns the (nconf, nparam) derivatives of the local energy with respect
+        to the coefficients c of the Jastrow factor jastrow of wf.
+
+        With $\Psi = D e^{U}$ and U linear in c, only the kinetic energy depends on
+        c, and $\partial_c T = -\sum_e \left[\frac{1}{2}\nabla_e^2 u
+        + \nabla_e \ln\Psi \cdot \nabla_e u\right]$, where u are the basis sums.
+        prefix is the prefix of the Jastrow coefficients in wf.parameters.
+        """
+        nconf, nelec = configs.configs.shape[:2]
+        grads = np.real(shared.gradients())
+        dke = {k: np.zeros((nconf,) + p.shape) for k, p in jastrow.parameters.items()}
+        for e in range(nelec):
+            bgrad, blap = jastrow.basis_gradient_laplacian(e, configs.electron(e))
+            for k in dke:
+                dke[k] -= 0.5 * blap[k]
+                dke[k] -= np.einsum("di,di...->i...", grads[e], bgrad[k])
+        return self.transform.serialize_gradients(
+            {prefix + k: v for k, v in dke.items()}
+        )
+
+    def finite_difference_derivatives(self, configs, wf):
+        """Returns the (nconf, nparam) derivatives of the local energy by forward
+        finite differences. wf is left recomputed at its original parameters."""
+        x0 = self.transform.serialize_parameters(wf.parameters)
+        rng = get_rng(configs)
+        state = get_rng_state(rng)
+        e0 = self.enacc(configs, wf)["total"]
+        dE = np.zeros((len(e0), len(x0)))
+        for j in range(len(x0)):
+            x = x0.copy()
+            x[j] += self.delta
+            recompute_parameters(wf, configs, self._set_parameters(wf, x))
+            set_rng_state(rng, state)
+            dE[:, j] = (self.enacc(configs, wf)["total"] - e0) / self.delta
+        recompute_parameters(wf, configs, self._set_parameters(wf, x0))
+        return dE
+
+    def __call__(self, configs, wf, shared=None):
+        if shared is None:
+            shared = SharedQuantities(configs, wf)
+        d = super().__call__(configs, wf, shared)
+        dp = self._dp(configs, wf, shared)
+        dE = self.energy_derivatives(configs, wf, shared)
+        d["dpHdpj"] = np.einsum("i,ij,ik->ijk", d["total"], dp, dp)
+        d["dEdp"] = dE
+        d["dpidEdpj"] = np.einsum("ij,ik->ijk", dp, dE)
+        return d
+
+    def avg(self, configs, wf, shared=None):
+        if shared is None:
+            shared = SharedQuantities(configs, wf)
+        nconf = configs.configs.shape[0]
+        d = super().avg(configs, wf, shared)
+        energy = shared.result(self.enacc)["total"]
+        dp = self._dp(configs, wf, shared)
+        dE = self.energy_derivatives(configs, wf, shared)
+        d["dpHdpj"] = np.einsum("i,ij,ik->jk", energy, dp, dp) / nconf
+        d["dEdp"] = np.mean(dE, axis=0)
+        d["dpidEdpj"] = np.einsum("ij,ik->jk", dp, dE) / nconf
         return d
@@ -0,0 +1,152 @@
+import os
+import queue
+import threading
+import numpy as np
+from pyqmc.coord import get_rng_state, set_rng_state
+
+
+class Checkpoint:
+    """Checkpoint file of a run, in numpy's .npz format.
+
+    A checkpoint holds the walker configurations (and wraps for periodic systems),
+    the wave function parameters, the state of the random number generators, and
+    whatever else the driver passes to save(), such as DMC weights or the optimizer
+    state. The drivers (mc.vmc, dmc.rundmc, linemin.line_minimization) take a
+    Checkpoint and a restart flag; with restart=True they continue from the file,
+    if it exists, as if the run had not been interrupted.
+
+    Only a copy of the state is made in the calling thread; the file is written by a
+    background thread, so the run does not wait for the disk. If the disk falls
+    behind, pending snapshots are replaced by newer ones. The file is replaced
+    atomically, so an interrupted write leaves the previous checkpoint intact.
+    """
+
+    def __init__(self, filename, interval=10, background=True):
+        """
+        Args:
+          filename: name of the checkpoint file
+
+          interval: number of steps between checkpoints; for rundmc() steps are DMC
+            steps, for line_minimization() iterations
+
+          background: if False, write the file in the calling thread
+        """
+        self.filename = filename
+        self.interval = interval
+        self.background = background
+        self._queue = None
+        self._error = None
+
+    def due(self, step, nsteps=1):
+        """True if a multiple of interval was reached in the nsteps steps that ended
+        at step"""
+        return step // self.interval > (step - nsteps) // self.interval
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def save(self, step, configs=None, wf=None, **state):
+        """Checkpoint the state after step steps.
+
+        Args:
+          configs: configs object whose configs (and wrap) are saved
+
+          wf: wave function whose parameters are saved
+
+          state: other arrays or numbers to save
+        """
+        data = snapshot(step, configs, wf, **state)
+        if not self.background:
+            self._write(data)
+            return
+        if self._queue is None:
+            self._queue = queue.Queue(maxsize=1)
+            threading.Thread(target=self._worker, daemon=True).start()
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+            except queue.Empty:
+                pass
+            self._queue.put_nowait(data)
+
+    def _worker(self):
+        while True:
+            data = self._queue.get()
+            try:
+                self._write(data)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, data):
+        tmp = self.filename + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **data)
+        os.replace(tmp, self.filename)
+
+    def wait(self):
+        """Wait until all checkpoints are written. Errors of the background writer
+        are raised here."""
+        if self._queue is not None:
+            self._queue.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def load(self):
+        """Returns a dictionary with the contents of the checkpoint file"""
+        self.wait()
+        with np.load(self.filename) as f:
+            return {k: f[k] for k in f.files}
+
+    def restore(self, configs=None, wf=None):
+        """Load the checkpoint into configs, wf.parameters and the random number
+        generator.
+
+        Returns:
+          state: dictionary with step and the other quantities passed to save()
+        """
+        return restore(self.load(), configs, wf)
+
+
+def snapshot(step, configs=None, wf=None, **state):
+    """Dictionary of copies of the arrays to checkpoint; see Checkpoint.save()"""
+    data = {"step": np.asarray(step)}
+    if configs is not None:
+        data["configs"] = configs.configs.copy()
+        if hasattr(configs, "wrap"):
+            data["wrap"] = configs.wrap.copy()
+    if wf is not None:
+        for k, p in wf.parameters.items():
+            data["parameters/" + k] = np.array(p)
+    data["rng/global"] = np.asarray(get_rng_state(np.random))
+    if getattr(configs, "rng", None) is not None:
+        data["rng/configs"] = np.asarray(get_rng_state(configs.rng))
+    for k, v in state.items():
+        data["state/" + k] = np.array(v)
+    return data
+
+
+def restore(data, configs=None, wf=None):
+    """Inverse of snapshot(): sets configs, wf.parameters and the random state from
+    data, and returns the other quantities with step"""
+    if configs is not None:
+        configs.configs = data["configs"].copy()
+        if "wrap" in data:
+            configs.wrap = data["wrap"].copy()
+        configs.trackers = {}
+    if wf is not None:
+        for k in wf.parameters.keys():
+            wf.parameters[k] = data["parameters/" + k].copy()
+    set_rng_state(np.random, str(data["rng/global"]))
+    if "rng/configs" in data and getattr(configs, "rng", None) is not None:
+        set_rng_state(configs.rng, str(data["rng/configs"]))
+    state = {"step": int(data["step"])}
+    for k, v in data.items():
+        if k.startswith("state/"):
+            state[k[len("state/") :]] = v if v.ndim > 0 else v.item()
+    return state
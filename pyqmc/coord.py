@@ -2,18 +2,74 @@ import numpy as np
 from pyqmc.distance import MinimalImageDistance, RawDistance
 from pyqmc.pbc import enforce_pbc
 import copy
+import json
+
+
+def get_rng(configs):
+    """The random number generator to sample configs with: configs.rng if it is set,
+    and otherwise the global np.random state. Both provide normal(), random(),
+    uniform(), standard_normal() and choice() with the same meaning."""
+    rng = getattr(configs, "rng", None)
+    return np.random if rng is None else rng
+
+
+def get_rng_state(rng):
+    """State of rng (a np.random.Generator or the np.random module), as a string"""
+    if rng is np.random:
+        state = np.random.get_state(legacy=False)
+    else:
+        state = rng.bit_generator.state
+    return json.dumps(state, default=lambda a: a.tolist())
+
+
+def set_rng_state(rng, state):
+    """Inverse of get_rng_state()"""
+    state = json.loads(state)
+    if rng is np.random:
+        np.random.set_state(state)
+    else:
+        rng.bit_generator.state = state
+
+
+def _spawn(rng, n):
+    """n independent child generators of rng, or None for the global state.
+    The children are seeded from numbers drawn from rng, so they depend only on the
+    state of rng, which get_rng_state() and the checkpoints record."""
+    if rng is None:
+        return [None] * n
+    entropy = rng.integers(2 ** 63, size=4)
+    seeds = np.random.SeedSequence(entropy).spawn(n)
+    return [np.random.Generator(type(rng.bit_generator)(s)) for s in seeds]
 
 
 class OpenConfigs:
-    def __init__(self, configs):
+    def __init__(self, configs, rng=None):
+        """
+        Args:
+          configs: (nconfig, nelec, 3) array
+
+          rng: np.random.Generator used by the samplers (see get_rng()); if None, the
+            global np.random state is used
+        """
         self.configs = configs
         self.dist = RawDistance()
+        self.trackers = {}
+        self.rng = rng
+
+    def __getstate__(self):
+        """Trackers are left out when configs are pickled or copied, since they would
+        also have to be updated for each move of the copy; they are rebuilt where
+        needed."""
+        return dict(self.__dict__, trackers={})
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
 
     def electron(self, e):
-        return OpenConfigs(self.configs[:, e])
+        return OpenConfigs(self.configs[:, e], self.rng)
 
     def mask(self, mask):
-        return OpenConfigs(self.configs[mask])
+        return OpenConfigs(self.configs[mask], self.rng)
 
     def make_irreducible(self, e, vec):
         """ 
@@ -32,6 +88,8 @@ class OpenConfigs:
           vec: OpenConfigs with (nconfig, 3) new coordinates
           accept: (nconfig,) boolean for which configs to update
         """
+        for tracker in self.trackers.values():
+            tracker.move(self, e, new, accept)
         self.configs[accept, e, :] = new.configs[accept, :]
 
     def resample(self, newinds):
@@ -40,6 +98,8 @@ class OpenConfigs:
         Args:
           newinds: (nconfigs,) array of indices
         """
+        for tracker in self.trackers.values():
+            tracker.resample(newinds)
         self.configs = self.configs[newinds]
 
     def split(self, npartitions):
@@ -48,9 +108,12 @@ class OpenConfigs:
         Args:
           npartitions: int, number of partitions to divide configs into
         Returns:
-          configslist: list of new configs objects
+          configslist: list of new configs objects, each with an independent random
+            stream spawned from rng
         """
-        return [OpenConfigs(c) for c in np.split(self.configs, npartitions)]
+        clist = np.array_split(self.configs, npartitions)
+        rlist = _spawn(self.rng, npartitions)
+        return [OpenConfigs(c, r) for c, r in zip(clist, rlist)]
 
     def join(self, configslist):
         """
@@ -58,24 +121,43 @@ class OpenConfigs:
         Args:
           configslist: list of OpenConfigs objects; total number of configs must match
         """
+        self.trackers = {}
         self.configs[:] = np.concatenate([c.configs for c in configslist], axis=0)[:]
 
     def copy(self):
+        """Deep copy. The copy has its own copy of rng in the same state, so it
+        draws the same numbers as the original; use split() for independent
+        streams."""
         return copy.deepcopy(self)
 
 
 class PeriodicConfigs:
-    def __init__(self, configs, lattice_vectors, wrap=None):
+    def __init__(self, configs, lattice_vectors, wrap=None, rng=None):
         self.configs = configs
         self.wrap = np.zeros(configs.shape) if wrap is None else wrap
         self.lvecs = lattice_vectors
         self.dist = MinimalImageDistance(lattice_vectors)
+        self.trackers = {}
+        self.rng = rng
+
+    def __getstate__(self):
+        """Trackers are left out when configs are pickled or copied, since they would
+        also have to be updated for each move of the copy; they are rebuilt where
+        needed."""
+        return dict(self.__dict__, trackers={})
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
 
     def electron(self, e):
-        return PeriodicConfigs(self.configs[:, e], self.lvecs, wrap=self.wrap[:, e])
+        return PeriodicConfigs(
+            self.configs[:, e], self.lvecs, wrap=self.wrap[:, e], rng=self.rng
+        )
 
     def mask(self, mask):
-        return PeriodicConfigs(self.configs[mask], self.lvecs, wrap=self.wrap[mask])
+        return PeriodicConfigs(
+            self.configs[mask], self.lvecs, wrap=self.wrap[mask], rng=self.rng
+        )
 
     def make_irreducible(self, e, vec):
         """ 
@@ -96,6 +178,8 @@ class PeriodicConfigs:
           new: PeriodicConfigs with (nconfig, 3) new coordinates
           accept: (nconfig,) boolean for which configs to update
         """
+        for tracker in self.trackers.values():
+            tracker.move(self, e, new, accept)
         self.configs[accept, e, :] = new.configs[accept, :]
         self.wrap[accept, e, :] = new.wrap[accept, :]
 
@@ -105,6 +189,8 @@ class PeriodicConfigs:
         Args:
           newinds: (nconfigs,) array of indices
         """
+        for tracker in self.trackers.values():
+            tracker.resample(newinds)
         self.configs = self.configs[newinds]
         self.wrap = self.wrap[newinds]
 
@@ -114,11 +200,15 @@ class PeriodicConfigs:
         Args:
           npartitions: int, number of partitions to divide configs into
         Returns:
-          configslist: list of new configs objects
+          configslist: list of new configs objects, each with an independent random
+            stream spawned from rng
         """
-        clist = np.split(self.configs, npartitions)
-        wlist = np.split(self.wrap, npartitions)
-        return [PeriodicConfigs(c, self.lvecs, w) for c, w in zip(clist, wlist)]
+        clist = np.array_split(self.configs, npartitions)
+        wlist = np.array_split(self.wrap, npartitions)
+        rlist = _spawn(self.rng, npartitions)
+        return [
+            PeriodicConfigs(c, self.lvecs, w, r) for c, w, r in zip(clist, wlist, rlist)
+        ]
 
     def join(self, configslist):
         """
@@ -126,10 +216,14 @@ class PeriodicConfigs:
         Args:
           configslist: list of OpenConfigs objects; total number of configs must match
         """
+        self.trackers = {}
         self.configs[:] = np.concatenate([c.configs for c in configslist], axis=0)[:]
         self.wrap[:] = np.concatenate([c.wrap for c in configslist], axis=0)[:]
 
     def copy(self):
+        """Deep copy. The copy has its own copy of rng in the same state, so it
+        draws the same numbers as the original; use split() for independent
+        streams."""
         return copy.deepcopy(self)
 
 
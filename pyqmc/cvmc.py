@@ -1,5 +1,6 @@
 import pyqmc
 import numpy as np
+from pyqmc.accumulators import SharedQuantities
 
 
 class DescriptorFromOBDM:
@@ -45,6 +46,8 @@ class DescriptorFromOBDM:
 class PGradDescriptor:
     """   """
 
+    needs = ("energy", "pgradient", "gradients", "obdm")
+
     def __init__(self, enacc, transform, dm_evaluators, descriptors, nodal_cutoff=1e-5):
         """ 
         
@@ -56,22 +59,22 @@ class PGradDescriptor:
         self.dm_evaluators = dm_evaluators
         self.descriptors = descriptors
 
-    def _node_cut(self, configs, wf):
+    def _node_cut(self, configs, wf, shared):
         """ Return true if a given configuration is within nodal_cutoff 
         of the node """
         ne = configs.configs.shape[1]
-        d2 = 0.0
-        for e in range(ne):
-            d2 += np.sum(wf.gradient(e, configs.electron(e)) ** 2, axis=0)
+        d2 = np.sum(shared.gradients() ** 2, axis=(0, 1))
         r = 1.0 / (d2 * ne * ne)
         return r < self.nodal_cutoff ** 2
 
-    def __call__(self, configs, wf):
-        pgrad = wf.pgradient()
-        d = self.enacc(configs, wf)
+    def __call__(self, configs, wf, shared=None):
+        if shared is None:
+            shared = SharedQuantities(configs, wf)
+        pgrad = shared.pgradient()
+        d = dict(shared.result(self.enacc))
         energy = d["total"]
         dp = self.transform.serialize_gradients(pgrad)
-        node_cut = self._node_cut(configs, wf)
+        node_cut = self._node_cut(configs, wf, shared)
         dp[node_cut, :] = 0.0
         # print('number cut off',np.sum(node_cut))
 
@@ -81,17 +84,19 @@ class PGradDescriptor:
         raise NotImplementedError("define __call__ for PGradOBDMTransform")
         return d
 
-    def avg(self, configs, wf):
+    def avg(self, configs, wf, shared=None):
+        if shared is None:
+            shared = SharedQuantities(configs, wf)
         nconf = configs.configs.shape[0]
-        pgrad = wf.pgradient()
-        den = self.enacc(configs, wf)
+        pgrad = shared.pgradient()
+        den = shared.result(self.enacc)
         energy = den["total"]
         dp = self.transform.serialize_gradients(pgrad)
 
-        dms = [evaluate(configs, wf) for evaluate in self.dm_evaluators]
+        dms = [shared.result(evaluate) for evaluate in self.dm_evaluators]
         descript = self.descriptors(dms)
 
-        node_cut = self._node_cut(configs, wf)
+        node_cut = self._node_cut(configs, wf, shared)
         dp[node_cut, :] = 0.0
         # print('number cut off',np.sum(node_cut))
 
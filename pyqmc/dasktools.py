@@ -1,7 +1,10 @@
 import os
+import copy
+import operator
 import pyqmc
 import numpy as np
 import pandas as pd
+from pyqmc.accumulators import walker_quantities
 
 os.environ["MKL_NUM_THREADS"] = "1"
 os.environ["NUMEXPR_NUM_THREADS"] = "1"
@@ -21,7 +24,9 @@ def distvmc(
     Args: 
     wf: a wave function object
 
-    coords: nconf x nelec x 3 
+    coords: nconf x nelec x 3 configs object, or a DistributedWalkers object.
+      In the latter case the walkers stay on the workers and only the
+      parameters of wf and the step averages are sent over the network.
 
     nsteps: how many steps to move each walker
 
@@ -36,46 +41,74 @@ def distvmc(
         npartitions = sum([x for x in client.nthreads().values()])
     allruns = []
     niterations = int(nsteps / nsteps_per)
-    coord = coords.split(npartitions)
+    resident = isinstance(coords, DistributedWalkers)
+    if not resident:
+        coord = coords.split(npartitions)
     alldata = []
     for epoch in range(niterations):
-        wfs = []
-        thiscoord = []
-        for i in range(npartitions):
-            wfs.append(wf)
-            thiscoord.append(coord[i])
-        runs = client.map(
-            pyqmc.vmc,
-            wfs,
-            thiscoord,
-            **{"nsteps": nsteps_per, "accumulators": accumulators, "stepoffset": epoch},
-        )
-        iterdata = []
-        for i, r in enumerate(runs):
-            res = r.result()
-            iterdata.extend(res[0])
-            coord[i] = res[1]
-
-        alldata.extend(
-            pd.DataFrame(iterdata)
-            .groupby("step", as_index=False)
-            .apply(lambda x: x.mean())
-            .to_dict("records")
-        )
+        if resident:
+            iterdata = coords.vmc(
+                wf.parameters,
+                nsteps=nsteps_per,
+                accumulators=accumulators,
+                stepoffset=epoch * nsteps_per,
+            )
+        else:
+            wfs = []
+            thiscoord = []
+            for i in range(npartitions):
+                wfs.append(wf)
+                thiscoord.append(coord[i])
+            runs = client.map(
+                pyqmc.vmc,
+                wfs,
+                thiscoord,
+                **{
+                    "nsteps": nsteps_per,
+                    "accumulators": accumulators,
+                    "stepoffset": epoch * nsteps_per,
+                },
+            )
+            iterdata = []
+            for i, r in enumerate(runs):
+                res = r.result()
+                iterdata.extend(res[0])
+                coord[i] = res[1]
+
+        alldata.extend(_average_by_step(iterdata, walker_quantities(accumulators)))
         print("epoch", epoch, "finished", flush=True)
 
-    coords.join(coord)
+    if not resident:
+        coords.join(coord)
 
     return alldata, coords
 
 
+def _average_by_step(data, walker=()):
+    """Average step dictionaries from several partitions that have the same step.
+    The per-walker quantities with keys in walker (see
+    accumulators.walker_quantities()) are concatenated instead."""
+    bystep = {}
+    for d in data:
+        bystep.setdefault(d["step"], []).append(d)
+    return [
+        {
+            k: np.concatenate([d[k] for d in ds])
+            if k in walker
+            else np.mean([d[k] for d in ds], axis=0)
+            for k in ds[0]
+        }
+        for step, ds in sorted(bystep.items())
+    ]
+
+
 def dist_lm_sampler(wf, configs, params, pgrad_acc, npartitions=None, client=None):
     """
     Evaluates accumulator on the same set of configs for correlated sampling of different wave function parameters.  Parallelized with parsl.
 
     Args:
         wf: wave function object
-        configs: (nconf, nelec, 3) array
+        configs: (nconf, nelec, 3) configs object or DistributedWalkers
         params: (nsteps, nparams) array 
             list of arrays of parameters (serialized) at each step
         pgrad_acc: PGradAccumulator 
@@ -90,17 +123,22 @@ def dist_lm_sampler(wf, configs, params, pgrad_acc, npartitions=None, client=Non
     """
     from pyqmc.linemin import lm_sampler
 
-    if npartitions is None:
-        npartitions = sum([x for x in client.nthreads().values()])
+    if isinstance(configs, DistributedWalkers):
+        stepresults = configs.lm_sampler(wf.parameters, params, pgrad_acc)
+    else:
+        if npartitions is None:
+            npartitions = sum([x for x in client.nthreads().values()])
 
-    configspart = configs.split(npartitions)
-    allruns = []
-    for p in range(npartitions):
-        allruns.append(client.submit(lm_sampler, wf, configspart[p], params, pgrad_acc))
+        configspart = configs.split(npartitions)
+        allruns = []
+        for p in range(npartitions):
+            allruns.append(
+                client.submit(lm_sampler, wf, configspart[p], params, pgrad_acc)
+            )
 
-    stepresults = []
-    for r in allruns:
-        stepresults.append(r.result())
+        stepresults = []
+        for r in allruns:
+            stepresults.append(r.result())
 
     keys = stepresults[0][0].keys()
     # This will be a list of dictionaries
@@ -128,30 +166,47 @@ def line_minimization(*args, client, **kwargs):
     return pyqmc.line_minimization(*args, vmc=distvmc, lm=dist_lm_sampler, **kwargs)
 
 
-def distdmc_propagate(wf, configs, weights, *args, client, npartitions=None, **kwargs):
+def distdmc_propagate(
+    wf, configs, weights, *args, client, npartitions=None, eloc=None, **kwargs
+):
+    """Distributed version of dmc.dmc_propagate. The partitions always recompute
+    their wave functions, so eloc is ignored and None is returned in its place."""
     import pyqmc.dmc
 
-    if npartitions is None:
-        npartitions = sum([x for x in client.nthreads().values()])
+    if isinstance(configs, DistributedWalkers):
+        allresults = configs.dmc_propagate(wf.parameters, weights, *args, **kwargs)
+        weightlist = [x[1] for x in allresults]
+        coordret = configs
+    else:
+        if npartitions is None:
+            npartitions = sum([x for x in client.nthreads().values()])
 
-    coord = configs.split(npartitions)
-    weight = np.split(weights, npartitions)
-    allruns = []
-    for nodeconfigs, nodeweight in zip(coord, weight):
-        allruns.append(
-            client.submit(
-                pyqmc.dmc.dmc_propagate, wf, nodeconfigs, nodeweight, *args, **kwargs
+        coord = configs.split(npartitions)
+        sizes = [c.configs.shape[0] for c in coord]
+        weight = np.split(weights, np.cumsum(sizes)[:-1])
+        allruns = []
+        for nodeconfigs, nodeweight in zip(coord, weight):
+            allruns.append(
+                client.submit(
+                    pyqmc.dmc.dmc_propagate,
+                    wf,
+                    nodeconfigs,
+                    nodeweight,
+                    *args,
+                    **kwargs,
+                )
             )
-        )
+        allresults = [r.result() for r in allruns]
+        configs.join([x[1] for x in allresults])
+        weightlist = [x[2] for x in allresults]
+        coordret = configs
 
     import pandas as pd
 
-    allresults = [r.result() for r in allruns]
-    configs.join([x[1] for x in allresults])
-    coordret = configs
-    weightret = np.vstack([x[2] for x in allresults])
+    weightret = np.concatenate(weightlist)
     df = pd.concat([pd.DataFrame(x[0]) for x in allresults])
     notavg = ["weight", "weightvar", "weightmin", "weightmax", "acceptance", "step"]
+    notavg += ["tmove_acceptance"]
     # Here we reweight the averages since each step on each node
     # was done with a different average weight.
 
@@ -163,4 +218,224 @@ def distdmc_propagate(wf, configs, weights, *args, client, npartitions=None, **k
         if k not in notavg:
             df[k] = df[k] / df["weight"]
     print(df)
-    return df, coordret, weightret
+    return df, coordret, weightret, None
+
+
+def _scatter_one(client, obj):
+    """Send obj to every worker once, returning a single future for it."""
+    return client.scatter([obj], broadcast=True, hash=False)[0]
+
+
+def _set_parameters(wf, parameters):
+    for k, p in parameters.items():
+        wf.parameters[k] = p.copy()
+
+
+def _resident_select(state, inds):
+    return state["configs"].mask(inds)
+
+
+def _resident_reassemble(state, localinds, pieces, order):
+    """Build the new walkers of a partition from its own walkers at localinds
+    followed by the walkers in pieces, then put them in the final order.
+    The old state is left untouched, since other partitions may still be
+    selecting walkers from it."""
+    configs = state["configs"].copy()
+    configs.resample(np.zeros(len(order), dtype=int))  # resize to the new size
+    configs.join([state["configs"].mask(localinds)] + pieces)
+    configs.resample(order)
+    return {"wf": state["wf"], "configs": configs}
+
+
+def _resident_vmc(state, parameters, **kwargs):
+    _set_parameters(state["wf"], parameters)
+    df, state["configs"] = pyqmc.vmc(state["wf"], state["configs"], **kwargs)
+    return state, df
+
+
+def _resident_lm_sampler(state, parameters, params, pgrad_acc):
+    from pyqmc.linemin import lm_sampler
+
+    _set_parameters(state["wf"], parameters)
+    return state, lm_sampler(state["wf"], state["configs"], params, pgrad_acc)
+
+
+def _resident_dmc_propagate(state, parameters, weights, *args, **kwargs):
+    import pyqmc.dmc
+
+    _set_parameters(state["wf"], parameters)
+    df, state["configs"], weights, eloc = pyqmc.dmc.dmc_propagate(
+        state["wf"], state["configs"], weights, *args, **kwargs
+    )
+    return state, (df, weights)
+
+
+class DistributedWalkers:
+    """
+    Partitions of walkers, each paired with its own copy of the wave function,
+    that stay resident on the dask workers between calls.
+
+    The wave function is serialized once when the object is created. Afterwards
+    each call only sends the current wave function parameters (and the
+    accumulators) to the workers, and only the step averages come back.
+    The walkers never leave the workers except through gather().
+
+    This object can be passed as the configs argument of distvmc(),
+    dist_lm_sampler(), distdmc_propagate() and the line_minimization() and
+    rundmc() drivers that use them.
+    """
+
+    def __init__(self, wf, configs, client, npartitions=None):
+        """
+        Args:
+          wf: a wave function object; copied to each partition
+
+          configs: configs object with the initial walkers
+
+          client: dask client
+
+          npartitions: number of walker partitions. Defaults to the number of
+            worker threads.
+        """
+        if npartitions is None:
+            npartitions = sum([x for x in client.nthreads().values()])
+        self.client = client
+        self.npartitions = npartitions
+        self._configs = configs.copy()
+        parts = configs.split(npartitions)
+        self._offsets = np.cumsum([0] + [c.configs.shape[0] for c in parts])
+        # each partition owns its wave function and walkers, also when the
+        # workers are threads in the same process as the caller
+        states = [{"wf": copy.deepcopy(wf), "configs": c.copy()} for c in parts]
+        self._states = client.scatter(states, hash=False)
+
+    def _run(self, func, *args, **kwargs):
+        """Run func(state, *args, **kwargs) on every partition. Each entry of
+        args is a list with one item per partition, kwargs are shared.
+        func returns (state, result); the states stay on the workers and only
+        the results are gathered to the client."""
+        runs = self.client.map(func, self._states, *args, pure=False, **kwargs)
+        self._states = self.client.map(
+            operator.getitem, runs, [0] * self.npartitions, pure=False
+        )
+        results = self.client.map(
+            operator.getitem, runs, [1] * self.npartitions, pure=False
+        )
+        return self.client.gather(results)
+
+    def _parameters(self, parameters):
+        parameters = {k: np.asarray(p) for k, p in parameters.items()}
+        return [_scatter_one(self.client, parameters)] * self.npartitions
+
+    def vmc(self, parameters, accumulators=None, **kwargs):
+        """Run pyqmc.vmc on every partition.
+
+        Returns:
+          A list of the step dictionaries from all partitions.
+        """
+        if accumulators is None:
+            accumulators = {}
+        results = self._run(
+            _resident_vmc,
+            self._parameters(parameters),
+            accumulators=_scatter_one(self.client, accumulators),
+            **kwargs,
+        )
+        return [d for r in results for d in r]
+
+    def lm_sampler(self, parameters, params, pgrad_acc):
+        """Run linemin.lm_sampler on every partition.
+
+        Returns:
+          A list with the lm_sampler result of each partition.
+        """
+        return self._run(
+            _resident_lm_sampler,
+            self._parameters(parameters),
+            params=_scatter_one(self.client, params),
+            pgrad_acc=_scatter_one(self.client, pgrad_acc),
+        )
+
+    def dmc_propagate(self, parameters, weights, *args, **kwargs):
+        """Run dmc.dmc_propagate on every partition. weights is split in the
+        same way as the walkers.
+
+        Returns:
+          A list of (df, weights) tuples, one for each partition.
+        """
+        if "accumulators" in kwargs:
+            kwargs["accumulators"] = _scatter_one(self.client, kwargs["accumulators"])
+        return self._run(
+            _resident_dmc_propagate,
+            self._parameters(parameters),
+            np.split(weights, self._offsets[1:-1]),
+            *[[a] * self.npartitions for a in args],
+            **kwargs,
+        )
+
+    def gather(self):
+        """Collect the walkers from the workers into a single configs object."""
+        parts = self.client.map(
+            operator.getitem,
+            self._states,
+            ["configs"] * self.npartitions,
+            pure=False,
+        )
+        parts = self.client.gather(parts)
+        # the population may have changed since the last gather (branch_splitmerge)
+        nconfig = sum(c.configs.shape[0] for c in parts)
+        self._configs.resample(np.zeros(nconfig, dtype=int))
+        self._configs.join(parts)
+        return self._configs
+
+    @property
+    def configs(self):
+        """The walker coordinates as a (nconfig, nelec, 3) array. This gathers
+        all walkers to the client."""
+        return self.gather().configs
+
+    def resample(self, newinds):
+        """Resample walkers by new indices (e.g. for DMC branching).
+
+        newinds may have a different length than the current population
+        (e.g. dmc.branch_splitmerge()); the new walkers are divided as evenly
+        as possible over the partitions. Walkers that a partition already
+        holds are copied in place on its worker, and only walkers that come
+        from other partitions are moved between workers. For the comb in
+        dmc.branch(), newinds is sorted, so the walkers that move are only
+        the ones needed to even out the weight differences between partitions.
+        """
+        newinds = np.asarray(newinds)
+        owner = np.searchsorted(self._offsets, newinds, side="right") - 1
+        local = newinds - self._offsets[owner]
+        sizes = [len(x) for x in np.array_split(newinds, self.npartitions)]
+        newoffsets = np.cumsum([0] + sizes)
+        newstates = []
+        for q in range(self.npartitions):
+            dest = slice(newoffsets[q], newoffsets[q + 1])
+            srcowner, srclocal = owner[dest], local[dest]
+            # own walkers first, then the other partitions in order
+            sortkey = np.where(srcowner == q, -1, srcowner)
+            order = np.argsort(sortkey, kind="stable")
+            pieces = [
+                self.client.submit(
+                    _resident_select,
+                    self._states[p],
+                    srclocal[srcowner == p],
+                    pure=False,
+                )
+                for p in np.unique(srcowner)
+                if p != q
+            ]
+            newstates.append(
+                self.client.submit(
+                    _resident_reassemble,
+                    self._states[q],
+                    srclocal[srcowner == q],
+                    pieces,
+                    np.argsort(order),
+                    pure=False,
+                )
+            )
+        self._states = newstates
+        self._offsets = newoffsets
@@ -8,6 +8,8 @@ os.environ["OMP_NUM_THREADS"] = "1"
 
 import numpy as np
 import pyqmc.mc as mc
+from pyqmc.accumulators import SharedQuantities, evaluate, split_interval
+from pyqmc.coord import get_rng
 import sys
 import pandas as pd
 
@@ -61,6 +63,8 @@ def dmc_propagate(
     ekey=("energy", "total"),
     drift_limiter=limdrift,
     stepoffset=0,
+    eloc=None,
+    tmoves=False,
 ):
     """
     Propagate DMC without branching
@@ -76,7 +80,7 @@ def dmc_propagate(
 
       nsteps: number of DMC steps to take
 
-      accumulators: A dictionary of functor objects that take in (coords,wf) and return a dictionary of quantities to be averaged. np.mean(quantity,axis=0) should give the average over configurations. If none, a default energy accumulator will be used.
+      accumulators: A dictionary of functor objects that take in (coords,wf) and return a dictionary of quantities to be averaged. np.mean(quantity,axis=0) should give the average over configurations. If none, a default energy accumulator will be used. An entry can also be a tuple (accumulator, interval) to evaluate it only every interval steps (see accumulators.split_interval()); the energy accumulator ekey[0] is always evaluated every step.
 
       ekey: tuple of strings; energy is needed for DMC weights. Access total energy by accumulators[ekey[0]](configs, wf)[ekey[1]
 
@@ -84,19 +88,30 @@ def dmc_propagate(
 
       stepoffset: what to start the step numbering at.
 
-    Returns: (df,coords,weights)
+      tmoves: If True, the nonlocal part of the ECP is treated with size-consistent T-moves (see tmove_sweep()) after each drift-diffusion sweep instead of only through the locality approximation. Requires accumulators[ekey[0]] to provide nonlocal_tmoves(), like EnergyAccumulator.
+
+      eloc: (nconfig,) local energies of configs from a previous call. If given, wf is assumed to be up to date with configs (e.g. through wf.resample() after branching), and the initial recompute and energy evaluation are skipped.
+
+    Returns: (df,coords,weights,eloc)
       df: A list of dictionaries nstep long that contains all results from the accumulators.
 
       coords: The final coordinates from this calculation.
 
       weights: The final weights from this calculation
+
+      eloc: The final local energies, to be passed to the next call
       
     """
     assert accumulators is not None, "Need an energy accumulator for DMC"
+    accumulators = {k: split_interval(acc) for k, acc in accumulators.items()}
+    enacc = accumulators[ekey[0]][0]
     nconfig, nelec = configs.configs.shape[0:2]
-    wf.recompute(configs)
-
-    eloc = accumulators[ekey[0]](configs, wf)[ekey[1]]
+    rng = get_rng(configs)
+    if eloc is None:
+        # the incremental sums of the trackers are rebuilt along with the wave function
+        configs.trackers = {}
+        wf.recompute(configs)
+        eloc = enacc(configs, wf)[ekey[1]]
     # eref_mean = np.mean(weights * eloc) / np.mean(weights)
     # eref = eref_mean
     df = []
@@ -105,7 +120,7 @@ def dmc_propagate(
         for e in range(nelec):
             # Propose move
             grad = drift_limiter(wf.gradient(e, configs.electron(e)).T, tstep)
-            gauss = np.random.normal(scale=np.sqrt(tstep), size=(nconfig, 3))
+            gauss = rng.normal(scale=np.sqrt(tstep), size=(nconfig, 3))
             eposnew = configs.configs[:, e, :] + gauss + grad
             newepos = configs.make_irreducible(e, eposnew)
 
@@ -120,16 +135,20 @@ def dmc_propagate(
             # Acceptance -- fixed-node: reject if wf changes sign
             wfratio = wf.testvalue(e, newepos)
             ratio = wfratio ** 2 * t_prob
-            accept = ratio * np.sign(wfratio) > np.random.rand(nconfig)
+            accept = ratio * np.sign(wfratio) > rng.random(nconfig)
 
             # Update wave function
             configs.move(e, newepos, accept)
             wf.updateinternals(e, newepos, mask=accept)
             acc[e] = np.mean(accept)
 
+        if tmoves:
+            avg_tmove = tmove_sweep(configs, wf, enacc, tstep)
+
         # weights
         elocold = eloc.copy()
-        energydat = accumulators[ekey[0]](configs, wf)
+        shared = SharedQuantities(configs, wf)
+        energydat = evaluate(enacc, configs, wf, shared)
         eloc = energydat[ekey[1]]
         tdamp = limit_timestep(
             weights, eloc, elocold, eref, branchcut_start, branchcut_stop
@@ -140,11 +159,13 @@ def dmc_propagate(
         wavg = np.mean(weights)
 
         avg = {}
-        for k, accumulator in accumulators.items():
-            if k != ekey[0]:
-                dat = accumulator(configs, wf)
-            else:
+        for k, (accumulator, interval) in accumulators.items():
+            if k == ekey[0]:
                 dat = energydat
+            elif (stepoffset + step) % interval == 0:
+                dat = evaluate(accumulator, configs, wf, shared)
+            else:
+                continue
             for m, res in dat.items():
                 avg[k + m] = np.dot(weights, res) / (nconfig * wavg)
         avg["weight"] = wavg
@@ -152,10 +173,48 @@ def dmc_propagate(
         avg["weightmin"] = np.amin(weights)
         avg["weightmax"] = np.amax(weights)
         avg["acceptance"] = np.mean(acc)
+        if tmoves:
+            avg["tmove_acceptance"] = avg_tmove
         avg["step"] = stepoffset + step
 
         df.append(avg)
-    return df, configs, weights
+    return df, configs, weights, eloc
+
+
+def tmove_sweep(configs, wf, energy_accumulator, tstep):
+    """
+    Size-consistent T-moves (Casula et al., J. Chem. Phys. 132, 154113 (2010)), applied 
+    to each electron in turn. Electron e moves to quadrature point x' with probability 
+    t(x')/(1 + sum t), where t(x') = max(-tstep*V_nl(x',x) Psi(x')/Psi(x), 0), and 
+    otherwise stays put.
+
+    Args:
+      configs: Configs object; updated in place
+
+      wf: wave function; updated in place
+
+      energy_accumulator: object providing nonlocal_tmoves(configs, wf, e, tstep), such as EnergyAccumulator
+
+      tstep: DMC time step
+
+    Returns:
+      The fraction of electron moves that were accepted
+    """
+    nconfig, nelec = configs.configs.shape[0:2]
+    rng = get_rng(configs)
+    acc = np.zeros(nelec)
+    for e in range(nelec):
+        t, epos_rot = energy_accumulator.nonlocal_tmoves(configs, wf, e, tstep)
+        cumt = np.cumsum(np.concatenate([np.ones((nconfig, 1)), t], axis=1), axis=1)
+        choice = np.sum(cumt < rng.random((nconfig, 1)) * cumt[:, -1:], axis=1)
+        accept = choice > 0
+        newepos = configs.make_irreducible(
+            e, epos_rot[np.arange(nconfig), np.maximum(choice - 1, 0)]
+        )
+        configs.move(e, newepos, accept)
+        wf.updateinternals(e, newepos, mask=accept)
+        acc[e] = np.mean(accept)
+    return np.mean(acc)
 
 
 def limit_timestep(weights, elocnew, elocold, eref, start, stop):
@@ -211,15 +270,64 @@ def branch(configs, weights):
       configs: resampled walker configurations
 
       weights: (nconfig,) all weights are equal to average weight
+
+      newinds: (nconfig,) indices of the walkers that were kept, as passed to configs.resample()
     """
-    nconfig = configs.configs.shape[0]
+    nconfig = len(weights)
     wtot = np.sum(weights)
     probability = np.cumsum(weights / wtot)
-    base = np.random.rand()
+    base = get_rng(configs).random()
     newinds = np.searchsorted(probability, (base + np.arange(nconfig) / nconfig) % 1.0)
     configs.resample(newinds)
     weights.fill(wtot / nconfig)
-    return configs, weights
+    return configs, weights, newinds
+
+
+def branch_splitmerge(configs, weights, wsplit=2.0, wmerge=0.5):
+    """
+    Perform branching on a set of walkers by splitting and merging.
+
+    Walkers with a weight larger than wsplit times the average weight are split into
+    int(w/wavg) copies that share its weight. Walkers lighter than wmerge times the
+    average weight are merged in pairs: one walker of the pair is kept with
+    probability proportional to its weight and carries the weight of both. All other
+    walkers are left alone, so the number of walkers can change, and the total
+    weight is conserved exactly.
+
+    Args:
+      configs: (nconfig,nelec,3) walker coordinates
+
+      weights: (nconfig,) walker weights
+
+      wsplit: relative weight above which walkers are split
+
+      wmerge: relative weight below which walkers are merged
+
+    Returns:
+      configs: walker configurations, with the merged walkers removed and the
+        copies of split walkers appended at the end
+
+      weights: weights of the new walkers
+
+      newinds: indices of the walkers that were kept, as passed to configs.resample()
+    """
+    weights = weights.copy()
+    wavg = np.mean(weights)
+    light = np.flatnonzero(weights < wmerge * wavg)
+    npair = len(light) // 2
+    first, second = light[:npair], light[npair : 2 * npair]
+    wpair = weights[first] + weights[second]
+    keepfirst = get_rng(configs).random(npair) * wpair < weights[first]
+    weights[np.where(keepfirst, first, second)] = wpair
+    keep = np.ones(len(weights), dtype=bool)
+    keep[np.where(keepfirst, second, first)] = False
+
+    heavy = np.flatnonzero(weights > wsplit * wavg)
+    ncopies = (weights[heavy] / wavg).astype(int)
+    weights[heavy] /= ncopies
+    newinds = np.concatenate([np.flatnonzero(keep), np.repeat(heavy, ncopies - 1)])
+    configs.resample(newinds)
+    return configs, weights[newinds], newinds
 
 
 def rundmc(
@@ -238,6 +346,12 @@ def rundmc(
     ekey=("energy", "total"),
     propagate=dmc_propagate,
     feedback=1.0,
+    branch=branch,
+    nconfig_target=None,
+    checkpoint=None,
+    restart=False,
+    hdf_file=None,
+    recompute_every=10,
     **kwargs,
 ):
     """
@@ -266,6 +380,20 @@ def rundmc(
 
       stepoffset: If continuing a run, what to start the step numbering at.
 
+      propagate: a function with the arguments and return values of dmc_propagate(), which returns (df, configs, weights, eloc). A propagate function that does not keep the local energies can return None for eloc.
+
+      branch: a function that takes (configs, weights) and returns the branched (configs, weights, newinds); branch() for stochastic reconfiguration at fixed population, or branch_splitmerge() for a variable population. If wf has resample(), it follows the walkers through newinds instead of being recomputed.
+
+      recompute_every: number of branch steps after which the wave function is recomputed from scratch and the local energies are reevaluated, to clear the round-off that builds up in the updated inverses and sums.
+
+      nconfig_target: the total weight that the feedback on eref drives the population towards. Defaults to the initial number of walkers.
+
+      checkpoint: a checkpoint.Checkpoint; the configurations, weights, eref, wave function parameters and random state are saved after branching, about every checkpoint.interval steps
+
+      restart: if True and the checkpoint file exists, continue from it. The returned df then only contains the steps after the checkpoint.
+
+      hdf_file: name of an HDF5 file to which the data of each step is appended after each branching, one dataset per key (see hdftools). On restart, the steps after the checkpoint are dropped from it first.
+
     Returns: (df,coords,weights)
       df: A list of dictionaries nstep long that contains all results from the accumulators.
 
@@ -277,32 +405,50 @@ def rundmc(
     nconfig, nelec = configs.configs.shape[0:2]
     if weights is None:
         weights = np.ones(nconfig)
+    if nconfig_target is None:
+        nconfig_target = len(weights)
 
     npropagate = int(np.ceil(nsteps / branchtime))
     df = []
-
-    df_, configs, weights = propagate(
-        wf,
-        configs,
-        weights,
-        tstep,
-        branchcut_start=1e8,
-        branchcut_stop=1e9,
-        eref=0.0,
-        nsteps=1,
-        stepoffset=0,
-        accumulators=accumulators,
-        ekey=ekey,
-        drift_limiter=drift_limiter,
-        **kwargs,
-    )
-    df_ = pd.DataFrame(df_)
-    eref = df_[ekey[0] + ekey[1]][0]
-    esigma = np.abs(eref) / 100
-    for step in range(npropagate):
+    if hdf_file is not None:
+        import pyqmc.hdftools as hdftools
+
+    if checkpoint is not None and restart and checkpoint.exists():
+        state = checkpoint.restore(configs, wf)
+        start, weights = state["step"], state["weights"]
+        eref, esigma = state["eref"], state["esigma"]
+        nconfig_target = state["nconfig_target"]
+        eloc = state.get("eloc", None)
+        if eloc is not None:
+            wf.recompute(configs)
+        if hdf_file is not None:
+            hdftools.truncate(hdf_file, "step", branchtime * start + stepoffset)
+    else:
+        start = 0
+        df_, configs, weights, eloc = propagate(
+            wf,
+            configs,
+            weights,
+            tstep,
+            branchcut_start=1e8,
+            branchcut_stop=1e9,
+            eref=0.0,
+            nsteps=1,
+            stepoffset=0,
+            accumulators=accumulators,
+            ekey=ekey,
+            drift_limiter=drift_limiter,
+            **kwargs,
+        )
+        df_ = pd.DataFrame(df_)
+        eref = df_[ekey[0] + ekey[1]][0]
+        esigma = np.abs(eref) / 100
+    if hdf_file is not None:
+        hdf = hdftools.Appender(hdf_file)
+    for step in range(start, npropagate):
         if verbose:
             print("branch step", step, flush=True)
-        df_, configs, weights = propagate(
+        df_, configs, weights, eloc = propagate(
             wf,
             configs,
             weights,
@@ -315,12 +461,44 @@ def rundmc(
             accumulators=accumulators,
             ekey=ekey,
             drift_limiter=drift_limiter,
+            eloc=eloc,
             **kwargs,
         )
+        if hdf_file is not None:
+            rows = df_.to_dict("records") if isinstance(df_, pd.DataFrame) else df_
+            hdf.append([dict(d, eref=eref) for d in rows])
         df_ = pd.DataFrame(df_)
         df_["eref"] = eref
         # print(df_)
         df.append(df_)
-        eref = df_[ekey[0] + ekey[1]].values[-1] - feedback * np.log(np.mean(weights))
-        configs, weights = branch(configs, weights)
+        eref = df_[ekey[0] + ekey[1]].values[-1] - feedback * np.log(
+            np.sum(weights) / nconfig_target
+        )
+        configs, weights, newinds = branch(configs, weights)
+        # Branching only copies walkers, so the wave function can follow them
+        refresh = (step + 1) % recompute_every == 0
+        if eloc is not None and hasattr(wf, "resample") and not refresh:
+            wf.resample(newinds)
+            eloc = eloc[newinds]
+        else:
+            eloc = None
+        nsteps_done = branchtime * (step + 1)
+        if checkpoint is not None and checkpoint.due(nsteps_done, branchtime):
+            state = {} if eloc is None else {"eloc": eloc}
+            checkpoint.save(
+                step + 1,
+                configs,
+                wf,
+                weights=weights,
+                eref=eref,
+                esigma=esigma,
+                nconfig_target=nconfig_target,
+                **state,
+            )
+    if hdf_file is not None:
+        hdf.close()
+    if checkpoint is not None:
+        checkpoint.wait()
+    if len(df) == 0:  # restarted from the end of the run
+        return pd.DataFrame(), configs, weights
     return pd.concat(df).reset_index(), configs, weights
@@ -2,7 +2,7 @@ import numpy as np
 import scipy
 import scipy.spatial
 import pyqmc.eval_ecp as eval_ecp
-from pyqmc.distance import RawDistance
+from pyqmc.ewald import Ewald
 
 
 def ee_energy(configs):
@@ -25,21 +25,106 @@ def ei_energy(mol, configs):
 
 
 def ii_energy(mol):
-    ei = 0.0
-    d = RawDistance()
-    rij, ij = d.dist_matrix(mol.atom_coords()[np.newaxis, :, :])
-    if len(ij) == 0:
-        return np.array([0.0])
-    rij = np.linalg.norm(rij, axis=2)[0, :]
-    iitot = 0
-    c = mol.atom_charges()
-    for (i, j), r in zip(ij, rij):
-        iitot += c[i] * c[j] / r
-    return iitot
+    charges = mol.atom_charges()
+    i, j = np.triu_indices(len(charges), 1)
+    coords = mol.atom_coords()
+    rij = np.linalg.norm(coords[i] - coords[j], axis=1)
+    return np.sum(charges[i] * charges[j] / rij)
+
+
+class CoulombTracker:
+    """Per-electron Coulomb sums of each configuration for open boundary conditions,
+    kept on configs.trackers and updated in O(nelec) for each accepted move."""
+
+    def __init__(self, charges, coords, configs):
+        """
+        Args:
+          charges: (natom,) ion charges
+
+          coords: (natom, 3) ion positions
+
+          configs: OpenConfigs object to compute the sums for
+        """
+        self.charges = charges
+        self.coords = coords
+        self.positions = configs.configs.copy()
+        nconf, nelec = self.positions.shape[:2]
+        self.rinv = np.zeros((nconf, nelec, nelec))
+        for e in range(nelec):
+            self.rinv[:, e] = self._inverse_distances(configs, self.positions, e)
+        self.ee = np.sum(self.rinv, axis=2)
+        self.ei = np.stack([self._ei(self.positions[:, e]) for e in range(nelec)], 1)
+
+    def _inverse_distances(self, configs, positions, e):
+        """1/r from electron e to all electrons; zero for e itself"""
+        r = np.linalg.norm(configs.dist.dist_i(positions, positions[:, e]), axis=2)
+        r[:, e] = np.inf
+        return 1.0 / r
+
+    def _ei(self, epos):
+        r = np.linalg.norm(epos[:, np.newaxis] - self.coords[np.newaxis], axis=2)
+        return -np.dot(1.0 / r, self.charges)
+
+    def move(self, configs, e, new, accept):
+        if not np.any(accept):
+            return
+        self.positions[accept, e] = new.configs[accept]
+        rinv = self._inverse_distances(configs, self.positions[accept], e)
+        self.ee[accept] += rinv - self.rinv[accept, e]
+        self.ee[accept, e] = np.sum(rinv, axis=1)
+        self.rinv[accept, e] = rinv
+        self.rinv[accept, :, e] = rinv
+        self.ei[accept, e] = self._ei(new.configs[accept])
+
+    def resample(self, newinds):
+        self.positions = self.positions[newinds]
+        self.rinv = self.rinv[newinds]
+        self.ee = self.ee[newinds]
+        self.ei = self.ei[newinds]
+
+    def is_current(self, configs):
+        return self.positions.shape == configs.configs.shape and np.array_equal(
+            self.positions, configs.configs
+        )
 
 
-def get_ecp(mol, configs, wf, threshold):
-    return eval_ecp.ecp(mol, configs, wf, threshold)
+class OpenCoulomb:
+    """Coulomb energy for open boundary conditions. The ion-ion energy is computed
+    once, and the electron sums are read from a CoulombTracker on the configs, which
+    is only updated for accepted moves."""
+
+    def __init__(self, mol):
+        self.charges = mol.atom_charges()
+        self.coords = mol.atom_coords()
+        self.ii_energy = ii_energy(mol)
+
+    def tracker(self, configs):
+        """CoulombTracker of configs, rebuilt if it is missing or out of date"""
+        tracker = configs.trackers.get("coulomb", None)
+        if tracker is None or not tracker.is_current(configs):
+            tracker = CoulombTracker(self.charges, self.coords, configs)
+            configs.trackers["coulomb"] = tracker
+        return tracker
+
+    def energy(self, configs):
+        """
+        Args:
+          configs: OpenConfigs object
+
+        Returns:
+          ee: (nconf,) electron-electron energy
+
+          ei: (nconf,) electron-ion energy
+
+          ii: float, ion-ion energy
+        """
+        tracker = self.tracker(configs)
+        ee = 0.5 * np.sum(tracker.ee, axis=1)
+        return ee, np.sum(tracker.ei, axis=1), self.ii_energy
+
+
+def get_ecp(mol, configs, wf, threshold, ecp_species=None):
+    return eval_ecp.ecp(mol, configs, wf, threshold, ecp_species)
 
 
 def kinetic(configs, wf):
@@ -50,7 +135,7 @@ def kinetic(configs, wf):
     return ke
 
 
-def energy(mol, configs, wf, threshold):
+def energy(mol, configs, wf, threshold, ecp_species=None, coulomb=None):
     """Compute the local energy of a set of configurations.
     
     Args:
@@ -60,13 +145,22 @@ def energy(mol, configs, wf, threshold):
        
       wf: A Wavefunction-like object. Functions used include recompute(), lapacian(), and testvalue()
 
+      ecp_species: precomputed ECP data from eval_ecp.generate_ecp_species(); generated if None
+
+      coulomb: object whose energy(configs) returns the ee, ei and ii terms, such as OpenCoulomb or Ewald. If None, Ewald is used for periodic systems and the direct sums otherwise
+
     Returns: 
       a dictionary with energy components ke, ee, ei, and total
       """
-    ee = ee_energy(configs)
-    ei = ei_energy(mol, configs)
-    ecp_val = get_ecp(mol, configs, wf, threshold)
-    ii = ii_energy(mol)
+    if coulomb is None and hasattr(mol, "a"):
+        coulomb = Ewald(mol)
+    if coulomb is not None:
+        ee, ei, ii = coulomb.energy(configs)
+    else:
+        ee = ee_energy(configs)
+        ei = ei_energy(mol, configs)
+        ii = ii_energy(mol)
+    ecp_val = get_ecp(mol, configs, wf, threshold, ecp_species)
     ke = kinetic(configs, wf)
     # print(ke,ee,ei,ii)
     return {
@@ -1,5 +1,6 @@
 import numpy as np
 import copy
+from pyqmc.coord import get_rng
 
 """
 v_l object. c*r^{n-2}*exp{-e*r^2} 
@@ -14,10 +15,10 @@ class rnExp:
 
     def __call__(self, r):
         return np.sum(
-            r[:, np.newaxis] ** self.n
+            r[..., np.newaxis] ** self.n
             * self.c
-            * np.exp(-self.e * r[:, np.newaxis] ** 2),
-            axis=1,
+            * np.exp(-self.e * r[..., np.newaxis] ** 2),
+            axis=-1,
         )
 
 
@@ -152,22 +153,24 @@ def get_P_l(mol, configs, weights, epos_rot, l_list, e, at):
 #########################################################################
 
 
-def ecp_ea(mol, configs, wf, e, at, threshold):
+def ecp_ea_quadrature(mol, configs, wf, e, at, threshold):
     """ 
-    Returns the ECP value between electron e and atom at, local+nonlocal.
+    Returns the ECP terms between electron e and atom at, resolved over the quadrature points.
+    Returns:
+      local: nconf array, local part of the ECP
+      nonlocal_: nconf x naip array, nonlocal contribution of each quadrature point, including 
+        the wave function ratio. Zero for the configurations left out by ecp_mask().
+      epos_rot: nconf x naip x 3 array, positions of the quadrature points
     """
     nconf = configs.configs.shape[0]
-    ecp_val = np.zeros(nconf)
 
     l_list, v_l = get_v_l(mol, configs, e, at)
-    mask, prob = ecp_mask(v_l, threshold)
+    mask, prob = ecp_mask(v_l, threshold, get_rng(configs))
     masked_v_l = v_l[mask]
     masked_v_l[:, :-1] /= prob[mask, np.newaxis]
     masked_configs = configs.mask(mask)
 
-    naip = 6
-    if len(l_list) > 2:
-        naip = 12
+    naip = choose_quadrature(len(l_list) - 2)
 
     # Use masked objects internally
     weights, epos_rot = get_rot(mol, masked_configs, e, at, naip)
@@ -179,34 +182,236 @@ def ecp_ea(mol, configs, wf, e, at, threshold):
     ratio = get_wf_ratio(wf, configs, expanded_epos_rot, e, mask)
 
     # Compute local and non-local parts
-    ecp_val[mask] = np.einsum("ij,ik,ijk->i", ratio, masked_v_l, P_l)
+    nonlocal_ = np.zeros((nconf, naip))
+    nonlocal_[mask] = np.einsum("ij,ik,ijk->ij", ratio, masked_v_l, P_l)
     local_l = -1
-    ecp_val += v_l[:, local_l]
-    return ecp_val
+    return v_l[:, local_l], nonlocal_, expanded_epos_rot
+
+
+def ecp_ea(mol, configs, wf, e, at, threshold):
+    """ 
+    Returns the ECP value between electron e and atom at, local+nonlocal.
+    """
+    local, nonlocal_, epos_rot = ecp_ea_quadrature(mol, configs, wf, e, at, threshold)
+    return local + np.sum(nonlocal_, axis=1)
+
+
+def ecp_species(mol):
+    """
+    Returns a dictionary from the names of the atoms with an ECP to the list of their atom indices.
+    """
+    species = {}
+    for at, (name, coord) in enumerate(mol._atom):
+        if name in mol._ecp:
+            species.setdefault(name, []).append(at)
+    return species
 
 
-def ecp(mol, configs, wf, threshold):
+def ecp_cutoff(vl, tol, rmax=50.0, npts=5000):
+    """
+    Returns the radius beyond which all the v_l channels are smaller than tol in magnitude.
+    Raises ValueError if they are not yet below tol at rmax.
+    Parameters:
+      vl: dictionary of v_l functors from generate_ecp_functors()
+    """
+    r = np.linspace(rmax / npts, rmax, npts)
+    large = np.amax(np.abs([func(r) for func in vl.values()]), axis=0) > tol
+    if large[-1]:
+        raise ValueError(
+            "ECP channels are larger than tol={0} at rmax={1}; ".format(tol, rmax)
+            + "increase the tolerance or rmax"
+        )
+    if not np.any(large):
+        return 0.0
+    return r[np.nonzero(large)[0][-1] + 1]
+
+
+def generate_ecp_species(mol, tol=1e-8, naip=None):
+    """
+    Precomputes the ECP data of each species, to be passed to ecp() and ecp_e_quadrature().
+    Parameters:
+      tol: the v_l channels are neglected beyond the radius where they all fall below tol
+      naip: number of quadrature points, as an int for all species or a dictionary by species 
+        name. Species that are not given use choose_quadrature().
+    Returns:
+      dictionary from species name to a dictionary with
+        atoms: indices of the atoms of this species
+        coords: natom x 3 array of their positions
+        functors: v_l functors, see generate_ecp_functors()
+        rcut: radius beyond which all v_l are below tol; farther electron-atom pairs are skipped
+        tree: for open boundary conditions, a scipy cKDTree over the atoms, else None
+        kmax: the largest number of atoms within rcut of any point
+        naip: number of points of the quadrature rule
+    """
+    from scipy.spatial import cKDTree
+
+    if not isinstance(naip, dict):
+        naip = {name: naip for name in mol._ecp}
+    species = {}
+    for name, atoms in ecp_species(mol).items():
+        coords = np.asarray([mol._atom[at][1] for at in atoms])
+        vl = generate_ecp_functors(mol._ecp[name][1])
+        npts = naip.get(name)
+        if npts is None:
+            npts = choose_quadrature(len(vl) - 2)
+        rcut = ecp_cutoff(vl, tol)
+        tree = None if hasattr(mol, "a") else cKDTree(coords)
+        kmax = len(atoms)
+        if tree is not None:
+            kmax = max(len(n) for n in tree.query_ball_point(coords, 2 * rcut))
+        species[name] = dict(
+            atoms=atoms,
+            coords=coords,
+            functors=vl,
+            rcut=rcut,
+            tree=tree,
+            kmax=kmax,
+            naip=npts,
+        )
+    return species
+
+
+def ecp_pairs(species, configs, epos):
+    """
+    Returns the (configuration, atom) pairs of the electron positions epos (nconf x 3) that are
+    within rcut of the atoms of one species, found with the species' tree when there is one.
+    Returns:
+      ci: configuration indices
+      ai: atom indices, within the species
+      r_ea_vec: npair x 3 electron-atom distance vectors
+    """
+    if species["tree"] is not None:
+        d, ai = species["tree"].query(
+            epos, k=species["kmax"], distance_upper_bound=species["rcut"]
+        )
+        d, ai = d.reshape((len(epos), -1)), ai.reshape((len(epos), -1))
+        ci, slot = np.nonzero(np.isfinite(d))
+        ai = ai[ci, slot]
+        return ci, ai, epos[ci] - species["coords"][ai]
+    r_ea_vec = configs.dist.dist_i(species["coords"], epos)
+    ci, ai = np.nonzero(np.linalg.norm(r_ea_vec, axis=-1) < species["rcut"])
+    return ci, ai, r_ea_vec[ci, ai]
+
+
+def ecp_e_quadrature(mol, configs, wf, e, threshold, species=None):
+    """ 
+    Returns the ECP terms between electron e and all atoms, resolved over the quadrature points.
+    The radial functions are evaluated for all atoms of a species at once, and the wave function 
+    ratios for all (atom, quadrature point) pairs that pass ecp_mask() are computed in a single 
+    testvalue() call. Electron-atom pairs beyond the cutoff radius of the species are skipped.
+    Parameters:
+      species: precomputed ECP data from generate_ecp_species(); generated if None
+    Returns:
+      local: nconf array, local part of the ECP summed over atoms
+      nonlocal_: nconf x npts array, nonlocal contribution of each quadrature point, including 
+        the wave function ratio. Configurations with fewer points are padded with zeros.
+      epos_rot: nconf x npts x 3 array, positions of the quadrature points. Padding points are 
+        at the current position of electron e.
+    """
+    if species is None:
+        species = generate_ecp_species(mol)
+    nconf = configs.configs.shape[0]
+    rng = get_rng(configs)
+    epos = configs.configs[:, e, :]
+    local = np.zeros(nconf)
+    conf, coef, points = [], [], []
+    for sp in species.values():
+        ci, ai, r_ea_vec = ecp_pairs(sp, configs, epos)
+        r_ea = np.linalg.norm(r_ea_vec, axis=-1)
+        vl = sp["functors"]
+        v_l = np.zeros((len(ci), len(vl)))
+        for l, func in vl.items():  # -1,0,1,...
+            v_l[:, l] = func(r_ea)
+        local += np.bincount(ci, weights=v_l[:, -1], minlength=nconf)
+        if len(vl) == 1:  # local channel only
+            continue
+
+        mask, prob = ecp_mask(v_l, threshold, rng)
+        ci, ai, r_ea_vec, r_ea = ci[mask], ai[mask], r_ea_vec[mask], r_ea[mask]
+        masked_v_l = v_l[mask, :-1] / prob[mask, np.newaxis]
+        weights, rot = rotated_quadrature(r_ea, sp["naip"], rng)
+        rdotR = np.einsum("ik,ijk->ij", r_ea_vec, rot)
+        rdotR /= r_ea[:, np.newaxis] ** 2
+        # the factor (2l+1) and the integration weights are included here
+        P_l_val = np.stack(
+            [(2 * l + 1) * P_l(rdotR, l) * weights for l in range(len(vl) - 1)],
+            axis=-1,
+        )
+        conf.append(ci)
+        coef.append(np.einsum("ik,ijk->ij", masked_v_l, P_l_val))
+        points.append(epos[ci, np.newaxis] - r_ea_vec[:, np.newaxis] + rot)
+
+    if len(conf) == 0:
+        return local, np.zeros((nconf, 0)), np.zeros((nconf, 0, 3))
+
+    # Pack the points of each configuration into a padded nconf x npts array
+    naipmax = max(c.shape[1] for c in coef)
+    conf = np.concatenate(conf)
+    npair = np.bincount(conf, minlength=nconf)
+    order = np.argsort(conf, kind="stable")
+    slot = np.zeros(len(conf), dtype=int)
+    slot[order] = np.arange(len(conf)) - np.searchsorted(conf[order], conf[order])
+    nonlocal_ = np.zeros((nconf, np.amax(npair, initial=0), naipmax))
+    epos_rot = np.tile(epos[:, np.newaxis, np.newaxis], (1, *nonlocal_.shape[1:], 1))
+    start = 0
+    for c, p in zip(coef, points):
+        pairs = slice(start, start + len(c))
+        nonlocal_[conf[pairs], slot[pairs], : c.shape[1]] = c
+        epos_rot[conf[pairs], slot[pairs], : c.shape[1]] = p
+        start += len(c)
+    nonlocal_ = nonlocal_.reshape((nconf, -1))
+    epos_rot = epos_rot.reshape((nconf, -1, 3))
+
+    mask = npair > 0
+    if np.any(mask):
+        nonlocal_[mask] *= get_wf_ratio(wf, configs, epos_rot, e, mask)
+    return local, nonlocal_, epos_rot
+
+
+def ecp(mol, configs, wf, threshold, species=None):
     """
     Returns the ECP value, summed over all the electrons and atoms.
+    species is the precomputed ECP data from generate_ecp_species(); generated if None.
     """
     nconf, nelec = configs.configs.shape[0:2]
     ecp_tot = np.zeros(nconf)
     if mol._ecp != {}:
+        if species is None:
+            species = generate_ecp_species(mol)
         for e in range(nelec):
-            for at in range(len(mol._atom)):
-                ecp_tot += ecp_ea(mol, configs, wf, e, at, threshold)
+            local, nonlocal_, epos_rot = ecp_e_quadrature(
+                mol, configs, wf, e, threshold, species
+            )
+            ecp_tot += local + np.sum(nonlocal_, axis=1)
     return ecp_tot
 
 
-def ecp_mask(v_l, threshold):
+def ecp_tmoves(mol, configs, wf, e, threshold, tau, species=None):
+    """
+    Returns the T-move amplitudes of electron e for a time step tau, from the nonlocal 
+    quadrature terms of all atoms.
+    Returns:
+      t: nconf x npts array, max(-tau*V_nl(x',x) Psi(x')/Psi(x), 0) for each quadrature point x'
+      epos_rot: nconf x npts x 3 array, positions of the quadrature points
+    """
+    local, nonlocal_, epos_rot = ecp_e_quadrature(
+        mol, configs, wf, e, threshold, species
+    )
+    return np.maximum(-tau * nonlocal_, 0), epos_rot
+
+
+def ecp_mask(v_l, threshold, rng=None):
     """
     Returns a mask for configurations sized nconf
     based on values of v_l. Also returns acceptance probabilities
+    rng is the np.random.Generator to draw from; the global np.random state if None.
     """
-    l = 2 * np.arange(v_l.shape[1] - 1) + 1
-    prob = np.dot(np.abs(v_l[:, :-1]), threshold * (2 * l + 1))
+    if rng is None:
+        rng = np.random
+    l = 2 * np.arange(v_l.shape[-1] - 1) + 1
+    prob = np.dot(np.abs(v_l[..., :-1]), threshold * (2 * l + 1))
     prob = np.minimum(np.ones(prob.shape), prob)
-    accept = prob > np.random.uniform(low=0, high=1, size=prob.shape)
+    accept = prob > rng.uniform(low=0, high=1, size=prob.shape)
     return accept, prob
 
 
@@ -221,64 +426,104 @@ def get_rot(mol, configs, e, at, naip):
       epos_rot: positions of the rotated electron, nconf x naip x 3
       
     """
-    nconf = configs.configs.shape[0]
     apos = np.array(mol._atom[at][1])[np.newaxis, np.newaxis]
+    r_ea = np.linalg.norm(get_r_ea(mol, configs, e, at), axis=1)
+    weights, rot = rotated_quadrature(r_ea, naip, get_rng(configs))
+    epos_rot = apos + rot
+    return weights, epos_rot
 
-    r_ea_vec = get_r_ea(mol, configs, e, at)
-    r_ea = np.linalg.norm(r_ea_vec, axis=1)[:, np.newaxis, np.newaxis]
-
-    # t and p are sampled randomly over a sphere around the atom
-    t = np.random.uniform(low=0.0, high=np.pi, size=nconf)
-    p = np.random.uniform(low=0.0, high=2 * np.pi, size=nconf)
 
-    # rotated unit vectors:
-    i_rot, j_rot, k_rot = (
-        np.zeros([nconf, 1, 3]),
-        np.zeros([nconf, 1, 3]),
-        np.zeros([nconf, 1, 3]),
-    )
-    i_rot[:, 0, 0] = np.cos(p - np.pi / 2.0)
-    i_rot[:, 0, 1] = np.sin(p - np.pi / 2.0)
-    j_rot[:, 0, 0] = np.sin(t + np.pi / 2.0) * np.cos(p)
-    j_rot[:, 0, 1] = np.sin(t + np.pi / 2.0) * np.sin(p)
-    j_rot[:, 0, 2] = np.cos(t + np.pi / 2.0)
-    k_rot[:, 0, 0] = np.sin(t) * np.cos(p)
-    k_rot[:, 0, 1] = np.sin(t) * np.sin(p)
-    k_rot[:, 0, 2] = np.cos(t)
-
-    d1, d2 = np.zeros((naip, 1)), np.zeros((naip, 1))
-    if naip == 6:
-        d1[1] = np.pi
-
-        d1[2] = np.pi / 2.0
-
-        d1[3] = np.pi / 2.0
-        d2[3] = np.pi
-
-        d1[4] = np.pi / 2.0
-        d2[4] = np.pi / 2.0
-
-        d1[5] = np.pi / 2.0
-        d2[5] = 3.0 * np.pi / 2.0
-
-    elif naip == 12:
-        d1[1] = np.pi
-
-        fi0 = np.pi / 5.0
-        tha = np.arccos(1.0 / np.sqrt(5.0))
-        for i in range(5):
-            rk2 = 2 * i
-            d1[i + 2] = tha
-            d2[i + 2] = rk2 * fi0
-
-            d1[i + 7] = np.pi - tha
-            d2[i + 7] = (rk2 + 1) * fi0
-
-    epos_rot = apos + r_ea * (
-        i_rot * np.sin(d1) * np.cos(d2)
-        + j_rot * np.sin(d1) * np.sin(d2)
-        + k_rot * np.cos(d1)
+def rotated_quadrature(r_ea, naip, rng=None):
+    """
+    Returns the integration weights (naip), and the quadrature points on spheres of radius r_ea
+    around the atom, each with a random orientation (nrot x naip x 3)
+    Parameters:
+      r_ea: nrot array, electron-atom distances
+      naip: number of quadrature points, a key of quadrature_rules
+      rng: np.random.Generator for the orientations; the global np.random state if None
+    Returns:
+      weights: naip array
+      rot: quadrature points relative to the atom, nrot x naip x 3
+    """
+    degree, directions, weights = quadrature_rules[naip]
+    rotations = random_rotations(r_ea.shape[0], rng)
+    rot = r_ea[:, np.newaxis, np.newaxis] * np.einsum(
+        "ijk,nk->inj", rotations, directions
     )
-    weights = 1.0 / naip * np.ones(naip)
+    return weights, rot
 
-    return weights, epos_rot
+
+def random_rotations(n, rng=None):
+    """
+    Returns n x 3 x 3 rotation matrices distributed uniformly over the rotation group, 
+    built from normalized random quaternions drawn from rng (the global np.random state if None).
+    """
+    if rng is None:
+        rng = np.random
+    q = rng.normal(size=(n, 4))
+    q /= np.linalg.norm(q, axis=1)[:, np.newaxis]
+    w, x, y, z = q.T
+    return np.stack(
+        [
+            [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+            [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+            [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+        ]
+    ).transpose((2, 0, 1))
+
+
+def _orbit(v):
+    """All the distinct points obtained from permutations and sign changes of v"""
+    import itertools
+
+    points = set()
+    for p in itertools.permutations(v):
+        for signs in itertools.product([1, -1], repeat=3):
+            points.add(tuple(np.round(np.multiply(p, signs), 14) + 0.0))
+    return np.array(sorted(points))
+
+
+def _build_quadrature_rules():
+    """
+    Returns the quadrature rules on the unit sphere, as a dictionary from the number of points
+    to (degree, directions (npts x 3), weights (npts)). A rule of degree d integrates all 
+    polynomials of degree d or less exactly. Weights are normalized to one.
+    """
+    a1 = _orbit([1.0, 0, 0])
+    a2 = _orbit([1 / np.sqrt(2), 1 / np.sqrt(2), 0])
+    a3 = _orbit([1 / np.sqrt(3)] * 3)
+    tetrahedron = a3[np.prod(np.sign(a3), axis=1) > 0]
+    phi = (1 + np.sqrt(5)) / 2
+    rectangle = np.array([[0, 1, phi], [0, 1, -phi], [0, -1, phi], [0, -1, -phi]])
+    icosahedron = np.concatenate([np.roll(rectangle, k, axis=1) for k in range(3)])
+    icosahedron /= np.sqrt(1 + phi ** 2)
+    b1 = _orbit([1 / np.sqrt(11), 1 / np.sqrt(11), 3 / np.sqrt(11)])
+
+    def rule(degree, orbits, weights):
+        directions = np.concatenate(orbits)
+        w = np.concatenate([np.full(len(o), wi) for o, wi in zip(orbits, weights)])
+        return degree, directions, w
+
+    return {
+        4: rule(2, [tetrahedron], [1 / 4]),
+        6: rule(3, [a1], [1 / 6]),
+        12: rule(5, [icosahedron], [1 / 12]),
+        18: rule(5, [a1, a2], [1 / 30, 1 / 15]),
+        26: rule(7, [a1, a2, a3], [1 / 21, 4 / 105, 9 / 280]),
+        50: rule(
+            11, [a1, a2, a3, b1], [4 / 315, 64 / 2835, 27 / 1280, 14641 / 725760]
+        ),
+    }
+
+
+quadrature_rules = _build_quadrature_rules()
+
+
+def choose_quadrature(lmax):
+    """
+    Returns the number of points of the smallest quadrature rule with degree lmax+3 or higher,
+    where lmax is the largest nonlocal angular momentum of the ECP. This gives the 6 point 
+    rule for s-only ECPs and the 12 point rule up to d channels.
+    """
+    exact = [n for n, rule in quadrature_rules.items() if rule[0] >= lmax + 3]
+    return min(exact, key=lambda n: quadrature_rules[n][1].shape[0])
@@ -0,0 +1,177 @@
+import numpy as np
+from scipy.special import erfc
+from pyqmc.distance import MinimalImageDistance
+
+
+class StructureFactorTracker:
+    """Electron structure factor sum_e exp(iG.r_e) of each configuration, kept on
+    configs.trackers and updated in O(nk) whenever a single electron is moved."""
+
+    def __init__(self, gpoints, configs):
+        """
+        Args:
+          gpoints: (nk, 3) reciprocal lattice vectors
+
+          configs: PeriodicConfigs object to compute the structure factor of
+        """
+        self.gpoints = gpoints
+        self.positions = configs.configs.copy()
+        self.sf = np.zeros((self.positions.shape[0], gpoints.shape[0]), dtype=complex)
+        for e in range(self.positions.shape[1]):
+            self.sf += np.exp(1j * np.dot(self.positions[:, e], gpoints.T))
+
+    def move(self, configs, e, new, accept):
+        old = self.positions[accept, e]
+        newpos = new.configs[accept]
+        self.sf[accept] += np.exp(1j * np.dot(newpos, self.gpoints.T)) - np.exp(
+            1j * np.dot(old, self.gpoints.T)
+        )
+        self.positions[accept, e] = newpos
+
+    def resample(self, newinds):
+        self.sf = self.sf[newinds]
+        self.positions = self.positions[newinds]
+
+    def is_current(self, configs):
+        return self.positions.shape == configs.configs.shape and np.array_equal(
+            self.positions, configs.configs
+        )
+
+
+class Ewald:
+    """Ewald summation of the Coulomb energy of electrons and ions in a periodic cell.
+    The k-vector set and all terms that depend only on the ions are computed once;
+    the electron structure factor is cached on the configs (see
+    StructureFactorTracker), so each evaluation only needs the real-space sums."""
+
+    def __init__(self, cell, precision=1e-12):
+        """
+        Args:
+          cell: pyscf Cell object; a, atom_charges() and atom_coords() are used
+
+          precision: neglected terms in the real-space and reciprocal sums are
+            smaller than about this
+        """
+        self.latvec = np.asarray(cell.a)
+        self.volume = np.abs(np.linalg.det(self.latvec))
+        self.dist = MinimalImageDistance(self.latvec)
+        self.shifts = self.dist.shifts
+        self.charges = cell.atom_charges()
+        self.coords = cell.atom_coords()
+
+        # Smallest distance between lattice planes; the real-space sum is converged
+        # within it, so only the minimal image and its nearest neighbors are needed
+        cross = np.cross(self.latvec[[1, 2, 0]], self.latvec[[2, 0, 1]])
+        hmin = np.min(self.volume / np.linalg.norm(cross, axis=1))
+        logp = np.sqrt(-np.log(precision))
+        self.alpha = logp / hmin
+        self.gpoints, self.gweight = self._generate_gpoints(2 * self.alpha * logp)
+
+        ion_phases = np.exp(1j * np.dot(self.coords, self.gpoints.T))
+        self.ion_sf = np.dot(self.charges, ion_phases)
+        self.ii_energy = self._ii_energy()
+
+    def _generate_gpoints(self, gmax):
+        """Reciprocal lattice vectors with |G| <= gmax in half of reciprocal space
+        (G and -G contribute equally), and their weights 4pi/V exp(-G^2/4a^2)/G^2"""
+        recvec = 2 * np.pi * np.linalg.inv(self.latvec).T
+        nmax = np.ceil(gmax * np.linalg.norm(self.latvec, axis=1) / (2 * np.pi))
+        ranges = [np.arange(-n, n + 1) for n in nmax.astype(int)]
+        pts = np.array([m.ravel() for m in np.meshgrid(*ranges, indexing="ij")]).T
+        half = (pts[:, 0] > 0) | (
+            (pts[:, 0] == 0) & ((pts[:, 1] > 0) | ((pts[:, 1] == 0) & (pts[:, 2] > 0)))
+        )
+        gpoints = np.dot(pts[half], recvec)
+        g2 = np.sum(gpoints ** 2, axis=1)
+        keep = g2 <= gmax ** 2
+        gpoints, g2 = gpoints[keep], g2[keep]
+        gweight = 4 * np.pi / self.volume * np.exp(-g2 / (4 * self.alpha ** 2)) / g2
+        return gpoints, gweight
+
+    def _real_space(self, dists):
+        """sum over lattice shifts of erfc(a|r+n|)/|r+n|, for minimal image vectors
+        dists (..., 3); returns an array of shape dists.shape[:-1]"""
+        tot = np.zeros(dists.shape[:-1])
+        for shift in self.shifts:
+            r = np.linalg.norm(dists + shift, axis=-1)
+            tot += erfc(self.alpha * r) / r
+        return tot
+
+    def _image_energy(self):
+        """Interaction of a unit charge with its own periodic images"""
+        images = self.shifts[np.any(self.dist.point_list != 0, axis=1)]
+        r = np.linalg.norm(images, axis=1)
+        return 0.5 * np.sum(erfc(self.alpha * r) / r)
+
+    def _self_energy(self, q2, q):
+        """Self-interaction and neutralizing-background terms for total squared
+        charge q2 and total charge q"""
+        return -self.alpha / np.sqrt(np.pi) * q2 - np.pi * q ** 2 / (
+            2 * self.volume * self.alpha ** 2
+        )
+
+    def _ii_energy(self):
+        zsum = np.sum(self.charges)
+        z2sum = np.sum(self.charges ** 2)
+        ii = z2sum * self._image_energy() + self._self_energy(z2sum, zsum)
+        ii += np.sum(self.gweight * np.abs(self.ion_sf) ** 2)
+        if len(self.charges) > 1:
+            rij, ij = self.dist.dist_matrix(self.coords[np.newaxis])
+            i, j = np.asarray(ij).T
+            zz = self.charges[i] * self.charges[j]
+            ii += np.sum(zz * self._real_space(rij[0]))
+        return ii
+
+    def structure_factor(self, configs):
+        """Electron structure factor of configs, from configs.trackers if it is up to
+        date; otherwise it is recomputed and tracked from here on.
+
+        Returns:
+          sf: (nconf, nk) array of sum_e exp(iG.r_e)
+        """
+        tracker = configs.trackers.get("ewald", None)
+        if (
+            tracker is None
+            or tracker.gpoints is not self.gpoints
+            or not tracker.is_current(configs)
+        ):
+            tracker = StructureFactorTracker(self.gpoints, configs)
+            configs.trackers["ewald"] = tracker
+        return tracker.sf
+
+    def ee_energy(self, configs, sf=None):
+        nconf, nelec = configs.configs.shape[:2]
+        if sf is None:
+            sf = self.structure_factor(configs)
+        ee = np.dot(np.abs(sf) ** 2, self.gweight)
+        ee += nelec * self._image_energy() + self._self_energy(nelec, nelec)
+        if nelec > 1:
+            rij, ij = configs.dist.dist_matrix(configs.configs)
+            ee += np.sum(self._real_space(rij), axis=1)
+        return ee
+
+    def ei_energy(self, configs, sf=None):
+        nconf, nelec = configs.configs.shape[:2]
+        if sf is None:
+            sf = self.structure_factor(configs)
+        ei = -2 * np.dot(np.real(sf * self.ion_sf.conj()), self.gweight)
+        ei += np.pi * nelec * np.sum(self.charges) / (self.volume * self.alpha ** 2)
+        for c, coord in zip(self.charges, self.coords):
+            dists = configs.dist.dist_i(configs.configs, np.tile(coord, (nconf, 1)))
+            ei += -c * np.sum(self._real_space(dists), axis=1)
+        return ei
+
+    def energy(self, configs):
+        """
+        Args:
+          configs: PeriodicConfigs object
+
+        Returns:
+          ee: (nconf,) electron-electron energy
+
+          ei: (nconf,) electron-ion energy
+
+          ii: float, ion-ion energy
+        """
+        sf = self.structure_factor(configs)
+        return self.ee_energy(configs, sf), self.ei_energy(configs, sf), self.ii_energy
@@ -0,0 +1,131 @@
+"""Columnar output of step data in HDF5 files.
+
+Each key of the step dictionaries returned by vmc(), rundmc() and the optimizers is
+stored as one dataset, whose first index is the row (step or iteration); array-valued
+quantities keep their shape in the remaining indices. Rows are appended to resizable,
+chunked datasets, so the cost of writing a row does not depend on how many rows the
+file already holds. The data can be read back with read_hdf().
+
+Requires h5py.
+"""
+import h5py
+import numpy as np
+
+
+def append_hdf(f, data):
+    """Append one row to the datasets of the file or group f.
+
+    Args:
+      f: h5py File or Group
+
+      data: dictionary of numbers or arrays. A dataset is created for each new key;
+        its earlier rows, and the rows of keys missing from data (such as accumulators
+        that are evaluated only every few steps), hold NaN. None values are treated as
+        missing. Real numbers, including integers, are stored as float64 and complex
+        numbers as complex128, so a key whose values change type is not truncated.
+        The shape of the values of a key must not change; a ValueError is raised
+        otherwise.
+    """
+    nrows = max(
+        (d.shape[0] for d in f.values() if isinstance(d, h5py.Dataset)), default=0
+    )
+    row = {}
+    for k, v in data.items():
+        if v is None:
+            continue
+        v = np.asarray(v)
+        if np.issubdtype(v.dtype, np.complexfloating):
+            v = v.astype(np.complex128)
+        elif np.issubdtype(v.dtype, np.number) or v.dtype == bool:
+            v = v.astype(np.float64)
+        if k in f and f[k].shape[1:] != v.shape:
+            raise ValueError(
+                "the shape of {0} changed from {1} to {2}; ".format(
+                    k, f[k].shape[1:], v.shape
+                )
+                + "quantities whose shape varies must be stored separately"
+            )
+        row[k] = v
+    for k, v in row.items():
+        if k not in f:
+            fill = np.nan if np.issubdtype(v.dtype, np.inexact) else 0
+            f.create_dataset(
+                k,
+                shape=(nrows, *v.shape),
+                maxshape=(None, *v.shape),
+                dtype=v.dtype,
+                chunks=True,
+                fillvalue=fill,
+            )
+    for d in f.values():
+        if isinstance(d, h5py.Dataset):
+            d.resize(nrows + 1, axis=0)
+    for k, v in row.items():
+        f[k][nrows] = v
+
+
+def append(filename, rows, group=None):
+    """Append the dictionaries in rows to the file filename (see append_hdf()), which is
+    created if needed. If group is given, the datasets are in that group."""
+    with Appender(filename, group) as appender:
+        appender.append(rows)
+
+
+class Appender:
+    """Keeps a file open to append rows to it during a run, instead of opening it for
+    each step. The file is flushed after each append(), so that the rows written so
+    far are in the file if the run stops. Close it with close(), or use the object
+    as a context manager."""
+
+    def __init__(self, filename, group=None):
+        """
+        Args:
+          filename: HDF5 file, created if needed
+
+          group: if given, the datasets are in that group
+        """
+        self.file = h5py.File(filename, "a")
+        self.group = self.file if group is None else self.file.require_group(group)
+
+    def append(self, rows):
+        """Append the dictionaries in rows (see append_hdf())"""
+        for row in rows:
+            append_hdf(self.group, row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def truncate(filename, key, value, group=None):
+    """Drop the rows at the end of the file with data[key] >= value, such as the steps
+    after a checkpoint that are run again on restart."""
+    with h5py.File(filename, "a") as f:
+        g = f if group is None else f.get(group, {})
+        if key not in g:
+            return
+        nrows = int(np.sum(g[key][()] < value))
+        for d in g.values():
+            if isinstance(d, h5py.Dataset):
+                d.resize(nrows, axis=0)
+
+
+def read_hdf(filename, group=None):
+    """Returns a dictionary of the datasets in filename (or in its group), with one row
+    per step"""
+    with h5py.File(filename, "r") as f:
+        g = f if group is None else f[group]
+        return {k: d[()] for k, d in g.items() if isinstance(d, h5py.Dataset)}
+
+
+def read_records(filename, group=None):
+    """The rows of read_hdf() as a list of dictionaries, as returned by the drivers"""
+    data = read_hdf(filename, group)
+    nrows = min((len(v) for v in data.values()), default=0)
+    return [{k: v[i] for k, v in data.items()} for i in range(nrows)]
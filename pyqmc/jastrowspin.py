@@ -126,6 +126,15 @@ class JastrowSpin:
         self._update_b_partial(e, epos, mask)
         self._configscurrent.move(e, epos, mask)
 
+    def resample(self, newinds):
+        """Resample the a and b sums and partial sums by new walker indices, in the
+        same way as configs.resample(newinds)."""
+        self._configscurrent.resample(newinds)
+        self._avalues = self._avalues[newinds]
+        self._bvalues = self._bvalues[newinds]
+        self._a_partial = self._a_partial[:, newinds]
+        self._b_partial = self._b_partial[:, newinds]
+
     def _a_update(self, e, epos, mask):
         r"""
           Calculate a (e-ion) partial sum for electron e
@@ -200,6 +209,12 @@ class JastrowSpin:
             self._b_partial[e, mask, l, 0] = bval[:, :sep].sum(axis=1)
             self._b_partial[e, mask, l, 1] = bval[:, sep:].sum(axis=1)
 
+    def recompute_parameters(self, configs, changed):
+        """Log value after the parameters in changed were modified, for the configs of
+        the last recompute(). The basis sums do not depend on the coefficients, so
+        nothing needs to be recomputed."""
+        return self.value()
+
     def value(self):
         """Compute the current log value of the wavefunction"""
         u = np.sum(self._bvalues * self.parameters["bcoeff"], axis=(2, 1))
@@ -241,6 +256,24 @@ class JastrowSpin:
 
     def gradient_laplacian(self, e, epos):
         """ """
+        bgrad, blap = self.basis_gradient_laplacian(e, epos)
+        grad = np.einsum("dijkl,jkl->di", bgrad["acoeff"], self.parameters["acoeff"])
+        grad += np.einsum("dikl,kl->di", bgrad["bcoeff"], self.parameters["bcoeff"])
+        lap = np.einsum("ijkl,jkl->i", blap["acoeff"], self.parameters["acoeff"])
+        lap += np.einsum("ikl,kl->i", blap["bcoeff"], self.parameters["bcoeff"])
+        return grad, lap + np.sum(grad ** 2, axis=0)
+
+    def basis_gradient_laplacian(self, e, epos):
+        """Derivatives of the gradient and laplacian of U = ln J for electron e with
+        respect to the coefficients. Since U is linear in the coefficients, these do
+        not depend on them; gradient_laplacian() contracts them with the coefficients.
+
+        Returns:
+          grad: dictionary of arrays of shape (3, nconf) + parameter shape
+
+          lap: dictionary of arrays of shape (nconf,) + parameter shape; the
+            laplacian of U only, without the |grad U|^2 term of the laplacian of J
+        """
         nconf, nelec = self._configscurrent.configs.shape[:2]
         nup = self._mol.nelec[0]
 
@@ -254,23 +287,25 @@ class JastrowSpin:
         eup = int(e < nup)
         edown = int(e >= nup)
 
-        grad = np.zeros((3, nconf))
-        lap = np.zeros(nconf)
+        agrad = np.zeros((3, nconf) + self.parameters["acoeff"].shape)
+        alap = np.zeros((nconf,) + self.parameters["acoeff"].shape)
+        bgrad = np.zeros((3, nconf) + self.parameters["bcoeff"].shape)
+        blap = np.zeros((nconf,) + self.parameters["bcoeff"].shape)
         # a-value component
-        for c, a in zip(self.parameters["acoeff"].transpose()[edown], self.a_basis):
+        for k, a in enumerate(self.a_basis):
             g, l = a.gradient_laplacian(dinew, rinew)
-            grad += np.einsum("j,ijk->ki", c, g)
-            lap += np.einsum("j,ijk->i", c, l)
+            agrad[:, :, :, k, edown] = g.transpose((2, 0, 1))
+            alap[:, :, k, edown] = np.sum(l, axis=-1)
 
         # b-value component
-        for c, b in zip(self.parameters["bcoeff"], self.b_basis):
-            bgrad, blap = b.gradient_laplacian(dnew, rnew)
-            grad += c[edown] * np.sum(bgrad[:, : nup - eup], axis=1).T
-            grad += c[1 + edown] * np.sum(bgrad[:, nup - eup :], axis=1).T
-            lap += c[edown] * np.sum(blap[:, : nup - eup], axis=(1, 2))
-            lap += c[1 + edown] * np.sum(blap[:, nup - eup :], axis=(1, 2))
-
-        return grad, lap + np.sum(grad ** 2, axis=0)
+        for k, b in enumerate(self.b_basis):
+            g, l = b.gradient_laplacian(dnew, rnew)
+            bgrad[:, :, k, edown] = np.sum(g[:, : nup - eup], axis=1).T
+            bgrad[:, :, k, 1 + edown] = np.sum(g[:, nup - eup :], axis=1).T
+            blap[:, k, edown] = np.sum(l[:, : nup - eup], axis=(1, 2))
+            blap[:, k, 1 + edown] = np.sum(l[:, nup - eup :], axis=(1, 2))
+
+        return {"acoeff": agrad, "bcoeff": bgrad}, {"acoeff": alap, "bcoeff": blap}
 
     def laplacian(self, e, epos):
         return self.gradient_laplacian(e, epos)[1]
@@ -0,0 +1,142 @@
+import numpy as np
+from pyqmc.jastrowspin import JastrowSpin
+from pyqmc.multiplywf import MultiplyWF
+
+
+class LinearJastrowEnergy:
+    r"""Log value and kinetic energy of a wave function as functions of the
+    coefficients c of its JastrowSpin factor, for a fixed set of configurations.
+
+    With $\Psi = D e^{U}$ and $U = \sum_k c_k u_k$, the log value is
+    $\ln|D| + \sum_k c_k u_k$ and the kinetic energy of each walker is the quadratic
+    $$-\frac{1}{2}\sum_e \left[\frac{\nabla_e^2 D}{D} + c \cdot \nabla_e^2 u
+    + |c \cdot \nabla_e u|^2 + 2 \frac{\nabla_e D}{D} \cdot (c \cdot \nabla_e u)\right].$$
+    The basis sums u_k, their gradients and laplacians are computed once, so new
+    coefficients are evaluated with small matrix products instead of a recompute.
+    The memory used is (nconf, nparam, nparam).
+    """
+
+    def __init__(self, wf, configs, jastrow, other=None, prefix=""):
+        """
+        Args:
+          wf: wave function; it is recomputed for configs
+
+          jastrow: the JastrowSpin factor of wf
+
+          other: the rest of wf, or None if wf is the Jastrow factor
+
+          prefix: prefix of the Jastrow coefficients in wf.parameters
+        """
+        self.jastrow = jastrow
+        self.prefix = prefix
+        self.keys = list(jastrow.parameters.keys())
+        nconf, nelec = configs.configs.shape[:2]
+
+        logval = np.real(wf.recompute(configs)[1])
+        self.basis = self._flatten(jastrow.pgradient(), 1)
+        c0 = self.coefficients({})
+        self.logref = logval - np.dot(self.basis, c0)
+
+        nparam = len(c0)
+        self.ke_const = np.zeros(nconf)
+        self.ke_linear = np.zeros((nconf, nparam))
+        self.ke_quadratic = np.zeros((nconf, nparam, nparam))
+        for e in range(nelec):
+            epos = configs.electron(e)
+            bgrad, blap = jastrow.basis_gradient_laplacian(e, epos)
+            bgrad = self._flatten(bgrad, 2)
+            self.ke_linear -= 0.5 * self._flatten(blap, 1)
+            self.ke_quadratic -= 0.5 * np.einsum("dip,diq->ipq", bgrad, bgrad)
+            if other is not None:
+                g, l = other.gradient_laplacian(e, epos)
+                self.ke_const -= 0.5 * np.real(l)
+                self.ke_linear -= np.einsum("di,dip->ip", np.real(g), bgrad)
+
+    def _flatten(self, d, ndim):
+        """Concatenate the parameter axes of a dictionary of arrays whose first ndim
+        axes are not parameter axes"""
+        return np.concatenate(
+            [d[k].reshape(d[k].shape[:ndim] + (-1,)) for k in self.keys], axis=-1
+        )
+
+    def coefficients(self, parameters):
+        """Flattened Jastrow coefficients, from parameters (a dictionary with the keys
+        of wf.parameters) where given and the current ones otherwise"""
+        return np.concatenate(
+            [
+                np.ravel(parameters.get(self.prefix + k, self.jastrow.parameters[k]))
+                for k in self.keys
+            ]
+        )
+
+    def indices(self, keys):
+        """Positions in the flattened coefficients of the parameters in keys"""
+        inds = []
+        n = 0
+        for k in self.keys:
+            size = self.jastrow.parameters[k].size
+            if self.prefix + k in keys:
+                inds.extend(range(n, n + size))
+            n += size
+        return np.array(inds, dtype=int)
+
+    def split(self, c):
+        """Dictionary of the Jastrow parameters, with the keys of wf.parameters, from
+        flattened coefficients c"""
+        d = {}
+        n = 0
+        for k in self.keys:
+            shape = self.jastrow.parameters[k].shape
+            d[self.prefix + k] = c[n : n + np.prod(shape)].reshape(shape)
+            n += np.prod(shape)
+        return d
+
+    def __call__(self, parameters):
+        """
+        Returns:
+          logval: (nconf,) log |psi| with the coefficients in parameters
+
+          ke: (nconf,) kinetic energy with the coefficients in parameters
+        """
+        return self.evaluate(self.coefficients(parameters))
+
+    def evaluate(self, c):
+        """Like __call__(), for flattened coefficients c"""
+        logval = self.logref + np.dot(self.basis, c)
+        ke = self.ke_const + np.dot(self.ke_linear, c)
+        ke += np.einsum("ipq,p,q->i", self.ke_quadratic, c, c)
+        return logval, ke
+
+    def gradient(self, c):
+        """
+        Returns:
+          dlogval: (nconf, nparam) derivatives of log |psi| at flattened coefficients c
+
+          dke: (nconf, nparam) derivatives of the kinetic energy
+        """
+        return self.basis, self.ke_linear + 2 * np.dot(self.ke_quadratic, c)
+
+
+def find_jastrow(wf, keys):
+    """Returns (jastrow, other, prefix) if all parameters in keys are coefficients of a
+    JastrowSpin factor of wf, and None otherwise. jastrow is that factor, other the
+    rest of wf (None if wf is the Jastrow factor), and prefix the prefix of the
+    Jastrow coefficients in wf.parameters."""
+    if isinstance(wf, JastrowSpin):
+        return wf, None, ""
+    if isinstance(wf, MultiplyWF):
+        factors = [("wf2", wf.wf2, wf.wf1), ("wf1", wf.wf1, wf.wf2)]
+        for prefix, jastrow, other in factors:
+            if isinstance(jastrow, JastrowSpin) and all(k[:3] == prefix for k in keys):
+                return jastrow, other, prefix
+    return None
+
+
+def linear_jastrow_energy(wf, configs, keys):
+    """Returns a LinearJastrowEnergy for wf and configs if all parameters in keys are
+    coefficients of a JastrowSpin factor of wf, and None otherwise"""
+    found = find_jastrow(wf, keys)
+    if found is None:
+        return None
+    jastrow, other, prefix = found
+    return LinearJastrowEnergy(wf, configs, jastrow, other, prefix)
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 import scipy
+from pyqmc.reblock import equilibration_steps
 
 
 def sr_update(pgrad, Sij, step, eps=0.1):
@@ -19,6 +20,75 @@ def sr12_update(pgrad, Sij, step, eps=0.1):
     return -v * step  # / np.linalg.norm(v)
 
 
+class SROperator:
+    """The overlap matrix S_ij = <dp_i dp_j> - <dp_i><dp_j> of stochastic
+    reconfiguration, stored as the per-walker parameter derivatives dp instead of
+    an (nparam, nparam) matrix. Like a numpy array, it provides dot() and
+    diagonal(), so it can be passed to sr_cg_update() in place of Sij."""
+
+    def __init__(self, dp):
+        """
+        Args:
+          dp: (nconf, nparam) array of d log psi / dp for each walker, for example
+            the dpwalker rows of a matrix_free PGradTransform from several steps
+        """
+        self.dp = dp
+        self.dpmean = np.mean(dp, axis=0)
+        self.shape = (dp.shape[1], dp.shape[1])
+
+    def dot(self, v):
+        Sv = np.dot(self.dp.T, np.dot(self.dp, v)) / self.dp.shape[0]
+        return Sv - self.dpmean * np.dot(self.dpmean, v)
+
+    def diagonal(self):
+        return np.mean(self.dp ** 2, axis=0) - self.dpmean ** 2
+
+
+def conjugate_gradient(matvec, b, precond, tol=1e-6, maxiter=None):
+    """Solve A x = b for a symmetric positive definite A given only the products
+    matvec(v) = A v, with the diagonal preconditioner precond ~ 1/diag(A)."""
+    x = np.zeros_like(b)
+    r = b.copy()
+    z = precond * r
+    p = z.copy()
+    rz = np.dot(r, z)
+    bnorm = np.linalg.norm(b)
+    if maxiter is None:
+        maxiter = 10 * len(b)
+    for i in range(maxiter):
+        if np.linalg.norm(r) <= tol * bnorm:
+            break
+        Ap = matvec(p)
+        alpha = rz / np.dot(p, Ap)
+        x += alpha * p
+        r -= alpha * Ap
+        z = precond * r
+        rznew = np.dot(r, z)
+        p = z + (rznew / rz) * p
+        rz = rznew
+    return x
+
+
+def sr_cg_update(pgrad, Sij, step, eps=0.1, eps_rel=0.0, tol=1e-6):
+    """Like sr_update(), but solves (S + shift) v = pgrad by conjugate gradient, so
+    that only products S.v are needed. Sij can be a dense matrix or an SROperator.
+
+    Args:
+      eps: constant diagonal shift, as in sr_update()
+
+      eps_rel: additional shift eps_rel*S_ii, which damps each parameter relative to
+        its own variance
+    """
+    diag = Sij.diagonal()
+    shift = eps + eps_rel * diag
+
+    def matvec(v):
+        return Sij.dot(v) + shift * v
+
+    v = conjugate_gradient(matvec, pgrad, 1.0 / (diag + shift), tol=tol)
+    return -v * step
+
+
 def line_minimization(
     wf,
     coords,
@@ -31,10 +101,13 @@ def line_minimization(
     lm=None,
     lmoptions=None,
     dataprefix="",
-    update=sr_update,
+    update=None,
     update_kws=None,
     verbose=2,
     npts=5,
+    checkpoint=None,
+    restart=False,
+    hdf_file=None,
 ):
     """Optimizes energy by determining gradients with stochastic reconfiguration
         and minimizing the energy along gradient directions using correlated sampling.
@@ -49,7 +122,7 @@ def line_minimization(
 
       steprange: How far to search in the line minimization
 
-      warmup: number of steps to use for vmc warmup; if None, same as in vmcoptions
+      warmup: number of initial VMC steps to discard in each evaluation of the gradient. If "auto", the walkers are not warmed up separately, and the steps to discard are detected from the energy trace (see reblock.equilibration_steps()); the walkers then carry over between iterations with as little warmup as is needed.
 
       maxiters: (maximum) number of steps in the gradient descent
 
@@ -61,7 +134,7 @@ def line_minimization(
 
       lmoptions: a dictionary of options for the lm method
 
-      update: A function that generates a parameter change 
+      update: A function that generates a parameter change. Defaults to sr_update, or to sr_cg_update if pgrad_acc is matrix_free; Sij is then an SROperator built from the walkers of the last pgrad_acc.walker_steps VMC steps, and update must accept it (sr_cg_update or sd_update).
 
       update_kws: Any keywords 
 
@@ -69,6 +142,12 @@ def line_minimization(
 
       npts: number of points to fit to in each line minimization
 
+      checkpoint: a checkpoint.Checkpoint; the parameters, configurations and random state are saved every checkpoint.interval iterations
+
+      restart: if True and the checkpoint file exists, continue from it with the same configurations, skipping the warmup. The data of earlier iterations is read back from the files written with dataprefix (or from hdf_file).
+
+      hdf_file: name of an HDF5 file to write the data to instead of the JSON files, with the gradient data in the group "grad" and the line minimization data in the group "line" (see hdftools). Each iteration only appends its own rows.
+
     Returns:
 
       wf: optimized wave function
@@ -88,49 +167,75 @@ def line_minimization(
         lm = lm_sampler
     if lmoptions is None:
         lmoptions = {}
+    matrix_free = getattr(pgrad_acc, "matrix_free", False)
+    if update is None:
+        update = sr_cg_update if matrix_free else sr_update
     if update_kws is None:
         update_kws = {}
+    if hdf_file is not None:
+        import pyqmc.hdftools as hdftools
 
     def gradient_energy_function(x, coords):
         newparms = pgrad_acc.transform.deserialize(x)
         for k in newparms:
             wf.parameters[k] = newparms[k]
         data, coords = vmc(wf, coords, accumulators={"pgrad": pgrad_acc}, **vmcoptions)
-        df = pd.DataFrame(data)[warmup:]
+        df = pd.DataFrame(data)
+        if warmup == "auto":
+            df = df[equilibration_steps(df["pgradtotal"]) :]
+        else:
+            df = df[warmup:]
         en = np.mean(df["pgradtotal"])
         en_err = np.std(df["pgradtotal"]) / np.sqrt(len(df))
         dpH = np.mean(df["pgraddpH"], axis=0)
         dp = np.mean(df["pgraddppsi"], axis=0)
-        dpdp = np.mean(df["pgraddpidpj"], axis=0)
         grad = 2 * (dpH - en * dp)
-        Sij = dpdp - np.einsum("i,j->ij", dp, dp)  # + eps*np.eye(dpdp.shape[0])
-        return coords, df["pgradtotal"].values[-1], grad, Sij, en, en_err
+        if matrix_free:
+            Sij = SROperator(np.concatenate(df["pgraddpwalker"].dropna().values))
+        else:
+            dpdp = np.mean(df["pgraddpidpj"], axis=0)
+            Sij = dpdp - np.einsum("i,j->ij", dp, dp)  # + eps*np.eye(dpdp.shape[0])
+        return coords, len(data) - len(df), grad, Sij, en, en_err
 
     x0 = pgrad_acc.transform.serialize_parameters(wf.parameters)
     datagrad = []
     datatest = []
+    start = 0
+    if checkpoint is not None and restart and checkpoint.exists():
+        state = checkpoint.restore(coords, wf)
+        start, x0 = state["step"], state["x0"].copy()
+        if start > 0 and hdf_file is not None:
+            for group in ["grad", "line"]:
+                hdftools.truncate(hdf_file, "iter", start, group)
+            datagrad = hdftools.read_records(hdf_file, "grad")
+            datatest = hdftools.read_records(hdf_file, "line")
+        elif start > 0:
+            datagrad = _read_records(dataprefix + "grad.json")
+            datatest = _read_records(dataprefix + "line.json")
 
     # VMC warm up period
-    print("starting warmup")
-    data, coords = vmc(wf, coords, accumulators={}, **vmcoptions)
-    print("warmup finished, nsteps", len(data))
+    if warmup != "auto" and start == 0:
+        print("starting warmup")
+        data, coords = vmc(wf, coords, accumulators={}, **vmcoptions)
+        print("warmup finished, nsteps", len(data))
 
     # Gradient descent cycles
-    for it in range(maxiters):
+    for it in range(start, maxiters):
         # Calculate gradient accurately
-        coords, last_en, pgrad, Sij, en, en_err = gradient_energy_function(x0, coords)
+        coords, ndiscard, pgrad, Sij, en, en_err = gradient_energy_function(x0, coords)
         datagrad.append(
             {
                 "pgrad": pgrad,
-                "S": Sij,
+                "S": Sij if isinstance(Sij, np.ndarray) else None,
                 "en": en,
                 "en_err": en_err,
                 "iter": it,
                 "params": x0.copy(),
+                "warmup": ndiscard,
             }
         )
 
-        print("descent en", en, en_err)
+        print("descent en", en, en_err, "discarded steps", ndiscard)
         print("descent |grad|", np.linalg.norm(pgrad), flush=True)
 
         xfit = []
@@ -187,8 +292,17 @@ def line_minimization(
 
         x0 += update(pgrad, Sij, est_min, **update_kws)
 
-        pd.DataFrame(datagrad).to_json(dataprefix + "grad.json")
-        pd.DataFrame(datatest).to_json(dataprefix + "line.json")
+        if hdf_file is not None:
+            hdftools.append(hdf_file, datagrad[-1:], "grad")
+            hdftools.append(hdf_file, dfs, "line")
+        else:
+            pd.DataFrame(datagrad).to_json(dataprefix + "grad.json")
+            pd.DataFrame(datatest).to_json(dataprefix + "line.json")
+        if checkpoint is not None and checkpoint.due(it + 1):
+            checkpoint.save(it + 1, coords, wf, x0=x0)
+
+    if checkpoint is not None:
+        checkpoint.wait()
 
     newparms = pgrad_acc.transform.deserialize(x0)
     for k in newparms:
@@ -197,6 +311,16 @@ def line_minimization(
     return wf, datagrad, datatest
 
 
+def _read_records(filename):
+    """List of dictionaries from a file written with pd.DataFrame(...).to_json()"""
+    records = pd.read_json(filename).to_dict("records")
+    for r in records:
+        for k, v in r.items():
+            if isinstance(v, list):
+                r[k] = np.array(v)
+    return records
+
+
 def lm_sampler(wf, configs, params, pgrad_acc):
     """ 
     Evaluates accumulator on the same set of configs for correlated sampling of different wave function parameters
@@ -215,17 +339,50 @@ def lm_sampler(wf, configs, params, pgrad_acc):
 
     import copy
     import numpy as np
+    from pyqmc.multiplywf import recompute_parameters
+    from pyqmc.linearjastrow import linear_jastrow_energy
+
+    # Without ECPs, only the kinetic energy depends on the Jastrow coefficients,
+    # and it can be evaluated for all parameter sets from one set of basis sums
+    if getattr(pgrad_acc.enacc, "ecp_species", None) == {}:
+        linear = linear_jastrow_energy(wf, configs, pgrad_acc.transform.to_opt)
+        if linear is not None:
+            return _linear_jastrow_sampler(wf, configs, params, pgrad_acc, linear)
 
     data = []
     psi0 = wf.recompute(configs)[1]  # recompute gives logdet
     for p in params:
         newparms = pgrad_acc.transform.deserialize(p)
+        changed = [
+            k for k in newparms if not np.array_equal(newparms[k], wf.parameters[k])
+        ]
         for k in newparms:
             wf.parameters[k] = newparms[k]
-        psi = wf.recompute(configs)[1]  # recompute gives logdet
+        # Only the factors whose parameters changed are recomputed
+        psi = recompute_parameters(wf, configs, changed)[1]
         rawweights = np.exp(2 * (psi - psi0))  # convert from log(|psi|) to |psi|**2
         df = pgrad_acc.enacc(configs, wf)
         df["weight"] = rawweights
 
         data.append(df)
     return data
+
+
+def _linear_jastrow_sampler(wf, configs, params, pgrad_acc, linear):
+    """lm_sampler() for Jastrow coefficients, using a linearjastrow.LinearJastrowEnergy
+    in place of recomputing wf for each set of parameters"""
+    ref = pgrad_acc.enacc(configs, wf)
+    potential = ref["total"] - ref["ke"]
+    psi0 = linear({})[0]
+    data = []
+    for p in params:
+        newparms = pgrad_acc.transform.deserialize(p)
+        for k in newparms:
+            wf.parameters[k] = newparms[k]
+        psi, ke = linear(newparms)
+        df = dict(ref)
+        df["ke"] = ke
+        df["total"] = potential + ke
+        df["weight"] = np.exp(2 * (psi - psi0))
+        data.append(df)
+    return data
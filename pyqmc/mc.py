@@ -6,9 +6,16 @@ os.environ["MKL_NUM_THREADS"] = "1"
 os.environ["NUMEXPR_NUM_THREADS"] = "1"
 os.environ["OMP_NUM_THREADS"] = "1"
 import numpy as np
+from pyqmc.accumulators import (
+    SharedQuantities,
+    average,
+    split_interval,
+    walker_quantities,
+)
+from pyqmc.coord import get_rng
 
 
-def initial_guess(mol, nconfig, r=1.0):
+def initial_guess(mol, nconfig, r=1.0, rng=None):
     """ Generate an initial guess by distributing electrons near atoms
     proportional to their charge.
 
@@ -20,6 +27,8 @@ def initial_guess(mol, nconfig, r=1.0):
 
      r: How far from the atoms to distribute the electrons
 
+     rng: np.random.Generator to draw the positions with. It is attached to the returned configs, so that the samplers continue the same stream (see coord.get_rng()). If None, the global np.random state is used.
+
     Returns: 
 
      A numpy array with shape (nconfig,nelectrons,3) with the electrons randomly distributed near 
@@ -28,6 +37,7 @@ def initial_guess(mol, nconfig, r=1.0):
     """
     from pyqmc.coord import OpenConfigs, PeriodicConfigs
 
+    random = np.random if rng is None else rng
     nelec = np.sum(mol.nelec)
     epos = np.zeros((nconfig, nelec, 3))
     wts = mol.atom_charges()
@@ -49,7 +59,7 @@ def initial_guess(mol, nconfig, r=1.0):
         if totleft > 0:
             bins = np.cumsum(nleft) / totleft
             inds = np.argpartition(
-                np.random.random((nconfig, len(wts))), totleft, axis=1
+                random.random((nconfig, len(wts))), totleft, axis=1
             )[:, :totleft]
             ind0 = s * mol.nelec[0]
             epos[:, ind0 : ind0 + nassigned, :] = np.repeat(
@@ -61,11 +71,11 @@ def initial_guess(mol, nconfig, r=1.0):
                 inds
             ]  # assign remaining electrons
 
-    epos += r * np.random.randn(*epos.shape)  # random shifts from atom positions
+    epos += r * random.standard_normal(epos.shape)  # random shifts from atom positions
     if hasattr(mol, "a"):
-        epos = PeriodicConfigs(epos, mol.a)
+        epos = PeriodicConfigs(epos, mol.a, rng=rng)
     else:
-        epos = OpenConfigs(epos)
+        epos = OpenConfigs(epos, rng=rng)
     return epos
 
 
@@ -88,7 +98,16 @@ def limdrift(g, cutoff=1):
 
 
 def vmc(
-    wf, configs, nsteps=100, tstep=0.5, accumulators=None, verbose=False, stepoffset=0
+    wf,
+    configs,
+    nsteps=100,
+    tstep=0.5,
+    accumulators=None,
+    verbose=False,
+    stepoffset=0,
+    checkpoint=None,
+    restart=False,
+    hdf_file=None,
 ):
     """Run a Monte Carlo sample of a given wave function.
 
@@ -102,12 +121,18 @@ def vmc(
 
       tstep: Time step for move proposals. Only affects efficiency.
 
-      accumulators: A dictionary of functor objects that take in (configs,wf) and return a dictionary of quantities to be averaged. np.mean(quantity,axis=0) should give the average over configurations. If None, then the coordinates will only be propagated with acceptance information.
+      accumulators: A dictionary of functor objects that take in (configs,wf) and return a dictionary of quantities to be averaged. np.mean(quantity,axis=0) should give the average over configurations. If None, then the coordinates will only be propagated with acceptance information. Accumulators with a `needs` attribute are also passed a SharedQuantities object, so that quantities such as the local energy are computed once per step. An entry can also be a tuple (accumulator, interval) to evaluate it only every interval steps (see accumulators.split_interval()); on other steps its keys are left out. Per-walker quantities (see accumulators.walker_quantities()) are only kept for the last steps.
       
       verbose: Print out step information 
 
       stepoffset: If continuing a run, what to start the step numbering at.
 
+      checkpoint: a checkpoint.Checkpoint; the configurations, wave function parameters and random state are saved every checkpoint.interval steps
+
+      restart: if True and the checkpoint file exists, continue from it: configs and wf are loaded from the checkpoint, and only the steps after it are run
+
+      hdf_file: name of an HDF5 file to which the data of each step is appended, one dataset per key (see hdftools). On restart, the steps after the checkpoint are dropped from it first.
+
     Returns: (df,configs)
        df: A list of dictionaries nstep long that contains all results from the accumulators. These are averaged across all walkers.
 
@@ -119,8 +144,24 @@ def vmc(
         if verbose:
             print("WARNING: running VMC with no accumulators")
 
+    accumulators = {k: split_interval(acc) for k, acc in accumulators.items()}
+    walker = walker_quantities(accumulators)
+    if hdf_file is not None:
+        import pyqmc.hdftools as hdftools
+
+    if checkpoint is not None and restart and checkpoint.exists():
+        start = checkpoint.restore(configs, wf)["step"]
+        nsteps, stepoffset = stepoffset + nsteps - start, start
+        if hdf_file is not None:
+            hdftools.truncate(hdf_file, "step", start)
+    if hdf_file is not None:
+        hdf = hdftools.Appender(hdf_file)
+
     nconf, nelec, ndim = configs.configs.shape
+    rng = get_rng(configs)
     df = []
+    # the incremental sums of the trackers are rebuilt along with the wave function
+    configs.trackers = {}
     wf.recompute(configs)
     for step in range(nsteps):
         if verbose:
@@ -129,7 +170,7 @@ def vmc(
         for e in range(nelec):
             # Propose move
             grad = limdrift(np.real(wf.gradient(e, configs.electron(e)).T))
-            gauss = np.random.normal(scale=np.sqrt(tstep), size=(nconf, 3))
+            gauss = rng.normal(scale=np.sqrt(tstep), size=(nconf, 3))
             newcoorde = configs.configs[:, e, :] + gauss + grad * tstep
             newcoorde = configs.make_irreducible(e, newcoorde)
 
@@ -141,15 +182,18 @@ def vmc(
             # Acceptance
             t_prob = np.exp(1 / (2 * tstep) * (forward - backward))
             ratio = np.multiply(wf.testvalue(e, newcoorde) ** 2, t_prob)
-            accept = ratio > np.random.rand(nconf)
+            accept = ratio > rng.random(nconf)
 
             # Update wave function
             configs.move(e, newcoorde, accept)
             wf.updateinternals(e, newcoorde, mask=accept)
             acc.append(np.mean(accept))
         avg = {}
-        for k, accumulator in accumulators.items():
-            dat = accumulator.avg(configs, wf)
+        shared = SharedQuantities(configs, wf)
+        for k, (accumulator, interval) in accumulators.items():
+            if (stepoffset + step) % interval != 0:
+                continue
+            dat = average(accumulator, configs, wf, shared)
             for m, res in dat.items():
                 # print(m,res.nbytes/1024/1024)
                 avg[k + m] = res  # np.mean(res,axis=0)
@@ -157,6 +201,18 @@ def vmc(
         avg["step"] = stepoffset + step
         avg["nconfig"] = nconf
         df.append(avg)
+        # per-walker quantities are only kept for the last steps
+        for k, nkeep in walker.items():
+            if len(df) > nkeep:
+                df[-nkeep - 1].pop(k, None)
+        if hdf_file is not None:
+            hdf.append([{k: v for k, v in avg.items() if k not in walker}])
+        if checkpoint is not None and checkpoint.due(stepoffset + step + 1):
+            checkpoint.save(stepoffset + step + 1, configs, wf)
+    if hdf_file is not None:
+        hdf.close()
+    if checkpoint is not None:
+        checkpoint.wait()
     return df, configs
 
 
@@ -46,6 +46,17 @@ class WFmerger(collections.abc.MutableMapping):
                 yield k1 + k2
 
 
+def recompute_parameters(wf, configs, changed):
+    """Log value of wf after the parameters listed in changed were modified, for the
+    configs of the last recompute(). Uses wf.recompute_parameters() if wf has it, and
+    a full recompute otherwise."""
+    if len(changed) == 0:
+        return wf.value()
+    if hasattr(wf, "recompute_parameters"):
+        return wf.recompute_parameters(configs, changed)
+    return wf.recompute(configs)
+
+
 class MultiplyWF:
     """Multiplies two wave functions """
 
@@ -59,10 +70,25 @@ class MultiplyWF:
         v2 = self.wf2.recompute(configs)
         return v1[0] * v2[0], v1[1] + v2[1]
 
+    def recompute_parameters(self, configs, changed):
+        """Like recompute(), for the configs of the last recompute() after the
+        parameters listed in changed were modified. Factors without changed
+        parameters are not recomputed, so for example a Slater determinant is reused
+        when only Jastrow parameters change."""
+        changed1 = [k[3:] for k in changed if k[:3] == "wf1"]
+        changed2 = [k[3:] for k in changed if k[:3] == "wf2"]
+        v1 = recompute_parameters(self.wf1, configs, changed1)
+        v2 = recompute_parameters(self.wf2, configs, changed2)
+        return v1[0] * v2[0], v1[1] + v2[1]
+
     def updateinternals(self, e, epos, mask=None):
         self.wf1.updateinternals(e, epos, mask=mask)
         self.wf2.updateinternals(e, epos, mask=mask)
 
+    def resample(self, newinds):
+        self.wf1.resample(newinds)
+        self.wf2.resample(newinds)
+
     def value(self):
         v1 = self.wf1.value()
         v2 = self.wf2.value()
@@ -138,6 +138,13 @@ class MultiSlater:
 
         self._updateval(det_ratio, s, mask)
 
+    def resample(self, newinds):
+        """Resample the internal state by new walker indices, in the same way as
+        configs.resample(newinds), so that recompute() is not needed after branching."""
+        self._aovals = self._aovals[newinds]
+        self._dets = [det[:, newinds] for det in self._dets]
+        self._inverse = [inv[newinds] for inv in self._inverse]
+
     def value(self):
         """Return logarithm of the wave function as noted in recompute()"""
         wf_val = 0
@@ -2,6 +2,7 @@
 import numpy as np
 from copy import deepcopy
 from pyqmc.mc import initial_guess
+from pyqmc.coord import get_rng
 
 
 class OBDMAccumulator:
@@ -66,7 +67,9 @@ class OBDMAccumulator:
                 mol, orb_coeff, self._extra_config, tstep
             )
 
-    def __call__(self, configs, wf):
+    needs = ("obdm",)
+
+    def __call__(self, configs, wf, shared=None):
         """ Quantities from equation (9) of DOI:10.1063/1.4793531"""
 
         nconf = configs.configs.shape[0]
@@ -78,11 +81,12 @@ class OBDMAccumulator:
             "acceptance": np.zeros(nconf),
         }
         acceptance = 0
+        rng = get_rng(configs)
         naux = self._extra_config.shape[0]
         nelec = len(self._electrons)
 
         for step in range(self._nstep):
-            e = np.random.choice(self._electrons)
+            e = rng.choice(self._electrons)
 
             points = np.concatenate([self._extra_config, configs.configs[:, e, :]])
             ao = self._mol.eval_gto("GTOval_sph", points)
@@ -94,7 +98,7 @@ class OBDMAccumulator:
             norm = borb_aux * borb_aux / fsum[:, np.newaxis]
             borb_configs = borb[naux:, :]
 
-            auxassignments = np.random.randint(0, naux, size=nconf)
+            auxassignments = rng.choice(naux, size=nconf)
             epos = configs.make_irreducible(e, self._extra_config[auxassignments])
             wfratio = wf.testvalue(e, epos)
 
@@ -108,7 +112,7 @@ class OBDMAccumulator:
             results["norm"] += norm[auxassignments]
 
             accept, self._extra_config = sample_onebody(
-                self._mol, self._orb_coeff, self._extra_config, tstep=self._tstep
+                self._mol, self._orb_coeff, self._extra_config, self._tstep, rng
             )
 
             results["acceptance"] += np.mean(accept)
@@ -119,8 +123,8 @@ class OBDMAccumulator:
 
         return results
 
-    def avg(self, configs, wf):
-        d = self(configs, wf)
+    def avg(self, configs, wf, shared=None):
+        d = self(configs, wf) if shared is None else shared.result(self)
         davg = {}
         for k, v in d.items():
             # print(k, v.shape)
@@ -128,18 +132,20 @@ class OBDMAccumulator:
         return davg
 
 
-def sample_onebody(mol, orb_coeff, configs, tstep=2.0):
-    """ For a set of orbitals defined by orb_coeff, return samples from f(r) = \sum_i phi_i(r)^2. """
-    config_pack = np.concatenate(
-        [configs, configs + np.sqrt(tstep) * np.random.randn(*configs.shape)], axis=0
-    )
+def sample_onebody(mol, orb_coeff, configs, tstep=2.0, rng=None):
+    """ For a set of orbitals defined by orb_coeff, return samples from f(r) = \sum_i phi_i(r)^2.
+    rng is a np.random.Generator; the global np.random state is used if it is None. """
+    if rng is None:
+        rng = np.random
+    shift = np.sqrt(tstep) * rng.standard_normal(configs.shape)
+    config_pack = np.concatenate([configs, configs + shift], axis=0)
 
     ao = mol.eval_gto("GTOval_sph", config_pack)
     borb = ao.dot(orb_coeff)
     fsum = (borb ** 2).sum(axis=1)
 
     n = configs.shape[0]
-    accept = fsum[n:] / fsum[0:n] > np.random.rand(n)
+    accept = fsum[n:] / fsum[0:n] > rng.random(n)
     newconf = config_pack[n:, :]
     configs[accept, :] = newconf[accept, :]
     return accept, configs
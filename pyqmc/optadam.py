@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+
+def adam_descent(
+    wf,
+    coords,
+    pgrad_acc,
+    warmup=10,
+    nsteps=5,
+    step=0.01,
+    beta1=0.9,
+    beta2=0.999,
+    eps=1e-8,
+    amsgrad=False,
+    maxiters=100,
+    vmc=None,
+    vmcoptions=None,
+    datafile=None,
+    hdf_file=None,
+    verbose=1,
+):
+    """Optimizes energy with the Adam (or AMSGrad) stochastic optimizer.
+
+    The walkers are propagated continuously: after an initial warmup, the
+    parameters are updated every nsteps VMC steps from the energy gradient
+    estimated on those steps, and the walkers carry over to the next update
+    without discarding any steps. The moment estimates of Adam average out the
+    noise of the small samples.
+
+    Args:
+
+      wf: initial wave function
+
+      coords: initial configurations
+
+      pgrad_acc: A PGradAccumulator-like object. Only dpH and dppsi are used, so one with matrix_free=True avoids accumulating the SR matrix.
+
+      warmup: number of VMC steps before the first update
+
+      nsteps: number of VMC steps per update
+
+      step: learning rate
+
+      beta1, beta2: decay rates of the first and second moment estimates
+
+      eps: regularizes the division by the second moment
+
+      amsgrad: if True, use the maximum of the second moment estimates (AMSGrad)
+
+      maxiters: number of parameter updates
+
+      vmc: A function that works like mc.vmc()
+
+      vmcoptions: a dictionary of options for the vmc method, other than nsteps
+
+      datafile: a file in which the current progress can be dumped in JSON format.
+
+      hdf_file: an HDF5 file to which the data of each update is appended (see hdftools)
+
+    Returns:
+
+      wf: optimized wave function
+
+      data: dictionary with the data of each update
+
+    """
+    if vmc is None:
+        import pyqmc.mc
+
+        vmc = pyqmc.mc.vmc
+    if vmcoptions is None:
+        vmcoptions = {}
+    if hdf_file is not None:
+        import pyqmc.hdftools as hdftools
+
+    def set_parameters(x):
+        newparms = pgrad_acc.transform.deserialize(x)
+        for k in newparms:
+            wf.parameters[k] = newparms[k]
+
+    x = pgrad_acc.transform.serialize_parameters(wf.parameters)
+    m = np.zeros(x.shape)
+    v = np.zeros(x.shape)
+    vmax = np.zeros(x.shape)
+    data = {"iter": [], "params": [], "pgrad": [], "totalen": [], "totalen_err": []}
+
+    if warmup > 0:
+        df, coords = vmc(wf, coords, nsteps=warmup, **vmcoptions)
+    stepoffset = warmup
+    for it in range(maxiters):
+        df, coords = vmc(
+            wf,
+            coords,
+            nsteps=nsteps,
+            accumulators={"pgrad": pgrad_acc},
+            stepoffset=stepoffset,
+            **vmcoptions
+        )
+        stepoffset += nsteps
+        df = pd.DataFrame(df)
+        en = np.mean(df["pgradtotal"])
+        en_err = np.std(df["pgradtotal"]) / np.sqrt(len(df))
+        dpH = np.mean(df["pgraddpH"], axis=0)
+        dp = np.mean(df["pgraddppsi"], axis=0)
+        grad = 2 * (dpH - en * dp)
+
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad ** 2
+        mhat = m / (1 - beta1 ** (it + 1))
+        if amsgrad:
+            vmax = np.maximum(vmax, v)
+            vhat = vmax / (1 - beta2 ** (it + 1))
+        else:
+            vhat = v / (1 - beta2 ** (it + 1))
+
+        data["iter"].append(it)
+        data["params"].append(x.copy())
+        data["pgrad"].append(grad)
+        data["totalen"].append(en)
+        data["totalen_err"].append(en_err)
+        if verbose > 0:
+            print(
+                "iteration",
+                it,
+                "|grad|=%.6f" % np.linalg.norm(grad),
+                "E=%.5f+-%.5f" % (en, en_err),
+                flush=True,
+            )
+        if datafile is not None:
+            pd.DataFrame(data).to_json(datafile)
+        if hdf_file is not None:
+            hdftools.append(hdf_file, [{k: v[-1] for k, v in data.items()}])
+
+        x = x - step * mhat / (np.sqrt(vhat) + eps)
+        set_parameters(x)
+
+    return wf, data
@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+import scipy.linalg
+from pyqmc.reblock import equilibration_steps
+
+
+def lm_matrices(df, prefix="lm"):
+    """Hamiltonian and overlap matrices of the linear method in the basis
+    {psi, dpsi/dp_i - <dp_i> psi}, from the step averages of a LinearMethodTransform.
+
+    Args:
+      df: DataFrame of VMC steps
+
+      prefix: key of the LinearMethodTransform in the accumulators dictionary
+
+    Returns:
+      H: (nparam+1, nparam+1) non-symmetric Hamiltonian matrix
+
+      S: (nparam+1, nparam+1) overlap matrix
+    """
+
+    def mean(k):
+        return np.mean(np.asarray(list(df[prefix + k].dropna())), axis=0)
+
+    en = mean("total")
+    dp, dpH, dEdp = mean("dppsi"), mean("dpH"), mean("dEdp")
+    dpdp, dpHdp, dpdEdp = mean("dpidpj"), mean("dpHdpj"), mean("dpidEdpj")
+
+    n = len(dp)
+    H = np.zeros((n + 1, n + 1))
+    S = np.zeros((n + 1, n + 1))
+    H[0, 0] = en
+    H[1:, 0] = dpH - dp * en
+    H[0, 1:] = H[1:, 0] + dEdp
+    H[1:, 1:] = (
+        dpHdp
+        - np.outer(dp, dpH)
+        - np.outer(dpH, dp)
+        + np.outer(dp, dp) * en
+        + dpdEdp
+        - np.outer(dp, dEdp)
+    )
+    S[0, 0] = 1.0
+    S[1:, 1:] = dpdp - np.outer(dp, dp)
+    return H, S
+
+
+def linear_update(H, S, shift, tol=1e-10):
+    """Parameter change from the generalized eigenproblem H v = E S v.
+
+    Args:
+      shift: added to the diagonal of H for the parameter directions; larger values
+        give shorter, more conservative steps
+
+      tol: directions with a variance S_ii below tol*max(S_ii) are redundant (for
+        example the normalization of an orbital) and are left unchanged
+
+    Returns:
+      dp: (nparam,) parameter change
+    """
+    diag = np.diag(S)[1:]
+    keep = np.concatenate([[True], diag > tol * np.amax(diag)])
+    Hk = H[np.ix_(keep, keep)].copy()
+    Sk = S[np.ix_(keep, keep)]
+    Hk[1:, 1:] += shift * np.eye(Hk.shape[0] - 1)
+    vals, vecs = scipy.linalg.eig(Hk, Sk)
+    # The eigenvector closest to the current wave function
+    ind = np.argmax(np.abs(vecs[0]) / np.linalg.norm(vecs, axis=0))
+    dp = np.zeros(len(diag))
+    dp[keep[1:]] = np.real(vecs[1:, ind] / vecs[0, ind])
+    return dp
+
+
+def linear_method(
+    wf,
+    coords,
+    lm_acc,
+    shifts=(1e-3, 1e-2, 1e-1),
+    warmup=0,
+    maxiters=5,
+    vmc=None,
+    vmcoptions=None,
+    lm=None,
+    lmoptions=None,
+    datafile=None,
+    hdf_file=None,
+    verbose=1,
+):
+    """Optimizes energy with the linear method. Each iteration solves the
+    generalized eigenproblem for several diagonal shifts of the Hamiltonian, and
+    the best of the resulting parameter sets is chosen by correlated sampling.
+
+    Args:
+
+      wf: initial wave function
+
+      coords: initial configurations
+
+      lm_acc: A LinearMethodTransform-like object
+
+      shifts: diagonal shifts to try in each iteration
+
+      warmup: number of VMC steps to discard in each iteration, or "auto" to detect them from the energy trace (see reblock.equilibration_steps())
+
+      maxiters: number of iterations
+
+      vmc: A function that works like mc.vmc()
+
+      vmcoptions: a dictionary of options for the vmc method
+
+      lm: the correlated sampling function to use, like linemin.lm_sampler()
+
+      lmoptions: a dictionary of options for the lm method
+
+      datafile: a file in which the current progress can be dumped in JSON format.
+
+      hdf_file: an HDF5 file to which the data of each iteration is appended (see hdftools)
+
+    Returns:
+
+      wf: optimized wave function
+
+      data: list of dictionaries with the data of each iteration
+
+    """
+    if vmc is None:
+        import pyqmc.mc
+
+        vmc = pyqmc.mc.vmc
+    if vmcoptions is None:
+        vmcoptions = {}
+    if lm is None:
+        from pyqmc.linemin import lm_sampler
+
+        lm = lm_sampler
+    if lmoptions is None:
+        lmoptions = {}
+    if hdf_file is not None:
+        import pyqmc.hdftools as hdftools
+
+    def set_parameters(x):
+        newparms = lm_acc.transform.deserialize(x)
+        for k in newparms:
+            wf.parameters[k] = newparms[k]
+
+    x0 = lm_acc.transform.serialize_parameters(wf.parameters)
+    data = []
+    for it in range(maxiters):
+        set_parameters(x0)
+        df, coords = vmc(wf, coords, accumulators={"lm": lm_acc}, **vmcoptions)
+        df = pd.DataFrame(df)
+        if warmup == "auto":
+            df = df[equilibration_steps(df["lmtotal"]) :]
+        else:
+            df = df[warmup:]
+        en = np.mean(df["lmtotal"])
+        en_err = np.std(df["lmtotal"]) / np.sqrt(len(df))
+        H, S = lm_matrices(df)
+
+        params = [x0 + linear_update(H, S, shift) for shift in shifts]
+        stepsdata = lm(wf, coords, params, lm_acc, **lmoptions)
+        ens = [
+            np.mean(d["total"] * d["weight"]) / np.mean(d["weight"]) for d in stepsdata
+        ]
+        best = int(np.argmin(ens))
+        if verbose > 0:
+            print("linear method iteration", it, "E=%.5f+-%.5f" % (en, en_err))
+            print("shifts", shifts, "energies", ens, flush=True)
+
+        data.append(
+            {
+                "iter": it,
+                "en": en,
+                "en_err": en_err,
+                "params": x0.copy(),
+                "shift": shifts[best],
+                "shift_energies": ens,
+            }
+        )
+        x0 = params[best]
+        if datafile is not None:
+            pd.DataFrame(data).to_json(datafile)
+        if hdf_file is not None:
+            hdftools.append(hdf_file, data[-1:])
+
+    set_parameters(x0)
+    return wf, data
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 import json
+from pyqmc.linemin import SROperator, sr_cg_update
 
 
 def gradient_descent(
@@ -25,7 +26,7 @@ def gradient_descent(
 
       coords: initial configurations
 
-      pgrad_acc: A PGradAccumulator-like object
+      pgrad_acc: A PGradAccumulator-like object. If it is matrix_free, the SR equations are solved by conjugate gradient with linemin.SROperator.
 
       vmc: A function that works like mc.vmc()
 
@@ -73,12 +74,16 @@ def gradient_descent(
         # Sij matrix with stabilizing diagonal
         dpH = np.mean(df["pgraddpH"], axis=0)
         dp = np.mean(df["pgraddppsi"], axis=0)
-        dpdp = np.mean(df["pgraddpidpj"], axis=0)
         grad = 2 * (dpH - en * dp)
-        Sij = dpdp - np.einsum("i,j->ij", dp, dp) + eps * np.eye(dpdp.shape[0])
-        invSij = np.linalg.inv(Sij)
+        if getattr(pgrad_acc, "matrix_free", False):
+            Sij = SROperator(np.concatenate(df["pgraddpwalker"].dropna().values))
+            srgrad = -sr_cg_update(grad, Sij, 1.0, eps)
+        else:
+            dpdp = np.mean(df["pgraddpidpj"], axis=0)
+            Sij = dpdp - np.einsum("i,j->ij", dp, dp) + eps * np.eye(dpdp.shape[0])
+            srgrad = np.einsum("ij,j->i", np.linalg.inv(Sij), grad)
         grad_std = 0
-        return grad, grad_std, invSij, en, en_std, len(df)
+        return grad, grad_std, srgrad, en, en_std, len(df)
 
     x0 = pgrad_acc.transform.serialize_parameters(wf.parameters)
     data = {
@@ -89,7 +94,7 @@ def gradient_descent(
         "totalen": [],
         "totalen_err": [],
     }
-    pgrad, pgrad_std, invSij, en, en_std, nsteps = gradient_energy_function(x0)
+    pgrad, pgrad_std, srgrad, en, en_std, nsteps = gradient_energy_function(x0)
     data["iter"].append(0)
     data["params"].append(x0)
     data["pgrad"].append(pgrad)
@@ -108,8 +113,8 @@ def gradient_descent(
 
     # Gradient descent cycles
     for it in range(maxiters):
-        x0 -= np.einsum("ij,j->i", invSij, pgrad) * step / (it / 10 + 1)
-        pgrad, pgrad_std, invSij, en, en_std, nsteps = gradient_energy_function(x0)
+        x0 -= srgrad * step / (it / 10 + 1)
+        pgrad, pgrad_std, srgrad, en, en_std, nsteps = gradient_energy_function(x0)
         if verbose > 1:
             print("p =", x0)
             print("grad =", pgrad)
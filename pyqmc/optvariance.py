@@ -1,12 +1,15 @@
 import numpy as np
 from scipy.optimize import minimize
 from pyqmc.energy import kinetic
+from pyqmc.linearjastrow import linear_jastrow_energy
 
 
 def optvariance(energy, wf, coords, params=None, **kwargs):
     """Optimizes variance of wave function against parameters indicated by params.
     
     Does not use gradient information, and assumes that only the kinetic energy changes.
+    If all params are coefficients of a JastrowSpin factor, the kinetic energy is
+    evaluated without recomputing the wave function (see linearjastrow).
     
     Args:
       energy: An Accumulator object that returns total energy in 'total' and kinetic energy in 'ke'
@@ -26,16 +29,21 @@ def optvariance(energy, wf, coords, params=None, **kwargs):
 
     # scipy.minimize() needs 1d argument
     x0 = np.concatenate([wf.parameters[k].flatten() for k in params])
-    shapes = np.array([wf.parameters[k].shape for k in params])
+    shapes = [wf.parameters[k].shape for k in params]
     slices = np.array([np.prod(s) for s in shapes])
+    # For Jastrow coefficients, the kinetic energy is evaluated from cached basis sums
+    linear = linear_jastrow_energy(wf, coords, params)
     Enref = energy(coords, wf)
 
     def variance_cost_function(x):
         x_sliced = np.split(x, slices[:-1])
         for i, k in enumerate(params):
             wf.parameters[k] = x_sliced[i].reshape(wf.parameters[k].shape)
-        wf.recompute(coords)
-        ke = kinetic(coords, wf)
+        if linear is not None:
+            ke = linear(wf.parameters)[1]
+        else:
+            wf.recompute(coords)
+            ke = kinetic(coords, wf)
         # Here we assume the ecp is fixed and only recompute
         # kinetic energy
         En = Enref["total"] - Enref["ke"] + ke
@@ -54,6 +62,130 @@ def optvariance(energy, wf, coords, params=None, **kwargs):
     return res.fun, wf
 
 
+def _weighted_cost(en, den, w, dlogval, cost):
+    """Variance or mean absolute deviation of the local energies en with normalized
+    weights w, and its gradient from the (nconf, nparam) derivatives den of the local
+    energies and dlogval of log|psi|, on which the weights depend as |psi|^2."""
+    dw = 2 * w[:, np.newaxis] * (dlogval - np.dot(w, dlogval))
+    mean = np.dot(w, en)
+    dmean = np.dot(w, den) + np.dot(en, dw)
+    dev = en - mean
+    if cost == "variance":
+        grad = np.dot(dev ** 2, dw) + 2 * np.dot(w * dev, den - dmean)
+        return np.dot(w, dev ** 2), grad
+    grad = np.dot(np.abs(dev), dw) + np.dot(w * np.sign(dev), den - dmean)
+    return np.dot(w, np.abs(dev)), grad
+
+
+def minimize_variance(
+    energy,
+    wf,
+    coords,
+    params=None,
+    cost="variance",
+    ess_min=0.5,
+    maxiters=10,
+    vmc=None,
+    vmcoptions=None,
+    verbose=1,
+    **kwargs
+):
+    """Minimizes the variance or the mean absolute deviation of the local energy with
+    respect to the Jastrow coefficients in params, using analytic gradients.
+
+    The configurations are fixed and reweighted by |psi/psi_0|^2 as the parameters
+    change; only one recompute is done for each set of configurations (see
+    linearjastrow). If the effective sample size drops below ess_min, new
+    configurations are sampled with vmc and the minimization continues from there.
+    As in optvariance(), the potential energy is assumed not to change, so the
+    nonlocal part of an ECP is not reoptimized.
+
+    Args:
+      energy: An Accumulator object that returns total energy in 'total' and kinetic energy in 'ke'
+
+      coords: configs equilibrated for wf
+
+      params: list of dictionary entries in wf.parameters to optimize; all must be coefficients of a JastrowSpin factor of wf
+
+      cost: "variance" or "mad" (mean absolute deviation from the mean)
+
+      ess_min: the configurations are resampled when the effective sample size falls below this fraction of their number
+
+      maxiters: maximum number of sets of configurations
+
+      vmc: A function that works like mc.vmc()
+
+      vmcoptions: a dictionary of options for the vmc method
+
+      kwargs: options for scipy.minimize
+
+    Returns:
+      opt_cost, modifying params into optimized values.
+
+    """
+    if params is None:
+        params = list(wf.parameters.keys())
+    if cost not in ["variance", "mad"]:
+        raise ValueError("cost must be 'variance' or 'mad', not " + str(cost))
+    if vmc is None:
+        import pyqmc.mc
+
+        vmc = pyqmc.mc.vmc
+    if vmcoptions is None:
+        vmcoptions = {}
+
+    for it in range(maxiters):
+        if it > 0:
+            df, coords = vmc(wf, coords, **vmcoptions)
+        linear = linear_jastrow_energy(wf, coords, params)
+        if linear is None:
+            raise ValueError("params must be coefficients of a JastrowSpin factor")
+        Enref = energy(coords, wf)
+        potential = Enref["total"] - Enref["ke"]
+        c0 = linear.coefficients(wf.parameters)
+        inds = linear.indices(params)
+        logval0 = linear.evaluate(c0)[0]
+
+        def weights(x):
+            c = c0.copy()
+            c[inds] = x
+            logval, ke = linear.evaluate(c)
+            w = np.exp(2 * (logval - logval0))
+            return c, ke, w / np.sum(w)
+
+        def cost_function(x):
+            c, ke, w = weights(x)
+            dlogval, dke = linear.gradient(c)
+            en = potential + ke
+            value = _weighted_cost(en, dke[:, inds], w, dlogval[:, inds], cost)
+            last.update(x=x.copy(), cost=value[0], w=w)
+            return value
+
+        def callback(xk):
+            # the last evaluation is usually at xk, at the end of the line search
+            if not np.array_equal(xk, last["x"]):
+                cost_function(xk)
+            w = last["w"]
+            ess = 1.0 / (np.sum(w ** 2) * len(w))
+            if verbose > 0:
+                print(cost, last["cost"], "effective sample size", ess)
+            if ess < ess_min:
+                resample[0] = True
+                raise StopIteration
+
+        resample = [False]
+        last = {}
+        res = minimize(
+            cost_function, x0=c0[inds], jac=True, callback=callback, **kwargs
+        )
+        for k, v in linear.split(weights(res.x)[0]).items():
+            wf.parameters[k] = v
+        if not resample[0]:
+            break
+
+    return res.fun, wf
+
+
 def test_single_opt():
     from pyqmc.accumulators import EnergyAccumulator
     from pyscf import lib, gto, scf
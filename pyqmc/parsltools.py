@@ -9,11 +9,85 @@ import parsl
 from parsl.app.app import python_app
 
 import numpy as np
+import copy
 import time
+from pyqmc.coord import OpenConfigs, PeriodicConfigs
+
+
+class NpyFile:
+    """
+    Handle to an array saved as a .npy file in a directory that the client
+    and the workers share. Only the file name goes through parsl; the
+    receiving side memory-maps the file.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+
+
+def pack(obj, npydir=None, threshold=2 ** 20):
+    """
+    Prepare obj to be sent to or returned from a parsl app.
+
+    Numpy arrays (also inside dicts, lists, tuples and configs objects) are
+    sent as binary buffers by parsl's serializer. If npydir is given, arrays
+    of at least threshold bytes are instead written to .npy files in npydir
+    and replaced by NpyFile handles.
+
+    Args:
+      obj: object to pack
+
+      npydir: directory visible to the client and the workers, or None
+
+      threshold: minimum size in bytes for an array to go through a file
+
+    Returns:
+      the packed object, to be restored with unpack()
+    """
+    if npydir is None:
+        return obj
+    if isinstance(obj, np.ndarray):
+        if obj.nbytes < threshold:
+            return obj
+        import uuid
+
+        fname = os.path.join(npydir, uuid.uuid4().hex + ".npy")
+        np.save(fname, obj)
+        return NpyFile(fname)
+    if isinstance(obj, dict):
+        return {k: pack(v, npydir, threshold) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(pack(v, npydir, threshold) for v in obj)
+    if isinstance(obj, (OpenConfigs, PeriodicConfigs)):
+        packed = copy.copy(obj)
+        packed.__dict__ = pack(obj.__getstate__(), npydir, threshold)
+        return packed
+    return obj
+
+
+def unpack(obj):
+    """
+    Restore an object made by pack(). Arrays sent through files are
+    memory-mapped copy-on-write, and the files are removed, so each packed
+    object should be unpacked once.
+    """
+    if isinstance(obj, NpyFile):
+        arr = np.load(obj.fname, mmap_mode="c")
+        os.remove(obj.fname)
+        return arr
+    if isinstance(obj, dict):
+        return {k: unpack(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(unpack(v) for v in obj)
+    if isinstance(obj, (OpenConfigs, PeriodicConfigs)):
+        obj = copy.copy(obj)
+        obj.__dict__ = unpack(obj.__dict__)
+        return obj
+    return obj
 
 
 @python_app
-def vmcparsl(wf, lastrun, nsteps, accumulators, stepoffset=0):
+def vmcparsl(wf, lastrun, nsteps, accumulators, stepoffset=0, npydir=None):
     import os
 
     os.environ["MKL_NUM_THREADS"] = "1"
@@ -21,17 +95,17 @@ def vmcparsl(wf, lastrun, nsteps, accumulators, stepoffset=0):
     os.environ["OMP_NUM_THREADS"] = "1"
 
     from pyqmc.mc import vmc
+    from pyqmc.parsltools import pack, unpack
     import copy
-    import numpy as np
 
     df, coords = vmc(
         copy.deepcopy(wf),
-        np.asarray(lastrun[1]).copy(),
+        unpack(lastrun[1]).copy(),
         nsteps=nsteps,
         accumulators=copy.deepcopy(accumulators),
         stepoffset=stepoffset,
     )
-    return df, coords.tolist()
+    return pack((df, coords), npydir)
 
 
 def distvmc(
@@ -42,15 +116,19 @@ def distvmc(
     npartitions=2,
     nsteps_per=None,
     sleeptime=5,
+    npydir=None,
 ):
     """ 
     Args: 
     wf: a wave function object
 
-    coords: nconf x nelec x 3 
+    coords: nconf x nelec x 3 configs object
 
     nsteps: how many steps to move each walker
 
+    npydir: if given, a directory shared by the client and the workers through
+      which large arrays are handed off as .npy files (see pack())
+
 
     """
     if nsteps_per is None:
@@ -61,21 +139,23 @@ def distvmc(
 
     allruns = []
     niterations = int(nsteps / nsteps_per)
-    coord = np.split(coords, npartitions)
+    coord = coords.split(npartitions)
     for epoch in range(niterations):
         for p in range(npartitions):
             if epoch == 0:
-                allruns.append(vmcparsl(wf, ([], coord[p]), nsteps_per, accumulators))
+                lastrun = ([], pack(coord[p], npydir))
             else:
-                allruns.append(
-                    vmcparsl(
-                        wf,
-                        allruns[-npartitions],
-                        nsteps_per,
-                        accumulators,
-                        stepoffset=epoch * nsteps_per,
-                    )
+                lastrun = allruns[-npartitions]
+            allruns.append(
+                vmcparsl(
+                    wf,
+                    lastrun,
+                    nsteps_per,
+                    accumulators,
+                    stepoffset=epoch * nsteps_per,
+                    npydir=npydir,
                 )
+            )
     import pandas as pd
     import time
 
@@ -91,14 +171,14 @@ def distvmc(
         time.sleep(sleeptime)
     df = []
     for r in allruns:
-        df.extend(r.result()[0])
-    coords = np.asarray(np.concatenate([x.result()[1] for x in allruns[-npartitions:]]))
+        df.extend(unpack(r.result()[0]))
+    coords.join([unpack(x.result()[1]) for x in allruns[-npartitions:]])
 
     return df, coords
 
 
 @python_app
-def lmparsl(wf, configs, params, pgrad_acc):
+def lmparsl(wf, configs, params, pgrad_acc, npydir=None):
     import os
 
     os.environ["MKL_NUM_THREADS"] = "1"
@@ -106,25 +186,24 @@ def lmparsl(wf, configs, params, pgrad_acc):
     os.environ["OMP_NUM_THREADS"] = "1"
 
     from pyqmc.linemin import lm_sampler
+    from pyqmc.parsltools import pack, unpack
     import copy
-    import numpy as np
 
     data = lm_sampler(
-        copy.deepcopy(wf), np.array(configs), np.array(params), copy.deepcopy(pgrad_acc)
+        copy.deepcopy(wf), unpack(configs), params, copy.deepcopy(pgrad_acc)
     )
-    for d in data:
-        for k in d:
-            d[k] = d[k].tolist()
-    return data
+    return pack(data, npydir)
 
 
-def dist_lm_sampler(wf, configs, params, pgrad_acc, npartitions=2, sleeptime=5):
+def dist_lm_sampler(
+    wf, configs, params, pgrad_acc, npartitions=2, sleeptime=5, npydir=None
+):
     """
     Evaluates accumulator on the same set of configs for correlated sampling of different wave function parameters.  Parallelized with parsl.
 
     Args:
         wf: wave function object
-        configs: (nconf, nelec, 3) array
+        configs: (nconf, nelec, 3) configs object
         params: (nsteps, nparams) array 
             list of arrays of parameters (serialized) at each step
         pgrad_acc: PGradAccumulator 
@@ -133,6 +212,7 @@ def dist_lm_sampler(wf, configs, params, pgrad_acc, npartitions=2, sleeptime=5):
         npartitions: number of tasks for parallelization
             divides configs array into npartitions chunks
         sleeptime: time to wait between checking for results from parsl jobs
+        npydir: shared directory for .npy handoffs of large arrays (see pack())
 
     Returns:
         data: list of dicts, one dict for each sample
@@ -140,10 +220,14 @@ def dist_lm_sampler(wf, configs, params, pgrad_acc, npartitions=2, sleeptime=5):
     """
     import copy
 
-    configspart = np.split(configs, npartitions)
+    configspart = configs.split(npartitions)
     allruns = []
     for p in range(npartitions):
-        allruns.append(lmparsl(wf, configspart[p], params, pgrad_acc))
+        allruns.append(
+            lmparsl(
+                wf, pack(configspart[p], npydir), params, pgrad_acc, npydir=npydir
+            )
+        )
 
     import time
 
@@ -160,7 +244,7 @@ def dist_lm_sampler(wf, configs, params, pgrad_acc, npartitions=2, sleeptime=5):
 
     stepresults = []
     for r in allruns:
-        stepresults.append(r.result())
+        stepresults.append(unpack(r.result()))
 
     keys = stepresults[0][0].keys()
     # This will be a list of dictionaries
@@ -191,34 +275,50 @@ def line_minimization(*args, npartitions, **kwargs):
 
 
 @python_app
-def dmc_worker(*args, **kwargs):
+def dmc_worker(*args, npydir=None, **kwargs):
     import pyqmc
     import pyqmc.dmc
+    from pyqmc.parsltools import pack, unpack
     import copy
-    import pandas as pd
 
-    argcopy = tuple(copy.deepcopy(x) for x in args)
+    argcopy = tuple(copy.deepcopy(unpack(x)) for x in args)
     kwcopy = {}
     for k, v in kwargs.items():
         kwcopy[k] = copy.deepcopy(v)
-    df, configs, weights = pyqmc.dmc.dmc_propagate(*argcopy, **kwcopy)
-    return df, configs.tolist(), weights.tolist()
+    df, configs, weights, eloc = pyqmc.dmc.dmc_propagate(*argcopy, **kwcopy)
+    return pack((df, configs, weights), npydir)
 
 
-def distdmc_propagate(wf, configs, weights, *args, npartitions, **kwargs):
-    coord = np.split(configs, npartitions)
-    weight = np.split(weights, npartitions)
+def distdmc_propagate(
+    wf, configs, weights, *args, npartitions, npydir=None, eloc=None, **kwargs
+):
+    """Distributed version of dmc.dmc_propagate. The partitions always recompute
+    their wave functions, so eloc is ignored and None is returned in its place."""
+    coord = configs.split(npartitions)
+    sizes = [c.configs.shape[0] for c in coord]
+    weight = np.split(weights, np.cumsum(sizes)[:-1])
     allruns = []
     for nodeconfigs, nodeweight in zip(coord, weight):
-        allruns.append(dmc_worker(wf, nodeconfigs, nodeweight, *args, **kwargs))
+        allruns.append(
+            dmc_worker(
+                wf,
+                pack(nodeconfigs, npydir),
+                pack(nodeweight, npydir),
+                *args,
+                npydir=npydir,
+                **kwargs,
+            )
+        )
 
     import pandas as pd
 
-    allresults = [r.result() for r in allruns]
-    coordret = np.vstack([x[1] for x in allresults])
-    weightret = np.vstack([x[2] for x in allresults])
+    allresults = [unpack(r.result()) for r in allruns]
+    configs.join([x[1] for x in allresults])
+    coordret = configs
+    weightret = np.concatenate([x[2] for x in allresults])
     df = pd.concat([pd.DataFrame(x[0]) for x in allresults])
     notavg = ["weight", "weightvar", "weightmin", "weightmax", "acceptance", "step"]
+    notavg += ["tmove_acceptance"]
     # Here we reweight the averages since each step on each node
     # was done with a different average weight.
 
@@ -230,7 +330,7 @@ def distdmc_propagate(wf, configs, weights, *args, npartitions, **kwargs):
         if k not in notavg:
             df[k] = df[k] / df["weight"]
     print(df)
-    return df, coordret, weightret
+    return df, coordret, weightret, None
 
 
 def clean_pyscf_objects(mol, mf):
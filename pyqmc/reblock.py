@@ -7,7 +7,13 @@ def optimally_reblocked(data):
         Find optimal reblocking of input data. Takes in pandas
         DataFrame of raw data to reblock, returns DataFrame
         of reblocked data.
+        Columns with missing values, such as accumulators evaluated only
+        every few steps, are reblocked separately over their own samples.
     """
+    if data.isnull().values.any():
+        return pd.concat(
+            [optimally_reblocked(data[[c]].dropna()) for c in data.columns]
+        )
     opt = opt_block(data)
     n_reblock = int(np.amax(opt))
     rb_data = reblock_by2(data, n_reblock)
@@ -67,6 +73,27 @@ def reblock_summary(df, nblocks):
     return pd.DataFrame(d)
 
 
+def equilibration_steps(series, nblocks=10, tol=2.0):
+    """
+    Number of initial samples of series to discard as equilibration.
+    The series is divided into nblocks blocks, and leading blocks are discarded while
+    the mean of the first remaining block differs from the mean of the blocks after
+    it by more than tol error bars. The error bar is estimated from the scatter of
+    the later block means. At least two blocks are kept.
+    """
+    x = np.asarray(series, dtype=float)
+    blocksize = len(x) // nblocks
+    if blocksize == 0 or nblocks < 3:
+        return 0
+    means = np.array(_reblock(x[: blocksize * nblocks], nblocks))
+    for k in range(nblocks - 2):
+        rest = means[k + 1 :]
+        err = np.std(rest, ddof=1) * np.sqrt(1 + 1 / len(rest))
+        if np.abs(means[k] - np.mean(rest)) <= tol * err:
+            return k * blocksize
+    return (nblocks - 2) * blocksize
+
+
 def opt_block(df):
     """
     Finds optimal block size for each variable in a dataset
@@ -97,6 +124,107 @@ def opt_block(df):
     return optimal_block
 
 
+class StreamingBlocker:
+    """
+    Flyvbjerg-Petersen blocking of a series that arrives one sample at a time.
+
+    Level l holds the running mean and sum of squared deviations of the averages of
+    blocks of 2**l consecutive samples, and at most one block waiting for its partner,
+    so the memory grows as log2 of the number of samples. The blocks are the same as
+    those of reblock_by2(), and optimal_block() uses the criterion of opt_block(), so
+    at any moment the estimates agree with reblocking the whole series so far.
+    Samples can be numbers or arrays, such as a row of quantities; each element is
+    blocked separately.
+    """
+
+    def __init__(self):
+        self.n = []  # number of blocks at each level
+        self._mean = []
+        self._m2 = []
+        self._pending = []
+
+    def add(self, x):
+        """Add the sample x"""
+        x = np.array(x, dtype=float)
+        level = 0
+        while x is not None:
+            if level == len(self.n):
+                self.n.append(0)
+                self._mean.append(np.zeros(x.shape))
+                self._m2.append(np.zeros(x.shape))
+                self._pending.append(None)
+            self.n[level] += 1
+            delta = x - self._mean[level]
+            self._mean[level] += delta / self.n[level]
+            self._m2[level] += delta * (x - self._mean[level])
+            if self._pending[level] is None:
+                self._pending[level], x = x, None
+            else:
+                x, self._pending[level] = (self._pending[level] + x) / 2, None
+            level += 1
+
+    def _shape(self):
+        return self._mean[0].shape if self.n else ()
+
+    def mean(self):
+        """Mean of all samples; NaN if there are none"""
+        if not self.n:
+            return np.full(self._shape(), np.nan)
+        return self._mean[0].copy()
+
+    def standard_errors(self):
+        """Standard error of the mean estimated at each level with at least two
+        blocks; the first index is the level. Empty until there are two samples."""
+        nblocks = np.array([n for n in self.n if n > 1])
+        if len(nblocks) == 0:
+            return np.zeros((0,) + self._shape())
+        m2 = np.array(self._m2[: len(nblocks)])
+        nblocks = nblocks.reshape((-1,) + (1,) * (m2.ndim - 1))
+        return np.sqrt(m2 / (nblocks - 1) / nblocks)
+
+    def optimal_block(self):
+        """The level at which the standard error is converged, according to the
+        criterion of opt_block(). If no level meets it, the series is too short for a
+        reliable error, and the last level is returned; level 0 until there are two
+        samples."""
+        serr = self.standard_errors()
+        if len(serr) == 0:
+            return np.zeros(self._shape(), dtype=int)
+        levels = np.arange(len(serr)).reshape((-1,) + (1,) * (serr.ndim - 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(serr[0] > 0, serr / serr[0], 1.0)
+        converged = 2.0 ** (3 * levels) >= 2 * self.n[0] * ratio ** 4
+        return np.where(
+            converged.any(axis=0), np.argmax(converged, axis=0), len(serr) - 1
+        )
+
+    def standard_error(self):
+        """Returns the standard error at the optimal block and its uncertainty, both
+        NaN until there are two samples"""
+        serr = self.standard_errors()
+        if len(serr) == 0:
+            return np.full(self._shape(), np.nan), np.full(self._shape(), np.nan)
+        opt = self.optimal_block()
+        err = np.take_along_axis(serr, opt[np.newaxis], axis=0)[0]
+        nblocks = np.array(self.n)[opt]
+        return err, err / np.sqrt(2 * (nblocks - 1))
+
+    def summary(self, index=None):
+        """
+        Current estimates in the format of optimally_reblocked(), except that the
+        mean is over all samples and each element is blocked at its own optimal level.
+        index gives the names of the elements.
+        """
+        err, errerr = self.standard_error()
+        d = {
+            "mean": np.atleast_1d(self.mean()),
+            "standard error": np.atleast_1d(err),
+            "standard error error": np.atleast_1d(errerr),
+            "reblocks": np.atleast_1d(self.optimal_block()),
+        }
+        return pd.DataFrame(d, index=index)
+
+
 def test_reblocking():
     """
         Tests reblocking against known distribution.
@@ -157,6 +157,14 @@ class PySCFSlaterUHF:
         ratio *= self.single_twist_mask(e, epos, mask)
         self._updateval(ratio, s, mask)
 
+    def resample(self, newinds):
+        """Resample the internal state by new walker indices, in the same way as
+        configs.resample(newinds), so that recompute() is not needed after branching."""
+        self._aovals = self._aovals[newinds]
+        self._dets = [(phase[newinds], mag[newinds]) for phase, mag in self._dets]
+        self._inverse = [inv[newinds] for inv in self._inverse]
+        self.wrap = self.wrap[newinds]
+
     ### not state-changing functions
 
     def value(self):
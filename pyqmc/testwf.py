@@ -44,6 +44,53 @@ def test_updateinternals(wf, configs):
     }
 
 
+def test_resample(wf, configs):
+    """
+    Parameters:
+    wf: a wave function object to be tested
+    configs: nconf x nelec x 3 position array
+
+    Returns: 
+    dictionary with the largest differences in value, gradient and move ratio between 
+    wf.resample() and a recompute on the resampled configs
+
+    """
+
+    nconf, ne, ndim = configs.configs.shape
+    configs = configs.copy()
+    wf.recompute(configs)
+    for e in range(ne):
+        epos = configs.make_irreducible(e, configs.configs[:, e, :] + 1e-2)
+        wf.updateinternals(e, epos)
+        configs.move(e, epos, [True] * nconf)
+
+    newinds = np.random.randint(0, nconf, nconf)
+    configs.resample(newinds)
+    wf.resample(newinds)
+    resampled = wf.value()
+    grad = wf.gradient(0, configs.electron(0))
+    epos = configs.make_irreducible(0, configs.configs[:, 0, :] + 1e-2)
+    ratio = wf.testvalue(0, epos)
+    wf.updateinternals(0, epos)
+    moved = wf.value()
+
+    wfcopy = copy.deepcopy(wf)
+    recompute = wfcopy.recompute(configs)
+    recomputegrad = wfcopy.gradient(0, configs.electron(0))
+    recomputeratio = wfcopy.testvalue(0, epos)
+    wfcopy.updateinternals(0, epos)
+    recomputemoved = wfcopy.value()
+
+    return {
+        "resamplevalue": np.max(
+            np.abs(resampled[0] * np.exp(resampled[1] - recompute[1]) - recompute[0])
+        ),
+        "resamplegradient": np.max(np.abs(grad - recomputegrad)),
+        "resampleratio": np.max(np.abs(ratio - recomputeratio)),
+        "resamplemove": np.max(np.abs(moved[1] - recomputemoved[1])),
+    }
+
+
 def test_wf_gradient(wf, configs, delta=1e-5):
     """ 
     Parameters:
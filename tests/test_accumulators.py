@@ -34,5 +34,62 @@ def test_transform():
     assert gradtrans.shape[0] == nconfig
 
 
+def test_coulomb_tracker():
+    from pyscf import gto
+    import pyqmc
+    from pyqmc.energy import OpenCoulomb, ee_energy, ei_energy, ii_energy
+
+    mol = gto.M(atom="Li 0. 0. 0.; H 0. 0. 1.5", basis="sto-3g", unit="bohr")
+    nconf = 20
+    configs = pyqmc.initial_guess(mol, nconf)
+    coulomb = OpenCoulomb(mol)
+    coulomb.energy(configs)
+    nelec = configs.configs.shape[1]
+    for step in range(3):
+        for e in range(nelec):
+            newcoorde = configs.configs[:, e] + 0.3 * np.random.randn(nconf, 3)
+            newcoorde = configs.make_irreducible(e, newcoorde)
+            configs.move(e, newcoorde, np.random.random(nconf) > 0.5)
+    configs.resample(np.random.randint(nconf, size=nconf))
+    ee, ei, ii = coulomb.energy(configs)
+    assert "coulomb" in configs.trackers
+    assert np.max(np.abs(ee - ee_energy(configs))) < 1e-10
+    assert np.max(np.abs(ei - ei_energy(mol, configs))) < 1e-10
+    assert abs(ii - ii_energy(mol)) < 1e-10
+    assert abs(ii - mol.energy_nuc()) < 1e-10
+
+    # trackers are not pickled or copied with the walkers
+    import pickle
+
+    assert pickle.loads(pickle.dumps(configs)).trackers == {}
+    assert configs.copy().trackers == {}
+    assert "coulomb" in configs.trackers
+
+
+def test_shared_energy():
+    """energy and pgrad share one local energy evaluation per step, so the random
+    ECP quadrature gives identical totals, also with quadratures chosen per species"""
+    from pyscf import gto, scf
+    import pyqmc
+
+    mol = gto.M(
+        atom="H 0. 0. 0.; H 0. 0. 1.4", ecp="bfd", basis="bfd_vdz", unit="bohr"
+    )
+    mf = scf.RHF(mol).run()
+    wf = pyqmc.slater_jastrow(mol, mf)
+    transform = LinearTransform(wf.parameters)
+    for naip in [None, {"H": 12}]:
+        accumulators = {
+            "energy": pyqmc.EnergyAccumulator(mol, naip=naip),
+            "pgrad": pyqmc.PGradTransform(
+                pyqmc.EnergyAccumulator(mol, naip=naip), transform
+            ),
+        }
+        configs = pyqmc.initial_guess(mol, 20)
+        df, configs = pyqmc.vmc(wf, configs, nsteps=3, accumulators=accumulators)
+        for d in df:
+            assert d["energytotal"] == d["pgradtotal"]
+
+
 if __name__ == "__main__":
     test_transform()
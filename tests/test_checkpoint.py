@@ -0,0 +1,55 @@
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+import numpy as np
+import pandas as pd
+
+
+def test_restart(tmp_path):
+    """ A run that is interrupted and restarted from its checkpoint gives the same
+    steps as an uninterrupted run """
+    from pyscf import gto, scf
+    import pyqmc
+    from pyqmc.accumulators import EnergyAccumulator
+    from pyqmc.checkpoint import Checkpoint
+
+    mol = gto.M(atom="Li 0. 0. 0.; H 0. 0. 1.5", basis="sto-3g", unit="bohr")
+    mf = scf.RHF(mol).run()
+    wf = pyqmc.slater_jastrow(mol, mf)
+    acc = {"energy": EnergyAccumulator(mol)}
+    configs = pyqmc.initial_guess(mol, 50)
+    df, configs = pyqmc.vmc(wf, configs, nsteps=5)
+    start = configs.copy()
+    rng = np.random.get_state()
+
+    def run(function, nsteps, checkpoint=None, restart=False, **kwargs):
+        configs = start.copy()
+        if not restart:
+            np.random.set_state(rng)
+        else:
+            configs.configs += np.random.rand(*configs.configs.shape)
+        df = function(
+            wf,
+            configs,
+            nsteps=nsteps,
+            accumulators=acc,
+            checkpoint=checkpoint,
+            restart=restart,
+            **kwargs,
+        )[0]
+        return pd.DataFrame(df)
+
+    for function, name, kwargs in [
+        (pyqmc.vmc, "vmc", {}),
+        (pyqmc.rundmc, "dmc", {"branchtime": 5, "tstep": 0.02}),
+    ]:
+        full = run(function, 20, **kwargs)
+        checkpoint = Checkpoint(str(tmp_path / (name + ".npz")), interval=10)
+        run(function, 10, checkpoint, **kwargs)
+        resumed = run(function, 20, checkpoint, restart=True, **kwargs)
+        full = full[full["step"] >= 10].reset_index(drop=True)
+        print(name, len(full), len(resumed))
+        assert len(full) == len(resumed)
+        assert np.allclose(full["energytotal"], resumed["energytotal"])
@@ -0,0 +1,120 @@
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+import numpy as np
+import pytest
+from pyscf import gto, scf
+import pyqmc
+
+distributed = pytest.importorskip("dask.distributed")
+
+
+@pytest.fixture(scope="module", params=[True, False], ids=["processes", "threads"])
+def client(request):
+    cluster = distributed.LocalCluster(
+        n_workers=2, threads_per_worker=1, processes=request.param
+    )
+    client = distributed.Client(cluster)
+    yield client
+    client.close()
+    cluster.close()
+
+
+@pytest.fixture(scope="module")
+def h2():
+    mol = gto.M(atom="H 0 0 0; H 0 0 1.4", basis="sto-3g", unit="bohr")
+    mf = scf.RHF(mol).run()
+    return mol, pyqmc.slater_jastrow(mol, mf)
+
+
+def test_distributed_walkers(client, h2):
+    """ Walkers kept on the workers come back unchanged and in order, and VMC runs
+    on them in place without touching the caller's wave function """
+    from pyqmc.dasktools import DistributedWalkers, distvmc
+
+    mol, wf = h2
+    configs = pyqmc.initial_guess(mol, 30)
+    start = configs.configs.copy()
+    value = wf.recompute(configs)
+    walkers = DistributedWalkers(wf, configs, client, npartitions=3)
+    assert np.array_equal(walkers.configs, start)
+
+    acc = {"energy": pyqmc.EnergyAccumulator(mol)}
+    df, walkers = distvmc(wf, walkers, accumulators=acc, nsteps=4, client=client)
+    assert len(df) == 4
+    moved = walkers.configs
+    assert moved.shape == start.shape
+    assert not np.allclose(moved, start)
+    assert all(np.array_equal(a, b) for a, b in zip(wf.value(), value))
+
+
+def test_distributed_resample(client, h2):
+    """ Resampling the resident walkers, with the sorted indices of the comb and with
+    an arbitrary reordering, gives the same walkers as resampling them locally """
+    from pyqmc.dasktools import DistributedWalkers
+
+    mol, wf = h2
+    configs = pyqmc.initial_guess(mol, 30)
+    ref = configs.copy()
+    walkers = DistributedWalkers(wf, configs, client, npartitions=3)
+    for newinds in [
+        np.sort(np.random.randint(0, 30, 30)),
+        np.random.permutation(30),
+        np.random.randint(0, 30, 30),
+    ]:
+        ref.resample(newinds)
+        walkers.resample(newinds)
+        assert np.array_equal(walkers.configs, ref.configs)
+
+
+def test_distributed_splitmerge(client, h2):
+    """ The resident walkers can change in number, as with split/merge branching,
+    and still be gathered; distributed DMC runs with branch_splitmerge """
+    from pyqmc.dasktools import DistributedWalkers, distdmc_propagate
+    from pyqmc.dmc import branch_splitmerge, rundmc
+
+    mol, wf = h2
+    configs = pyqmc.initial_guess(mol, 30)
+    ref = configs.copy()
+    walkers = DistributedWalkers(wf, configs, client, npartitions=3)
+    for newinds in [np.repeat(np.arange(30), 2), np.arange(0, 60, 3)]:
+        ref.resample(newinds)
+        walkers.resample(newinds)
+        assert np.array_equal(walkers.configs, ref.configs)
+
+    acc = {"energy": pyqmc.EnergyAccumulator(mol)}
+    df, walkers, weights = rundmc(
+        wf,
+        walkers,
+        nsteps=6,
+        branchtime=2,
+        tstep=0.02,
+        accumulators=acc,
+        branch=branch_splitmerge,
+        propagate=distdmc_propagate,
+        client=client,
+    )
+    assert walkers.configs.shape[0] == len(weights)
+    assert np.all(np.isfinite(df["energytotal"]))
+
+
+def test_distributed_walker_quantities(client, h2):
+    """ Per-walker quantities come back only for the last steps, with the walkers
+    of all partitions concatenated instead of averaged """
+    from pyqmc.dasktools import DistributedWalkers, distvmc
+
+    mol, wf = h2
+    configs = pyqmc.initial_guess(mol, 30)
+    walkers = DistributedWalkers(wf, configs, client, npartitions=3)
+    pgrad = pyqmc.gradient_generator(mol, wf, ["wf2acoeff"])
+    pgrad.matrix_free = True
+    pgrad.walker_steps = 2
+    df, walkers = distvmc(
+        wf, walkers, accumulators={"pgrad": pgrad}, nsteps=4, client=client
+    )
+    assert ["pgraddpwalker" in d for d in df] == [False, False, True, True]
+    nparam = wf.parameters["wf2acoeff"].size
+    assert df[-1]["pgraddpwalker"].shape == (30, nparam)
+    assert df[-1]["pgraddppsi"].shape == (nparam,)
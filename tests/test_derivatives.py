@@ -57,6 +57,10 @@ def test_wfs():
             print(k, item)
             assert item < epsilon
 
+        for k, item in testwf.test_resample(wf, epos).items():
+            print(k, item)
+            assert item < epsilon
+
 
 def test_func3d():
     """
@@ -117,6 +121,62 @@ def test_func3d():
     assert abs(l_both).sum() == 0
 
 
+def test_recompute_parameters():
+    """
+    Recomputing only the factors whose parameters changed gives the same value and
+    energy as a full recompute.
+    """
+    from pyscf import gto, scf
+    from pyqmc.slateruhf import PySCFSlaterUHF
+    from pyqmc.jastrowspin import JastrowSpin
+    from pyqmc.multiplywf import MultiplyWF, recompute_parameters
+    from pyqmc.accumulators import EnergyAccumulator
+    import pyqmc
+
+    mol = gto.M(atom="Li 0. 0. 0.; H 0. 0. 1.5", basis="sto-3g", unit="bohr")
+    mf = scf.RHF(mol).run()
+    wf = MultiplyWF(PySCFSlaterUHF(mol, mf), JastrowSpin(mol))
+    enacc = EnergyAccumulator(mol)
+    configs = pyqmc.initial_guess(mol, 10)
+    wf.recompute(configs)
+    for changed in [["wf2acoeff", "wf2bcoeff"], ["wf1mo_coeff_alpha"]]:
+        for k in changed:
+            wf.parameters[k] = np.random.rand(*wf.parameters[k].shape) * 0.1
+        val = recompute_parameters(wf, configs, changed)[1]
+        en = enacc(configs, wf)["total"]
+        assert np.max(np.abs(val - wf.recompute(configs)[1])) < 1e-10
+        assert np.max(np.abs(en - enacc(configs, wf)["total"])) < 1e-8
+
+
+def test_linear_jastrow_energy():
+    """
+    The log value and kinetic energy from cached Jastrow basis sums agree with a
+    recompute for new coefficients.
+    """
+    from pyscf import gto, scf
+    from pyqmc.slateruhf import PySCFSlaterUHF
+    from pyqmc.jastrowspin import JastrowSpin
+    from pyqmc.multiplywf import MultiplyWF
+    from pyqmc.linearjastrow import linear_jastrow_energy
+    from pyqmc.energy import kinetic
+    import pyqmc
+
+    mol = gto.M(atom="Li 0. 0. 0.; H 0. 0. 1.5", basis="sto-3g", unit="bohr")
+    mf = scf.RHF(mol).run()
+    wf = MultiplyWF(PySCFSlaterUHF(mol, mf), JastrowSpin(mol))
+    configs = pyqmc.initial_guess(mol, 10)
+    keys = ["wf2acoeff", "wf2bcoeff"]
+    assert linear_jastrow_energy(wf, configs, ["wf1mo_coeff_alpha"]) is None
+    linear = linear_jastrow_energy(wf, configs, keys)
+    for i in range(2):
+        newparms = {k: np.random.rand(*wf.parameters[k].shape) * 0.1 for k in keys}
+        logval, ke = linear(newparms)
+        for k in keys:
+            wf.parameters[k] = newparms[k]
+        assert np.max(np.abs(logval - wf.recompute(configs)[1])) < 1e-10
+        assert np.max(np.abs(ke - kinetic(configs, wf))) < 1e-8
+
+
 if __name__ == "__main__":
     test_wfs()
     test_func3d()
@@ -71,5 +71,93 @@ def test():
     ), "energy not within {0} of -0.5: energy {1}".format(5 * err, np.mean(energy))
 
 
+def test_branch_splitmerge():
+    """ Split/merge branching conserves weight and copies the right walkers """
+    from pyqmc.dmc import branch_splitmerge
+    from pyqmc.coord import OpenConfigs
+
+    nconf = 200
+    weights = np.exp(np.random.randn(nconf))
+    configs = OpenConfigs(np.random.randn(nconf, 2, 3))
+    ids = configs.configs[:, 0, 0].copy()
+    wavg = np.mean(weights)
+
+    configs, newweights, newinds = branch_splitmerge(configs, weights, wsplit=2.0, wmerge=0.5)
+    assert configs.configs.shape[0] == len(newweights) == len(newinds)
+    assert np.abs(np.sum(newweights) - np.sum(weights)) < 1e-10
+    assert np.all(newweights <= 2.0 * wavg)
+    nmerge = np.sum(weights < 0.5 * wavg) // 2
+    nsplit = np.sum((weights / wavg).astype(int)[weights > 2.0 * wavg] - 1)
+    assert len(newweights) == nconf - nmerge + nsplit
+    # every walker is a copy of an original walker, and carries at least its weight
+    orig = np.searchsorted(np.sort(ids), configs.configs[:, 0, 0])
+    worig = weights[np.argsort(ids)][orig]
+    light = worig < 0.5 * wavg
+    assert np.all(newweights[light] >= worig[light])
+
+
+def test_recompute_every():
+    """ Between branchings the wave function follows the walkers through resample(),
+    and it is only recomputed from scratch every recompute_every branch steps """
+    from pyscf import gto, scf
+    import pyqmc
+    from pyqmc.dmc import rundmc
+
+    mol = gto.M(atom="H 0. 0. 0.", basis="sto-3g", unit="bohr", spin=1)
+    mf = scf.UHF(mol).run()
+    wf = pyqmc.PySCFSlaterUHF(mol, mf)
+    ncalls = []
+    recompute = wf.recompute
+
+    def counted_recompute(configs):
+        ncalls.append(1)
+        return recompute(configs)
+
+    wf.recompute = counted_recompute
+    acc = {"energy": pyqmc.EnergyAccumulator(mol)}
+    configs = pyqmc.initial_guess(mol, 50)
+    df, configs, weights = rundmc(
+        wf, configs, nsteps=20, branchtime=2, accumulators=acc, recompute_every=3
+    )
+    # the first propagation, and after branch steps 3, 6 and 9
+    assert len(ncalls) == 4
+    assert np.all(np.isfinite(df["energytotal"]))
+
+
+def test_tmoves():
+    """ T-moves and the locality approximation give the same DMC energy for a
+    pseudopotential atom within four combined error bars, below the mean-field
+    energy """
+    from pyscf import gto, scf
+    import pyqmc
+    from pyqmc.dmc import rundmc
+
+    mol = gto.M(atom="C 0. 0. 0.", ecp="bfd", basis="bfd_vtz", spin=2)
+    mf = scf.UHF(mol).run()
+    wf = pyqmc.PySCFSlaterUHF(mol, mf)
+    acc = {"energy": pyqmc.EnergyAccumulator(mol)}
+    configs = pyqmc.initial_guess(mol, 100, rng=np.random.default_rng(1))
+    df, configs = pyqmc.vmc(wf, configs, nsteps=20, accumulators=acc)
+    nsteps, warmup = 200, 40
+    energy, err = {}, {}
+    for tmoves in [True, False]:
+        df, _, weights = rundmc(
+            wf,
+            configs.copy(),
+            nsteps=nsteps,
+            tstep=0.05,
+            accumulators=acc,
+            tmoves=tmoves,
+        )
+        if tmoves:
+            assert np.mean(df["tmove_acceptance"]) > 0
+        rb = reblock.optimally_reblocked(df[["energytotal"]][warmup:])
+        energy[tmoves] = rb["mean"]["energytotal"]
+        err[tmoves] = rb["standard error"]["energytotal"]
+    print("T-moves", energy[True], err[True], "locality", energy[False], err[False])
+    assert np.abs(energy[True] - energy[False]) < 4 * np.hypot(err[True], err[False])
+    assert energy[True] < mf.e_tot
+
+
 if __name__ == "__main__":
     test()
@@ -31,5 +31,112 @@ def test_ecp():
     )
 
 
+def test_ecp_batched(monkeypatch):
+    """ The batched evaluation over atoms agrees with the sum over single atoms for a
+    wave function whose ratios differ from 1 """
+    import pyqmc
+    from pyqmc import eval_ecp
+
+    mol = gto.M(
+        atom="C 0 0 0; O 0 0 2.1; H 0 1.8 -1.0",
+        ecp={"C": "bfd", "O": "bfd"},
+        basis={"C": "bfd_vdz", "O": "bfd_vdz", "H": "sto-3g"},
+        unit="bohr",
+        spin=1,
+    )
+    mf = scf.UHF(mol).run()
+    wf = pyqmc.slater_jastrow(mol, mf)
+    rng = np.random.default_rng(2)
+    for k in ["wf2acoeff", "wf2bcoeff"]:
+        wf.parameters[k] = 0.1 * rng.standard_normal(wf.parameters[k].shape)
+    # The same quadrature points in both evaluations, so that they can be compared
+    identity = lambda n, rng=None: np.tile(np.eye(3), (n, 1, 1))
+    monkeypatch.setattr(eval_ecp, "random_rotations", identity)
+    nconf = 100
+    coords = initial_guess(mol, nconf)
+    wf.recompute(coords)
+    threshold = 1e15
+    nelec = coords.configs.shape[1]
+    batched = eval_ecp.ecp(mol, coords, wf, threshold)
+    single = np.zeros(nconf)
+    ratios = []
+    for e in range(nelec):
+        for at in [0, 1]:
+            local, nonlocal_, epos_rot = eval_ecp.ecp_ea_quadrature(
+                mol, coords, wf, e, at, threshold
+            )
+            single += local + np.sum(nonlocal_, axis=1)
+            epos = coords.make_irreducible(e, epos_rot)
+            ratios.append(wf.testvalue(e, epos))
+    assert np.std(np.concatenate(ratios, axis=None)) > 0.01
+    assert np.allclose(batched, single)
+
+
+def test_ecp_cutoff(monkeypatch):
+    """ Electron-atom pairs beyond the cutoff radius are skipped, and skipping them
+    does not change the energy """
+    import pytest
+    import pyqmc
+    from pyqmc import eval_ecp
+
+    mol = gto.M(
+        atom="C 0 0 0; C 0 0 12", ecp="bfd", basis="bfd_vdz", unit="bohr", spin=2
+    )
+    mf = scf.UHF(mol).run()
+    species = eval_ecp.generate_ecp_species(mol)
+    carbon = species["C"]
+    rcut = carbon["rcut"]
+    r = np.linspace(rcut, 3 * rcut, 50)
+    assert np.all([np.abs(f(r)) < 1e-8 for f in carbon["functors"].values()])
+    with pytest.raises(ValueError):
+        eval_ecp.ecp_cutoff(carbon["functors"], 1e-8, rmax=rcut / 2)
+
+    coords = initial_guess(mol, 200)
+    epos = np.random.uniform([-3, -3, -3], [3, 3, 15], size=(200, 3))
+    ci, ai, r_ea_vec = eval_ecp.ecp_pairs(carbon, coords, epos)
+    dist = np.linalg.norm(epos[:, np.newaxis] - carbon["coords"], axis=-1)
+    assert 0 < len(ci) < 200
+    assert np.array_equal(np.sort(ci * 2 + ai), np.flatnonzero(dist < rcut))
+    assert np.allclose(r_ea_vec, epos[ci] - carbon["coords"][ai])
+
+    wf = pyqmc.slater_jastrow(mol, mf)
+    wf.parameters["wf2acoeff"] = 0.1 * np.ones(wf.parameters["wf2acoeff"].shape)
+    wf.recompute(coords)
+    identity = lambda n, rng=None: np.tile(np.eye(3), (n, 1, 1))
+    monkeypatch.setattr(eval_ecp, "random_rotations", identity)
+    nocutoff = {"C": dict(carbon, rcut=np.inf, kmax=2)}
+    threshold = 1e15
+    cut = eval_ecp.ecp(mol, coords, wf, threshold, species)
+    full = eval_ecp.ecp(mol, coords, wf, threshold, nocutoff)
+    assert np.allclose(cut, full)
+
+
+def test_quadrature_rules():
+    """ Each quadrature rule integrates polynomials up to its degree exactly """
+    import itertools
+    from pyqmc.eval_ecp import quadrature_rules, random_rotations
+
+    def doublefactorial(n):
+        return np.prod(np.arange(n, 0, -2)) if n > 0 else 1
+
+    for npts, (degree, directions, weights) in quadrature_rules.items():
+        rotated = np.einsum("jk,nk->nj", random_rotations(1)[0], directions)
+        for a, b, c in itertools.product(range(degree + 1), repeat=3):
+            if a + b + c > degree:
+                continue
+            if a % 2 or b % 2 or c % 2:
+                exact = 0.0
+            else:
+                exact = (
+                    doublefactorial(a - 1)
+                    * doublefactorial(b - 1)
+                    * doublefactorial(c - 1)
+                    / doublefactorial(a + b + c + 1)
+                )
+            for x in [directions, rotated]:
+                quad = np.dot(weights, x[:, 0] ** a * x[:, 1] ** b * x[:, 2] ** c)
+                assert abs(quad - exact) < 1e-12, (npts, a, b, c, quad, exact)
+
+
 if __name__ == "__main__":
     test_ecp()
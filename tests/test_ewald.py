@@ -0,0 +1,58 @@
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+import numpy as np
+from pyscf.pbc import gto
+from pyqmc.coord import PeriodicConfigs
+from pyqmc.ewald import Ewald
+
+
+def test_madelung():
+    """Rock salt structure: ions on the Na sites, electrons on the Cl sites"""
+    L = 4.0
+    cell = gto.M(
+        atom="H 0 0 0; H 0 2 2; H 2 0 2; H 2 2 0",
+        basis="sto-3g",
+        a=np.eye(3) * L,
+        unit="bohr",
+        verbose=0,
+    )
+    ewald = Ewald(cell)
+    assert abs(ewald.ii_energy - cell.energy_nuc()) < 1e-6
+
+    epos = np.array([[2.0, 0, 0], [0, 2, 0], [0, 0, 2], [2, 2, 2]])
+    configs = PeriodicConfigs(epos[np.newaxis], cell.a)
+    ee, ei, ii = ewald.energy(configs)
+    madelung = 1.747565
+    assert abs(ee[0] + ei[0] + ii + 4 * madelung / (L / 2)) < 1e-5
+
+
+def test_structure_factor_updates():
+    L = 3.0
+    cell = gto.M(
+        atom="H 0 0 0; H 0.75 0.75 0.75",
+        basis="sto-3g",
+        a=(np.ones((3, 3)) - np.eye(3)) * L / 2,
+        unit="bohr",
+        verbose=0,
+    )
+    assert abs(Ewald(cell).ii_energy - cell.energy_nuc()) < 1e-6
+
+    nconf, nelec = 10, 2
+    ewald = Ewald(cell)
+    configs = PeriodicConfigs(np.random.randn(nconf, nelec, 3), cell.a)
+    ewald.energy(configs)
+    for step in range(5):
+        for e in range(nelec):
+            newcoorde = configs.configs[:, e] + 0.5 * np.random.randn(nconf, 3)
+            newcoorde = configs.make_irreducible(e, newcoorde)
+            accept = np.random.random(nconf) > 0.5
+            configs.move(e, newcoorde, accept)
+    configs.resample(np.random.randint(nconf, size=nconf))
+    tracked = ewald.energy(configs)
+
+    fresh = Ewald(cell).energy(configs.copy())
+    for a, b in zip(tracked, fresh):
+        assert np.max(np.abs(a - b)) < 1e-10
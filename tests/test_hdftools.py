@@ -0,0 +1,55 @@
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+import numpy as np
+import pandas as pd
+from pyscf import gto, scf
+import pyqmc
+from pyqmc.accumulators import EnergyAccumulator
+from pyqmc.hdftools import append, read_hdf
+
+
+def test_vmc_hdf(tmp_path):
+    """ The HDF5 output of vmc holds the same data as the returned list, including
+    array-valued quantities and accumulators evaluated only every few steps """
+    mol = gto.M(atom="Li 0. 0. 0.; H 0. 0. 1.5", basis="sto-3g", unit="bohr")
+    mf = scf.RHF(mol).run()
+    wf = pyqmc.slater_jastrow(mol, mf)
+    acc = {
+        "energy": EnergyAccumulator(mol),
+        "pgrad": (pyqmc.gradient_generator(mol, wf, ["wf2acoeff"]), 3),
+    }
+    hdf_file = str(tmp_path / "vmc.hdf5")
+    configs = pyqmc.initial_guess(mol, 30)
+    df, configs = pyqmc.vmc(
+        wf, configs, nsteps=4, accumulators=acc, stepoffset=1, hdf_file=hdf_file
+    )
+    df2, configs = pyqmc.vmc(
+        wf, configs, nsteps=3, accumulators=acc, stepoffset=5, hdf_file=hdf_file
+    )
+    df = pd.DataFrame(df + df2)
+    data = read_hdf(hdf_file)
+
+    assert np.array_equal(data["step"], df["step"])
+    assert np.allclose(data["energytotal"], df["energytotal"])
+    sampled = df["pgraddppsi"].notnull().values
+    assert np.array_equal(sampled, np.isfinite(data["pgraddppsi"][:, 0]))
+    assert np.allclose(data["pgraddppsi"][sampled], np.stack(df["pgraddppsi"][sampled]))
+
+
+def test_append_types(tmp_path):
+    """ Numbers are stored as float64, so a key that starts out as an integer keeps
+    later fractional values, and a key whose shape changes is rejected """
+    import pytest
+
+    hdf_file = str(tmp_path / "rows.hdf5")
+    append(hdf_file, [{"n": 1, "x": np.float32(0.5)}, {"n": 2.5, "x": 1e-50}])
+    data = read_hdf(hdf_file)
+    assert data["n"].dtype == data["x"].dtype == np.float64
+    assert np.array_equal(data["n"], [1.0, 2.5])
+    assert np.array_equal(data["x"], [0.5, 1e-50])
+    append(hdf_file, [{"v": np.zeros(3)}])
+    with pytest.raises(ValueError):
+        append(hdf_file, [{"v": np.zeros(4)}])
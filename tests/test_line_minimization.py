@@ -10,17 +10,22 @@ from pyscf import lib, gto, scf
 from pyqmc import slater_jastrow, line_minimization, initial_guess, gradient_generator
 
 
-def test():
+def test(tmp_path):
     """ Optimize a Helium atom's wave function and check that it's 
-    better than Hartree-Fock"""
+    better than Hartree-Fock, and that the history is written to hdf_file"""
+    import numpy as np
+    from pyqmc.hdftools import read_hdf
 
     mol = gto.M(atom="He 0. 0. 0.", basis="bfd_vdz", ecp="bfd", unit="bohr")
     mf = scf.RHF(mol).run()
     wf = slater_jastrow(mol, mf)
     nconf = 500
+    hdf_file = str(tmp_path / "linemin.hdf5")
     wf, dfgrad, dfline = line_minimization(
-        wf, initial_guess(mol, nconf), gradient_generator(mol, wf)
+        wf, initial_guess(mol, nconf), gradient_generator(mol, wf), hdf_file=hdf_file
     )
+    assert np.allclose(read_hdf(hdf_file, "grad")["en"], [d["en"] for d in dfgrad])
+    assert len(read_hdf(hdf_file, "line")["en"]) == len(dfline)
     dfgrad = pd.DataFrame(dfgrad)
     mfen = mf.energy_tot()
     enfinal = dfgrad["en"].values[-1]
@@ -28,5 +33,60 @@ def test():
     assert mfen > enfinal
 
 
+def test_sr_cg():
+    """ The matrix-free SR update agrees with the dense one """
+    import numpy as np
+    from pyqmc.linemin import SROperator, sr_update, sr_cg_update
+
+    nconf, nparam = 200, 30
+    dp = np.random.randn(nconf, nparam) * np.linspace(0.1, 2, nparam)
+    pgrad = np.random.randn(nparam)
+    S = SROperator(dp)
+    dpmean = np.mean(dp, axis=0)
+    Sdense = np.dot(dp.T, dp) / nconf - np.outer(dpmean, dpmean)
+    assert np.allclose(S.dot(pgrad), np.dot(Sdense, pgrad))
+    assert np.allclose(S.diagonal(), np.diag(Sdense))
+
+    dense = sr_update(pgrad, Sdense, 0.3, eps=0.1)
+    cg = sr_cg_update(pgrad, S, 0.3, eps=0.1, tol=1e-10)
+    assert np.allclose(dense, cg, atol=1e-8)
+
+
+def test_matrix_free(tmp_path):
+    """ The matrix-free SR overlap is averaged over the walkers of the last
+    walker_steps steps, which are the only ones kept, and line_minimization uses it
+    with the default update """
+    import numpy as np
+    import pyqmc
+    from pyqmc.linemin import SROperator
+
+    mol = gto.M(atom="He 0. 0. 0.", basis="bfd_vdz", ecp="bfd", unit="bohr")
+    mf = scf.RHF(mol).run()
+    wf = slater_jastrow(mol, mf)
+    dense = gradient_generator(mol, wf, ["wf2acoeff", "wf2bcoeff"])
+    free = gradient_generator(mol, wf, ["wf2acoeff", "wf2bcoeff"])
+    free.matrix_free = True
+    free.walker_steps = 2
+    configs = initial_guess(mol, 100)
+    df, configs = pyqmc.vmc(
+        wf, configs, nsteps=5, accumulators={"dense": dense, "free": free}
+    )
+    df = pd.DataFrame(df)
+    assert np.array_equal(df["freedpwalker"].notnull(), [False] * 3 + [True] * 2)
+    dp = np.mean(df["densedppsi"][-2:], axis=0)
+    Sdense = np.mean(df["densedpidpj"][-2:], axis=0) - np.outer(dp, dp)
+    S = SROperator(np.concatenate(df["freedpwalker"].dropna().values))
+    v = np.random.randn(len(dp))
+    assert np.allclose(S.dot(v), Sdense.dot(v))
+
+    wf, dfgrad, dfline = line_minimization(
+        wf, configs, free, maxiters=3, dataprefix=str(tmp_path / "")
+    )
+    assert np.all(np.isfinite(pd.DataFrame(dfgrad)["en"]))
+
+
 if __name__ == "__main__":
-    test()
+    import pathlib
+    import tempfile
+
+    test(pathlib.Path(tempfile.mkdtemp()))
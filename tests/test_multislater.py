@@ -37,6 +37,8 @@ def test():
       
         for k, item in testwf.test_updateinternals(wf, epos).items():
             assert item < epsilon
+        for k, item in testwf.test_resample(wf, epos).items():
+            assert item < epsilon
         assert testwf.test_wf_gradient(wf, epos, delta=delta)[0] < epsilon
         assert testwf.test_wf_laplacian(wf, epos, delta=delta)[0] < epsilon
         assert testwf.test_wf_pgradient(wf, epos, delta=delta)[0] < epsilon
@@ -0,0 +1,28 @@
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+import numpy as np
+from pyscf import gto, scf
+from pyqmc import slater_jastrow, initial_guess, gradient_generator, adam_descent
+
+
+def test():
+    """ Optimize the Jastrow factor of a Helium atom with AMSGrad and check that
+    the energy of the last updates is better than Hartree-Fock"""
+
+    mol = gto.M(atom="He 0. 0. 0.", basis="bfd_vdz", ecp="bfd", unit="bohr")
+    mf = scf.RHF(mol).run()
+    wf = slater_jastrow(mol, mf)
+    pgrad = gradient_generator(mol, wf, to_opt=["wf2acoeff", "wf2bcoeff"])
+    pgrad.matrix_free = True
+    wf, data = adam_descent(
+        wf, initial_guess(mol, 300), pgrad, maxiters=40, step=0.05, amsgrad=True
+    )
+    en = np.array(data["totalen"][-10:])
+    assert mf.energy_tot() - np.mean(en) > 3 * np.std(en) / np.sqrt(len(en))
+
+
+if __name__ == "__main__":
+    test()
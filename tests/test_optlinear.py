@@ -0,0 +1,54 @@
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+import numpy as np
+from pyscf import gto, scf
+from pyqmc import slater_jastrow, initial_guess, gradient_generator, linear_method
+from pyqmc.accumulators import LinearMethodTransform
+
+
+def test():
+    """ Optimize the Jastrow factor of a Helium atom with the linear method and
+    check that it's better than Hartree-Fock after a few iterations"""
+
+    mol = gto.M(atom="He 0. 0. 0.", basis="bfd_vdz", ecp="bfd", unit="bohr")
+    mf = scf.RHF(mol).run()
+    wf = slater_jastrow(mol, mf)
+    pgrad = gradient_generator(mol, wf, to_opt=["wf2acoeff", "wf2bcoeff"])
+    lm_acc = LinearMethodTransform(pgrad.enacc, pgrad.transform)
+    wf, data = linear_method(
+        wf,
+        initial_guess(mol, 300),
+        lm_acc,
+        maxiters=3,
+        warmup=5,
+        vmcoptions={"nsteps": 30},
+    )
+    en, en_err = data[-1]["en"], data[-1]["en_err"]
+    assert mf.energy_tot() - en > 3 * en_err
+
+
+def test_energy_derivatives():
+    """ The analytic derivatives of the local energy with respect to the Jastrow
+    coefficients agree with finite differences """
+    mol = gto.M(atom="Li 0. 0. 0.; H 0. 0. 1.5", basis="sto-3g", unit="bohr")
+    mf = scf.RHF(mol).run()
+    wf = slater_jastrow(mol, mf)
+    rng = np.random.default_rng(3)
+    for k in ["wf2acoeff", "wf2bcoeff"]:
+        wf.parameters[k] = 0.1 * rng.standard_normal(wf.parameters[k].shape)
+    pgrad = gradient_generator(mol, wf, to_opt=["wf2acoeff", "wf2bcoeff"])
+    lm_acc = LinearMethodTransform(pgrad.enacc, pgrad.transform, delta=1e-6)
+    configs = initial_guess(mol, 20)
+    wf.recompute(configs)
+    analytic = lm_acc.energy_derivatives(configs, wf)
+    fd = lm_acc.finite_difference_derivatives(configs, wf)
+    nparam = len(pgrad.transform.serialize_parameters(wf.parameters))
+    assert analytic.shape == fd.shape == (20, nparam)
+    assert np.allclose(analytic, fd, atol=1e-4 * (1 + np.abs(fd).max()))
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,74 @@
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+import numpy as np
+
+
+def test_minimize_variance():
+    """ Optimize the Jastrow factor of He and check that the cost decreases """
+    from pyscf import gto, scf
+    import pyqmc
+    from pyqmc.accumulators import EnergyAccumulator
+
+    mol = gto.M(atom="He 0. 0. 0.", basis="ccpvdz", unit="bohr", verbose=0)
+    mf = scf.RHF(mol).run()
+    wf = pyqmc.slater_jastrow(mol, mf)
+    enacc = EnergyAccumulator(mol)
+    configs = pyqmc.initial_guess(mol, 500)
+    df, configs = pyqmc.vmc(wf, configs, nsteps=20)
+    params = ["wf2acoeff", "wf2bcoeff"]
+
+    for cost in ["variance", "mad"]:
+        for k in params:
+            wf.parameters[k][...] = 0.0
+        wf.recompute(configs)
+        en = enacc(configs, wf)["total"]
+        start = np.var(en) if cost == "variance" else np.mean(np.abs(en - en.mean()))
+        opt, wf = pyqmc.minimize_variance(
+            enacc, wf, configs, params, cost=cost, maxiters=1, verbose=0
+        )
+        print(cost, start, opt)
+        assert opt < start
+
+
+def test_resample():
+    """ When the effective sample size falls below ess_min, new configurations are
+    sampled with vmc and the minimization continues on them """
+    from pyscf import gto, scf
+    import pyqmc
+    from pyqmc.accumulators import EnergyAccumulator
+
+    mol = gto.M(atom="He 0. 0. 0.", basis="ccpvdz", unit="bohr", verbose=0)
+    mf = scf.RHF(mol).run()
+    wf = pyqmc.slater_jastrow(mol, mf)
+    enacc = EnergyAccumulator(mol)
+    configs = pyqmc.initial_guess(mol, 200)
+    df, configs = pyqmc.vmc(wf, configs, nsteps=20)
+    params = ["wf2acoeff", "wf2bcoeff"]
+    sampled = []
+
+    def vmc(wf, configs, **kwargs):
+        sampled.append(wf.parameters["wf2bcoeff"].copy())
+        return pyqmc.vmc(wf, configs, **kwargs)
+
+    # any change of the parameters brings the effective sample size below 1
+    opt, wf = pyqmc.minimize_variance(
+        enacc,
+        wf,
+        configs,
+        params,
+        ess_min=1.0,
+        maxiters=3,
+        vmc=vmc,
+        vmcoptions={"nsteps": 5},
+    )
+    assert len(sampled) == 2
+    # the configurations are resampled with the parameters reached so far
+    assert not np.allclose(sampled[0], 0.0)
+    assert not np.allclose(sampled[1], sampled[0])
+
+
+if __name__ == "__main__":
+    test_minimize_variance()
@@ -0,0 +1,75 @@
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+import numpy as np
+import pytest
+
+pytest.importorskip("parsl")
+
+
+def test_pack_unpack(tmp_path):
+    """ Arrays and configs objects survive pack() and unpack(); large arrays go
+    through .npy files, which are removed once they are read back """
+    from pyqmc.coord import OpenConfigs, PeriodicConfigs
+    from pyqmc.parsltools import NpyFile, pack, unpack
+
+    big = np.random.randn(200, 10, 3)
+    small = np.arange(5.0)
+    periodic = PeriodicConfigs(np.random.rand(20, 4, 3), 2 * np.eye(3))
+    obj = ([{"energy": small, "dppsi": big}], OpenConfigs(big.copy()), periodic)
+
+    packed = pack(obj, str(tmp_path), threshold=2000)
+    assert isinstance(packed[0][0]["dppsi"], NpyFile)
+    assert isinstance(packed[0][0]["energy"], np.ndarray)
+    assert isinstance(packed[1].configs, NpyFile)
+    assert len(os.listdir(tmp_path)) == 2
+
+    data, configs, pconfigs = unpack(packed)
+    assert os.listdir(tmp_path) == []
+    assert np.array_equal(data[0]["dppsi"], big)
+    assert np.array_equal(data[0]["energy"], small)
+    assert isinstance(configs, OpenConfigs)
+    assert np.array_equal(configs.configs, big)
+    assert isinstance(pconfigs, PeriodicConfigs)
+    assert np.array_equal(pconfigs.configs, periodic.configs)
+    assert np.array_equal(pconfigs.wrap, periodic.wrap)
+
+
+def test_distvmc(tmp_path):
+    """ VMC runs through the parsl apps, the moved walkers come back from the
+    workers, and no files are left in npydir """
+    import parsl
+    from parsl.config import Config
+    from parsl.executors.threads import ThreadPoolExecutor
+    from pyscf import gto, scf
+    import pyqmc
+    from pyqmc.parsltools import distvmc
+
+    mol = gto.M(atom="H 0 0 0; H 0 0 1.4", basis="sto-3g", unit="bohr")
+    mf = scf.RHF(mol).run()
+    wf = pyqmc.slater_jastrow(mol, mf)
+    configs = pyqmc.initial_guess(mol, 20)
+    start = configs.configs.copy()
+    acc = {"energy": pyqmc.EnergyAccumulator(mol)}
+    npydir = tmp_path / "npy"
+    npydir.mkdir()
+
+    config = Config(
+        executors=[ThreadPoolExecutor(max_threads=2)],
+        run_dir=str(tmp_path / "runinfo"),
+    )
+    parsl.load(config)
+    try:
+        df, configs = distvmc(
+            wf, configs, accumulators=acc, nsteps=3, npartitions=2, npydir=str(npydir)
+        )
+    finally:
+        parsl.dfk().cleanup()
+        parsl.clear()
+    assert len(df) == 6
+    assert np.all(np.isfinite([d["energytotal"] for d in df]))
+    assert configs.configs.shape == start.shape
+    assert not np.allclose(configs.configs, start)
+    assert os.listdir(npydir) == []
@@ -0,0 +1,76 @@
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+import numpy as np
+import pandas as pd
+
+
+def test_reblock_missing():
+    """ Columns with missing values, as from accumulators evaluated every few steps,
+    are reblocked over their own samples without gaps """
+    from pyqmc.reblock import optimally_reblocked
+
+    np.random.seed(0)
+    interval = 3
+    data = pd.DataFrame({"a": np.random.randn(1024), "b": np.random.randn(1024)})
+    data.loc[1::interval, "b"] = np.nan
+    rb = optimally_reblocked(data)
+    rb_b = optimally_reblocked(data[["b"]].dropna())
+    assert np.allclose(rb.loc["b"].values, rb_b.loc["b"].values)
+    assert np.allclose(rb.loc["a"].values, optimally_reblocked(data[["a"]]).loc["a"])
+
+
+def test_equilibration_steps():
+    """A decaying transient is discarded, and most of the series is kept"""
+    from pyqmc.reblock import equilibration_steps
+
+    np.random.seed(0)
+    nsteps = 200
+    transient = 5 * np.exp(-np.arange(nsteps) / 10.0)
+    ncut = equilibration_steps(np.random.randn(nsteps) + transient)
+    assert 20 <= ncut <= nsteps // 2
+
+
+def test_streaming_blocker():
+    """Blocking one sample at a time gives the same optimal block and error as
+    reblocking the whole series"""
+    from pyqmc.reblock import StreamingBlocker, opt_block, reblock_by2
+
+    np.random.seed(0)
+    nsteps = 1500
+    data = pd.DataFrame(
+        {
+            "a": np.convolve(np.random.randn(nsteps), np.ones(16) / 10, "same"),
+            "b": np.convolve(np.random.randn(nsteps), np.ones(64) / 10, "same") - 50,
+        }
+    )
+    blocker = StreamingBlocker()
+    for row in data.values:
+        blocker.add(row)
+    assert len(blocker.n) <= np.log2(nsteps) + 1
+    summary = blocker.summary(data.columns)
+    assert np.allclose(summary["mean"], data.mean())
+    for c in data.columns:
+        nblock = int(opt_block(data[[c]])[0])
+        assert summary.loc[c, "reblocks"] == nblock
+        serr = reblock_by2(data[[c]], nblock).sem().values[0]
+        assert np.isclose(summary.loc[c, "standard error"], serr)
+
+
+def test_streaming_blocker_short():
+    """With fewer than two samples the errors are NaN at level 0"""
+    from pyqmc.reblock import StreamingBlocker
+
+    blocker = StreamingBlocker()
+    assert np.isnan(blocker.mean())
+    blocker.add([1.0, 2.0])
+    err, errerr = blocker.standard_error()
+    assert np.all(np.isnan(err)) and np.all(np.isnan(errerr))
+    assert np.array_equal(blocker.optimal_block(), [0, 0])
+    summary = blocker.summary(["a", "b"])
+    assert np.array_equal(summary["mean"], [1.0, 2.0])
+    assert summary["standard error"].isnull().all()
+    blocker.add([3.0, 2.0])
+    assert np.allclose(blocker.standard_error()[0], [1.0, 0.0])
@@ -75,6 +75,58 @@ def test_accumulator():
     assert df["energytotal"][29] == np.average(eaccum_energy["total"])
 
 
+def test_accumulator_interval():
+    """ Accumulators with an interval only produce entries on those steps."""
+    mol = gto.M(atom="H 0. 0. 0.; H 0. 0. 1.4", basis="sto-3g", unit="bohr")
+    mf = scf.RHF(mol).run()
+    wf = PySCFSlaterUHF(mol, mf)
+    coords = initial_guess(mol, 100)
+    nsteps, interval = 40, 3
+    df, coords = vmc(
+        wf,
+        coords,
+        nsteps=nsteps,
+        accumulators={
+            "energy": EnergyAccumulator(mol),
+            "sparse": (EnergyAccumulator(mol), interval),
+        },
+    )
+    df = pd.DataFrame(df)
+    assert df["energytotal"].notnull().all()
+    sampled = df["step"][df["sparsetotal"].notnull()]
+    assert np.all(sampled.values == np.arange(0, nsteps, interval))
+
+
+def test_rng():
+    """
+    Test that runs with the same generator are reproducible, and that partitions get
+    independent streams that are reproducible from the state of the generator.
+    """
+    mol = gto.M(atom="Li 0. 0. 0.; H 0. 0. 1.5", basis="sto-3g", unit="bohr")
+    mf = scf.RHF(mol).run()
+    wf = PySCFSlaterUHF(mol, mf)
+    acc = {"energy": EnergyAccumulator(mol)}
+
+    runs = []
+    for i in range(2):
+        coords = initial_guess(mol, 50, rng=np.random.default_rng(42))
+        df, coords = vmc(wf, coords, nsteps=5, accumulators=acc)
+        runs.append(pd.DataFrame(df)["energytotal"].values)
+    assert np.array_equal(runs[0], runs[1])
+
+    parts = coords.split(2)
+    assert parts[0].rng is not parts[1].rng
+    assert parts[0].rng.random() != parts[1].rng.random()
+
+    # the partition streams only depend on the saved state of the parent stream
+    from pyqmc.coord import get_rng_state, set_rng_state
+
+    state = get_rng_state(coords.rng)
+    first = [p.rng.random() for p in coords.split(2)]
+    set_rng_state(coords.rng, state)
+    assert [p.rng.random() for p in coords.split(2)] == first
+
+
 if __name__ == "__main__":
     test_vmc()
     test_accumulator()